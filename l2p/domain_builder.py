@@ -10,7 +10,6 @@ for how to structurally prompt LLMs so they are compatible with class function p
 """
 
 import re
-import time
 
 from collections import OrderedDict
 from typing import Any
@@ -92,7 +91,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 # parse LLM output into types
@@ -125,7 +123,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError("Max retries exceeded. Failed to extract types.")
 
@@ -167,7 +164,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 # extract respective types from response
@@ -210,7 +206,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError("Max retries exceeded. Failed to extract types.")
 
@@ -257,7 +252,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 # parse LLM output into constants
@@ -285,7 +279,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError("Max retries exceeded. Failed to extract constants.")
 
@@ -348,7 +341,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)  # prompt model
 
                 # extract new predicates from response
@@ -386,7 +378,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError("Max retries exceeded. Failed to extract predicates.")
 
@@ -449,7 +440,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 # extract functions from response
@@ -483,7 +473,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError("Max retries exceeded. Failed to extract functions.")
 
@@ -532,7 +521,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 # extract respective nl actions from response
@@ -546,7 +534,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError("Max retries exceeded. Failed to extract NL actions.")
 
@@ -627,7 +614,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 # parse LLM output into action and predicates
@@ -680,7 +666,6 @@ class DomainBuilder:
                     f"Error on attempt {attempt + 1}/{max_retries}: {e}\n"
                     f"LLM Output:\n{llm_output if 'llm_output' in locals() else 'None'}\nRetrying...\n"
                 )
-                time.sleep(2)
 
         raise RuntimeError("Max retries exceeded. Failed to extract PDDL action.")
 
@@ -752,7 +737,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
 
                 llm_output = model.query(prompt=prompt)
 
@@ -801,7 +785,6 @@ class DomainBuilder:
                     f"Error on attempt {attempt + 1}/{max_retries}: {e}\n"
                     f"LLM Output:\n{llm_output if 'llm_output' in locals() else 'None'}\nRetrying...\n"
                 )
-                time.sleep(2)
 
         raise RuntimeError("Max retries exceeded. Failed to extract PDDL action.")
 
@@ -849,7 +832,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)  # get BaseLLM response
 
                 # extract respective types from response
@@ -883,7 +865,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError("Max retries exceeded. Failed to extract parameters.")
 
@@ -959,7 +940,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)  # get BaseLLM response
 
                 # extract respective preconditions from response
@@ -1013,7 +993,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError("Max retries exceeded. Failed to extract preconditions.")
 
@@ -1092,7 +1071,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)  # get BaseLLM response
 
                 # extract respective effects from response
@@ -1137,7 +1115,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError("Max retries exceeded. Failed to extract effects.")
 
@@ -1181,7 +1158,6 @@ class DomainBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 if formalize_types:
@@ -1230,7 +1206,6 @@ class DomainBuilder:
                     f"Error encountered during attempt {attempt + 1}/{max_retries}: {e}. "
                     f"\nLLM Output: \n\n{llm_output if 'llm_output' in locals() else 'None'}\n\n Retrying..."
                 )
-                time.sleep(2)  # add a delay before retrying
 
         raise RuntimeError(
             "Max retries exceeded. Failed to extract domain specification."
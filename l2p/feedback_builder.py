@@ -35,7 +35,6 @@ class FeedbackBuilder:
         if feedback_type.lower() == "human":
             feedback_msg = self.human_feedback(llm_output)
         elif feedback_type.lower() == "llm":
-            model.reset_tokens()
             feedback_msg = model.query(prompt=feedback_template)
         else:
             raise ValueError("Invalid feedback_type. Expected 'human' or 'llm'")
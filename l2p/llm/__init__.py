@@ -2,3 +2,19 @@ from .base import *
 from .openai import *
 from .huggingface import *
 from .vllm import *
+from .llamacpp import *
+from .http_pool import *
+from .grammar import *
+from .chat_template import *
+from .registry import *
+from .loading import *
+from .cache import *
+from .coalesce import *
+from .rate_limit import *
+from .retry_policy import *
+from .tokens import *
+from .query_log import *
+from .usage import *
+from .metrics import *
+from .router import *
+from .hedging import *
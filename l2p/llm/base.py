@@ -3,10 +3,13 @@ This file contains code for calling LLMs and saving raw model outputs.
 Currently, this builder class contains the generic method to run a wide range of LLMs.
 """
 
-import logging, functools
+import asyncio, logging, functools
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
 from typing import Any
 import yaml
+from ..utils.pddl_parser import is_section_complete
+from .metrics import QueryTimer, metrics_registry
 
 LOG: logging.Logger = logging.getLogger(__name__)
 
@@ -48,6 +51,15 @@ def require_llm(func):
 
 
 class BaseLLM(ABC):
+    # model parameters that shape responses; providers replace them with the ones they send
+    sampling_parameter_names: tuple[str, ...] = (
+        "temperature",
+        "top_p",
+        "max_new_tokens",
+        "max_completion_tokens",
+        "stop",
+    )
+
     def __init__(self, model: str, api_key: str | None = None) -> None:
 
         if not self.valid_models():
@@ -75,6 +87,75 @@ class BaseLLM(ABC):
         """
         pass
 
+    async def aquery(self, prompt: str, **kwargs) -> str:
+        """
+        Asynchronously query an LLM with a given prompt and return the response. By default,
+        the blocking `query` is offloaded to a worker thread so the event loop is never blocked;
+        providers with a native asynchronous client should override this method.
+
+        Args:
+            prompt (str): The prompt to send to the LLM
+            **kwargs: provider-specific arguments forwarded to `query`
+        Returns:
+            str: The response from the LLM
+        """
+        return await asyncio.to_thread(self.query, prompt, **kwargs)
+
+    def query_batch(self, prompts: list[str], **kwargs) -> list[str]:
+        """
+        Query an LLM with a batch of prompts and return the responses in the same order.
+        By default, prompts are sent one after another; providers that can batch or fan out
+        requests natively should override this method.
+
+        Args:
+            prompts (list[str]): The prompts to send to the LLM
+            **kwargs: provider-specific arguments forwarded to `query`
+        Returns:
+            list[str]: The responses from the LLM, one per prompt
+        """
+        return [self.query(prompt, **kwargs) for prompt in prompts]
+
+    def query_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Query an LLM with a given prompt and yield the response in chunks as it is generated.
+        Consumers may stop iterating (or close the generator) at any point to cancel generation.
+        By default, the full response of `query` is yielded as a single chunk; providers that
+        support streaming should override this method.
+
+        Args:
+            prompt (str): The prompt to send to the LLM
+            **kwargs: provider-specific arguments forwarded to `query`
+        Yields:
+            str: The next chunk of the response from the LLM
+        """
+        yield self.query(prompt, **kwargs)
+
+    def query_sections(self, prompt: str, headings: list[str], **kwargs) -> str:
+        """
+        Query an LLM through `query_stream` and cancel generation as soon as every required
+        section (the `### <heading>` line and its fenced blocks) is complete, i.e. the next
+        `### ` heading has started. Saves the output tokens models spend on the sections
+        after the parsed ones.
+
+        Args:
+            prompt (str): The prompt to send to the LLM
+            headings (list[str]): headings the caller parses (i.e. ['OBJECTS', 'INITIAL', 'GOAL'])
+            **kwargs: provider-specific arguments forwarded to `query_stream`
+        Returns:
+            str: The (possibly truncated) response from the LLM
+        """
+        llm_output = ""
+        stream = self.query_stream(prompt, **kwargs)
+        try:
+            for chunk in stream:
+                llm_output += chunk
+                if all(is_section_complete(llm_output, h) for h in headings):
+                    break
+        finally:
+            stream.close()  # cancels generation if still running
+
+        return llm_output
+
     def query_with_system_prompt(self, system_prompt: str, prompt: str) -> str:
         """
         Abstract method to query an LLM with a given prompt and system prompt and return the response.
@@ -92,3 +173,56 @@ class BaseLLM(ABC):
         List of valid model parameters, e.g., 'gpt4o-mini' for GPT
         """
         return []
+
+    def sampling_parameters(self) -> dict[str, Any]:
+        """Return the sampling parameters sent with every query (i.e. temperature, stop)."""
+        return {
+            name: getattr(self, name, None) for name in self.sampling_parameter_names
+        }
+
+    def metric_labels(self) -> dict[str, str]:
+        """Labels of this model's query metrics (see `metrics.py`)."""
+        return {
+            "provider": str(getattr(self, "provider", type(self).__name__.lower())),
+            "engine": str(getattr(self, "model_engine", getattr(self, "model", None))),
+        }
+
+    def _query_timer(self) -> QueryTimer:
+        """Start timing a query of this model; used by the `measured` decorator."""
+        return QueryTimer(self.metric_labels(), owner=self)
+
+    def get_metrics(self) -> dict[str, list[dict]]:
+        """Return the latency, throughput and retry metrics recorded for this model."""
+        return metrics_registry.snapshot(self.metric_labels())
+
+
+class LLMWrapper(BaseLLM):
+    def __init__(self, llm: BaseLLM) -> None:
+        """
+        Base class for layers that wrap another BaseLLM (i.e. caching, request coalescing).
+        The wrapped model has already been validated, so `BaseLLM.__init__` is not re-run;
+        any attribute not defined on the wrapper (i.e. `get_tokens`, `reset_tokens`,
+        `model_engine`) is forwarded to the wrapped model.
+
+        Args:
+            llm (BaseLLM): the LLM instance to wrap
+        """
+        self.llm = llm
+
+    def __getattr__(self, name: str) -> Any:
+        # only invoked when normal attribute lookup fails
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def query(self, prompt: str, **kwargs) -> str:
+        """Forward the query to the wrapped LLM."""
+        return self.llm.query(prompt, **kwargs)
+
+    def valid_models(self) -> list[str]:
+        """Returns the valid models of the wrapped LLM."""
+        return self.llm.valid_models()
+
+    def sampling_parameters(self) -> dict[str, Any]:
+        """Returns the sampling parameters of the wrapped LLM."""
+        return self.llm.sampling_parameters()
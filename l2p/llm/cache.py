@@ -0,0 +1,362 @@
+"""
+This is a wrapper (CachedLLM) for any BaseLLM instance that stores model responses in a
+persistent, content-addressed cache. Responses are keyed on a hash of the model engine,
+every sampling parameter it sends (see `BaseLLM.sampling_parameters`), decoding grammar and
+the exact messages sent, so re-running an experiment never pays twice for an identical
+prompt.
+
+Cache storage is pluggable through `CacheBackend`. L2P provides:
+    1. MemoryCache - in-process LRU cache bounded by total size in bytes
+    2. SQLiteCache - single-file local database
+    3. DirectoryCache - sharded directory of JSON files (i.e. on a shared filesystem for multi-node runs)
+"""
+
+import hashlib, json, os, sqlite3, tempfile, threading, time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+from typing_extensions import override
+from .base import BaseLLM, LLMWrapper
+from .query_log import QueryLog
+
+
+def request_messages(prompt: str, **kwargs) -> list[dict[str, str]]:
+    """
+    Build the chat messages a provider sends for a query; `messages` (OPENAI) take
+    precedence over `system_prompt` (HUGGING_FACE, VLLM).
+    """
+    if kwargs.get("messages"):
+        return kwargs["messages"]
+
+    messages = []
+    if kwargs.get("system_prompt"):
+        messages.append({"role": "system", "content": kwargs["system_prompt"]})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def request_key(llm: BaseLLM, prompt: str, **kwargs) -> str:
+    """
+    Content-addressed key of a query: SHA-256 hash of the model engine, every sampling
+    parameter the provider sends, decoding grammar and exact messages that would be sent
+    to the model.
+
+    Args:
+        llm (BaseLLM): LLM instance the query is sent to
+        prompt (str): the prompt to send to the LLM
+        **kwargs: provider-specific query arguments (i.e. `messages`, `system_prompt`, `grammar`)
+
+    Returns:
+        key (str): hex digest identifying the request
+    """
+
+    # constrained and unconstrained responses to the same messages must not share an entry
+    grammar = kwargs.get("grammar") or getattr(llm, "grammar", None)
+
+    request = {
+        "engine": getattr(llm, "model_engine", getattr(llm, "model", None)),
+        "parameters": llm.sampling_parameters(),
+        "grammar": grammar.to_regex() if grammar is not None else None,
+        "messages": request_messages(prompt, **kwargs),
+    }
+    encoded = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Return the cached entry for `key`, or None if it is not stored."""
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: dict[str, Any]) -> None:
+        """Store a JSON-serializable entry under `key`."""
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove all cached entries."""
+        pass
+
+
+class MemoryCache(CacheBackend):
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        """
+        In-process LRU cache. Least recently used entries are evicted once the total
+        size of stored (serialized) entries exceeds `max_bytes`.
+
+        Args:
+            max_bytes (int): maximum total size of cached entries, defaults to 64 MiB
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sizeof(key: str, value: str) -> int:
+        return len(key) + len(value.encode("utf-8"))
+
+    @override
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(value)
+
+    @override
+    def set(self, key: str, value: dict[str, Any]) -> None:
+        value = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._sizeof(key, self._entries.pop(key))
+            self._entries[key] = value
+            self.size += self._sizeof(key, value)
+
+            # evict least recently used entries until under budget
+            while self.size > self.max_bytes and self._entries:
+                old_key, old_value = self._entries.popitem(last=False)
+                self.size -= self._sizeof(old_key, old_value)
+
+    @override
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache(CacheBackend):
+    def __init__(self, path: str) -> None:
+        """
+        Local single-file cache backed by SQLite.
+
+        Args:
+            path (str): path to the SQLite database file (created if it does not exist)
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    @override
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @override
+    def set(self, key: str, value: dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+
+    @override
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class DirectoryCache(CacheBackend):
+    def __init__(self, root: str, shard_depth: int = 2) -> None:
+        """
+        Cache stored as one JSON file per entry in a sharded directory tree
+        (i.e. `<root>/ab/cd/abcd....json`). Writes are atomic renames, so several
+        processes or nodes can share the same directory on a shared filesystem.
+
+        Args:
+            root (str): root directory of the cache
+            shard_depth (int): number of two-character directory levels, defaults to 2
+        """
+        self.root = root
+        self.shard_depth = shard_depth
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        shards = [key[2 * i : 2 * i + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, f"{key}.json")
+
+    @override
+    def get(self, key: str) -> dict[str, Any] | None:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    @override
+    def set(self, key: str, value: dict[str, Any]) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @override
+    def clear(self) -> None:
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".json"):
+                    os.remove(os.path.join(dirpath, filename))
+
+
+class CachedLLM(LLMWrapper):
+    def __init__(self, llm: BaseLLM, backend: CacheBackend | None = None) -> None:
+        """
+        Wraps a BaseLLM so identical queries are answered from cache. Cache hits are
+        recorded in `query_log` with zero tokens and zero cost, so `get_tokens` and cost
+        accounting of the wrapped model only reflect requests that were actually sent.
+
+        Args:
+            llm (BaseLLM): LLM instance to wrap
+            backend (CacheBackend): cache storage, defaults to an in-memory `MemoryCache`
+        """
+        super().__init__(llm)
+        self.backend = backend if backend is not None else MemoryCache()
+        # same in-memory bounds as the wrapped log; entries are not spilled a second time
+        llm_log = getattr(llm, "query_log", None)
+        self.query_log = QueryLog(
+            maxlen=getattr(llm_log, "maxlen", 1000),
+            retention=getattr(llm_log, "retention", "full"),
+        )
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _log_hit(self, prompt: str, llm_output: str, **kwargs) -> None:
+        self.query_log.append(
+            {
+                "model": getattr(self.llm, "model_engine", None),
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_tokens": 0,
+                "input_cost_usd": 0.0,
+                "output_cost_usd": 0.0,
+                "total_cost_usd": 0.0,
+                "messages": request_messages(prompt, **kwargs),
+                "output": llm_output,
+                "cache_hit": True,
+            }
+        )
+
+    @contextmanager
+    def _log_misses(self) -> Iterator[None]:
+        """Copy the entries the wrapped LLM logs for the calling query into this log."""
+        llm_log = getattr(self.llm, "query_log", None)
+        if not isinstance(llm_log, QueryLog):
+            yield
+            return
+
+        with llm_log.capture() as entries:
+            try:
+                yield
+            finally:
+                for entry in entries:
+                    self.query_log.append({**entry, "cache_hit": False})
+
+    def _store(self, key: str, llm_output: str) -> None:
+        self.backend.set(
+            key,
+            {
+                "model": getattr(self.llm, "model_engine", None),
+                "output": llm_output,
+                "created": time.time(),
+            },
+        )
+
+    @override
+    def query(self, prompt: str, **kwargs) -> str:
+        """Return the cached response for the query, or query the wrapped LLM and cache it."""
+
+        key = request_key(self.llm, prompt, **kwargs)
+        cached = self.backend.get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            self._log_hit(prompt, cached["output"], **kwargs)
+            return cached["output"]
+
+        with self._lock:
+            self.misses += 1
+        with self._log_misses():
+            llm_output = self.llm.query(prompt, **kwargs)
+        self._store(key, llm_output)
+        return llm_output
+
+    @override
+    def query_batch(self, prompts: list[str], **kwargs) -> list[str]:
+        """Answer cached prompts directly and send only the misses as one batch."""
+
+        keys = [request_key(self.llm, prompt, **kwargs) for prompt in prompts]
+        outputs = [None] * len(prompts)
+        misses = []
+
+        for i, key in enumerate(keys):
+            cached = self.backend.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                self._log_hit(prompts[i], cached["output"], **kwargs)
+                outputs[i] = cached["output"]
+            else:
+                misses.append(i)
+
+        if misses:
+            with self._lock:
+                self.misses += len(misses)
+            with self._log_misses():
+                llm_outputs = self.llm.query_batch(
+                    [prompts[i] for i in misses], **kwargs
+                )
+            for i, llm_output in zip(misses, llm_outputs):
+                self._store(keys[i], llm_output)
+                outputs[i] = llm_output
+
+        return outputs
+
+    def get_cache_stats(self) -> dict[str, int]:
+        """Return number of cache hits and misses."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def get_query_log(self) -> list:
+        """Retrieve query log, including cache hits."""
+        return list(self.query_log)
+
+    def reset_query_log(self) -> None:
+        """Reset query log of the cache and the wrapped LLM."""
+        self.query_log.clear()
+        if hasattr(self.llm, "reset_query_log"):
+            self.llm.reset_query_log()
@@ -0,0 +1,215 @@
+"""
+This file contains the prompt templating shared by local model providers (HUGGING_FACE,
+VLLM, LLAMA_CPP). A ChatTemplate is resolved once per model:
+    1. the tokenizer's native chat template (i.e. `tokenizer.chat_template`) when the
+       model ships one, otherwise
+    2. the first entry of `prompt_templates` whose key is part of the model engine name,
+       otherwise the prompt is used as is.
+
+Each system prompt is rendered once into the text before and after the user prompt, and
+the text before it is tokenized once, so a query only renders and tokenizes its own prompt.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable
+from .utils.prompt_template import prompt_templates
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are a PDDL coding assistant. Provide concise, correct code only."
+)
+
+# stands in for the user prompt when a template is rendered
+_MARKER = "\x00"
+
+# prompt beginnings used to check that tokenizing the prompt on its own gives the same
+# tokens as tokenizing it after the template prefix
+_PROBES = ("x", " x", "X", "(define", "\n", "### ")
+
+
+def find_template(model_engine: str) -> str | None:
+    """Return the first entry of `prompt_templates` whose key is part of `model_engine`."""
+    model_name = model_engine.lower()
+    for key, template in prompt_templates.items():
+        if key in model_name:
+            return template
+    return None
+
+
+class ChatTemplate:
+    def __init__(
+        self,
+        model_engine: str,
+        apply_chat_template: Callable[[list[dict]], str] | None = None,
+        tokenize: Callable[[str, bool], list[int]] | None = None,
+        bos_token: str | None = None,
+        cache_size: int = 16,
+    ) -> None:
+        """
+        Prompt template of a model, with the rendered and tokenized text around the user
+        prompt cached per system prompt.
+
+        Args:
+            model_engine (str): model name, used to find a template in `prompt_templates`
+            apply_chat_template (Callable): renders chat messages with the model's native chat template (including the generation prompt), defaults to None
+            tokenize (Callable): tokenizes text, with or without special tokens (i.e. BOS), defaults to None
+            bos_token (str): text of the BOS token, so it is not added twice when templates already contain it, defaults to None
+            cache_size (int): # of system prompts whose prefix is cached, defaults to 16
+        """
+        self.model_engine = model_engine
+        self._apply_chat_template = apply_chat_template
+        self._tokenize = tokenize
+        self.bos_token = bos_token
+        self.cache_size = cache_size
+
+        self.template = find_template(model_engine)
+        self.native = False
+        if apply_chat_template is not None:
+            try:
+                self.native = _MARKER in self._render_native(DEFAULT_SYSTEM_PROMPT)
+            except Exception as e:
+                print(f"[WARNING] Chat template of {model_engine} failed: {e}")
+
+        # system prompt -> (text before prompt, text after prompt, prefix ids or None)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_tokenizer(cls, model_engine: str, tokenizer, **kwargs) -> "ChatTemplate":
+        """
+        Build the template of a model from its HuggingFace tokenizer (also used by vLLM),
+        using the tokenizer's chat template if it has one.
+
+        Args:
+            model_engine (str): model name, used to find a template in `prompt_templates`
+            tokenizer: HuggingFace tokenizer of the model
+            **kwargs: other arguments of ChatTemplate
+
+        Returns:
+            template (ChatTemplate): template of the model
+        """
+        apply_chat_template = None
+        if getattr(tokenizer, "chat_template", None):
+            apply_chat_template = lambda messages: tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+
+        return cls(
+            model_engine,
+            apply_chat_template=apply_chat_template,
+            tokenize=lambda text, special: tokenizer(
+                text, add_special_tokens=special
+            ).input_ids,
+            bos_token=tokenizer.bos_token,
+            **kwargs,
+        )
+
+    def _render_native(self, system_prompt: str) -> str:
+        try:
+            return self._apply_chat_template(
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": _MARKER},
+                ]
+            )
+        except Exception:
+            # some templates (i.e. Gemma, Mistral) do not accept a system message
+            return self._apply_chat_template(
+                [{"role": "user", "content": f"{system_prompt}\n\n{_MARKER}"}]
+            )
+
+    def _render(self, system_prompt: str) -> tuple[str, str]:
+        """Render the template around the marker and split it there."""
+
+        if self.native:
+            before, _, after = self._render_native(system_prompt).partition(_MARKER)
+            return before, after
+
+        if self.template is None:
+            return "", ""
+
+        before, _, after = self.template.format(
+            system_prompt=system_prompt, prompt=_MARKER
+        ).partition(_MARKER)
+        return before.lstrip(), after.rstrip()
+
+    def _add_special_tokens(self, before: str) -> bool:
+        """False if the template itself starts with the BOS token."""
+        return not (self.bos_token and before.startswith(self.bos_token))
+
+    def _prefix_ids(self, before: str) -> list[int] | None:
+        """
+        Tokens of the text before the prompt, if prefix tokens + prompt tokens always equal
+        the tokens of the full text (checked with a few probe prompts), otherwise None.
+        """
+
+        if self._tokenize is None or not before:
+            return None
+
+        special = self._add_special_tokens(before)
+        prefix_ids = self._tokenize(before, special)
+        for probe in _PROBES:
+            expected = self._tokenize(before + probe, special)
+            if expected != prefix_ids + self._tokenize(probe, False):
+                return None
+        return prefix_ids
+
+    def _split(self, system_prompt: str | None) -> tuple[str, str, list[int] | None]:
+        system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
+        with self._lock:
+            split = self._cache.get(system_prompt)
+            if split is not None:
+                self._cache.move_to_end(system_prompt)
+                return split
+
+        before, after = self._render(system_prompt)
+        split = (before, after, self._prefix_ids(before))
+
+        with self._lock:
+            self._cache[system_prompt] = split
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return split
+
+    def render(self, system_prompt: str | None, prompt: str) -> str:
+        """
+        Build the full prompt.
+
+        Args:
+            system_prompt (str): system prompt, defaults to DEFAULT_SYSTEM_PROMPT if None
+            prompt (str): user prompt
+
+        Returns:
+            full_prompt (str): prompt in the model's template
+        """
+        before, after, _ = self._split(system_prompt)
+        return before + prompt + after
+
+    def encode(
+        self, system_prompt: str | None, prompt: str, complete: bool = True
+    ) -> tuple[str, list[int]]:
+        """
+        Build and tokenize the full prompt, reusing the cached tokens of the template prefix.
+
+        Args:
+            system_prompt (str): system prompt, defaults to DEFAULT_SYSTEM_PROMPT if None
+            prompt (str): user prompt
+            complete (bool): include the template text after the prompt, defaults to True
+
+        Returns:
+            full_prompt (str): prompt in the model's template
+            input_ids (list[int]): tokens of the full prompt
+        """
+        if self._tokenize is None:
+            raise RuntimeError("ChatTemplate.encode requires a tokenizer.")
+
+        before, after, prefix_ids = self._split(system_prompt)
+        text = prompt + after if complete else prompt
+
+        if prefix_ids is not None:
+            return before + text, prefix_ids + self._tokenize(text, False)
+
+        full_prompt = before + text
+        return full_prompt, self._tokenize(
+            full_prompt, self._add_special_tokens(full_prompt)
+        )
@@ -0,0 +1,109 @@
+"""
+This is a wrapper (CoalescingLLM) for any BaseLLM instance that coalesces identical
+in-flight queries ("single-flight"). When several threads (or coroutines) send the same
+deterministic query at once, only the first one is sent to the wrapped model and every
+caller receives its result.
+
+Only deterministic queries (temperature 0, no sampling) are coalesced, since sampled
+queries are expected to return different responses.
+"""
+
+import asyncio, threading
+from typing_extensions import override
+from .base import BaseLLM, LLMWrapper
+from .cache import request_key
+
+
+class _Flight:
+    """A query in flight that other callers can wait on."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: str | None = None
+        self.error: BaseException | None = None
+
+
+class CoalescingLLM(LLMWrapper):
+    def __init__(self, llm: BaseLLM) -> None:
+        """
+        Wraps a BaseLLM so identical concurrent deterministic queries share one upstream call.
+
+        Args:
+            llm (BaseLLM): LLM instance to wrap
+        """
+        super().__init__(llm)
+        self.upstream_calls = 0
+        self.suppressed = 0
+        self._flights: dict[str, _Flight] = {}
+        self._async_flights: dict[tuple[int, str], asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def _is_deterministic(self) -> bool:
+        return getattr(self.llm, "temperature", 0) == 0 and not getattr(
+            self.llm, "do_sample", False
+        )
+
+    @override
+    def query(self, prompt: str, **kwargs) -> str:
+        """Query the wrapped LLM, or wait for an identical query that is already in flight."""
+
+        if not self._is_deterministic():
+            with self._lock:
+                self.upstream_calls += 1
+            return self.llm.query(prompt, **kwargs)
+
+        key = request_key(self.llm, prompt, **kwargs)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.upstream_calls += 1
+            else:
+                self.suppressed += 1
+
+        # followers wait for the leader's result (or error)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self.llm.query(prompt, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    @override
+    async def aquery(self, prompt: str, **kwargs) -> str:
+        """Asynchronously query the wrapped LLM, sharing identical in-flight coroutines."""
+
+        if not self._is_deterministic():
+            with self._lock:
+                self.upstream_calls += 1
+            return await self.llm.aquery(prompt, **kwargs)
+
+        # tasks are bound to their event loop, so flights are kept per loop
+        key = (id(asyncio.get_running_loop()), request_key(self.llm, prompt, **kwargs))
+        with self._lock:
+            task = self._async_flights.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self.llm.aquery(prompt, **kwargs))
+                task.add_done_callback(lambda _: self._async_flights.pop(key, None))
+                self._async_flights[key] = task
+                self.upstream_calls += 1
+            else:
+                self.suppressed += 1
+
+        # shield so one cancelled caller does not cancel the shared request
+        return await asyncio.shield(task)
+
+    def get_coalescing_stats(self) -> dict[str, int]:
+        """Return number of upstream calls made and duplicate calls suppressed."""
+        return {"upstream_calls": self.upstream_calls, "suppressed": self.suppressed}
@@ -0,0 +1,310 @@
+"""
+This file contains a grammar for the L2P output format (a '### heading' line followed by a
+``` fenced block of PDDL, for each requested heading) and its use for constrained decoding
+with local models:
+    1. SectionGrammar - character-level state machine of the format, which also exports an
+       equivalent regular expression for guided decoding in vLLM
+    2. GrammarLogitsProcessor - `generate` logits processor for HUGGING_FACE that masks
+       every token that would make the response violate the grammar
+
+A constrained response always contains each heading in order, followed by a fenced block
+with balanced parentheses, so it can be parsed without retries (as long as the model is
+given enough `max_new_tokens` to finish).
+"""
+
+import re
+
+# state: (mode, section index, position in literal / line start, paren depth, in comment)
+State = tuple[str, int, int, int, bool]
+
+
+class SectionGrammar:
+    def __init__(
+        self,
+        headings: list[str],
+        allow_preamble: bool = True,
+        max_preamble: int = 2000,
+        max_depth: int = 8,
+    ) -> None:
+        """
+        Grammar of a response made of the given headings (in order), each followed by a
+        fenced block whose parentheses are balanced. ';' comments are ignored.
+
+        Args:
+            headings (list[str]): section headings without '### ' (i.e. 'Action Parameters')
+            allow_preamble (bool): allow free text (i.e. reasoning) before and between sections, defaults to True
+            max_preamble (int): max # of characters of free text before each section, defaults to 2000
+            max_depth (int): max parenthesis nesting depth, defaults to 8
+        """
+        if not headings:
+            raise ValueError("SectionGrammar requires at least one heading.")
+
+        self.headings = list(headings)
+        self.allow_preamble = allow_preamble
+        self.max_preamble = max_preamble
+        self.max_depth = max_depth
+        self._literals = [f"### {heading}\n" for heading in self.headings]
+
+    def start(self) -> State:
+        """Initial state, before the first section."""
+        return ("free", 0, 1, 0, False)
+
+    def is_complete(self, state: State) -> bool:
+        """True if every section has been generated (the response may end)."""
+        return state[0] == "done"
+
+    def step(self, state: State, text: str) -> State | None:
+        """
+        Advance the state over `text`.
+
+        Args:
+            state (State): current state
+            text (str): text appended to the response
+
+        Returns:
+            state (State | None): new state, or None if `text` violates the grammar
+        """
+        for char in text:
+            state = self._step_char(state, char)
+            if state is None:
+                return None
+        return state
+
+    def _step_char(self, state: State, char: str) -> State | None:
+        mode, section, pos, depth, comment = state
+
+        if mode == "free":
+            # `pos` is 1 at the start of a line, `depth` counts the characters of the gap
+            if pos and char == "#":
+                return ("head", section, 1, 0, False)
+            if char == "`":
+                return None
+            if self.allow_preamble:
+                # once the gap is too long, only the end of the line (then '#') is allowed
+                if depth >= self.max_preamble and (pos or char != "\n"):
+                    return None
+            elif char != "\n" or depth >= 3:
+                return None
+            return ("free", section, int(char == "\n"), depth + 1, False)
+
+        if mode == "head":
+            literal = self._literals[section]
+            if char != literal[pos]:
+                return None
+            if pos + 1 == len(literal):
+                return ("open", section, 0, 0, False)
+            return ("head", section, pos + 1, 0, False)
+
+        if mode == "open":
+            # up to two blank lines are allowed between the heading and the fence
+            if pos == 0 and char == "\n" and depth < 2:
+                return ("open", section, 0, depth + 1, False)
+            if pos < 3 and char == "`":
+                return ("open", section, pos + 1, 0, False)
+            if pos == 3 and char == "\n":
+                return ("body", section, 1, 0, False)
+            return None
+
+        if mode == "body":
+            line_start = bool(pos)
+            if comment:
+                return ("body", section, int(char == "\n"), depth, char != "\n")
+            if char == "\n":
+                return ("body", section, 1, depth, False)
+            if char == "`":
+                # the fence closes the block, only at the start of a line at depth 0
+                if line_start and depth == 0:
+                    return ("close", section, 1, 0, False)
+                return None
+            if char == "#" and line_start and depth == 0:
+                return None
+            if char == ";":
+                return ("body", section, 0, depth, True)
+            if char == "(":
+                if depth >= self.max_depth:
+                    return None
+                return ("body", section, 0, depth + 1, False)
+            if char == ")":
+                if depth == 0:
+                    return None
+                return ("body", section, 0, depth - 1, False)
+            return ("body", section, 0, depth, False)
+
+        if mode == "close":
+            if char != "`":
+                return None
+            if pos + 1 < 3:
+                return ("close", section, pos + 1, 0, False)
+            if section + 1 < len(self.headings):
+                return ("free", section + 1, 0, 0, False)
+            return ("done", section, 0, 0, False)
+
+        # done: only trailing whitespace
+        return state if char in " \n" else None
+
+    def fallback(self, state: State) -> str:
+        """Shortest text that is always valid from `state` and moves it towards completion."""
+        mode, section, pos, depth, comment = state
+
+        if mode == "free":
+            return self._literals[section] if pos else "\n"
+        if mode == "head":
+            return self._literals[section][pos:]
+        if mode == "open":
+            return "`" * (3 - pos) + "\n" if pos < 3 else "\n"
+        if mode == "body":
+            if comment or (depth == 0 and not pos):
+                return "\n"
+            return ")" if depth else "```"
+        if mode == "close":
+            return "`" * (3 - pos)
+        return ""
+
+    def completion(self, state: State) -> str:
+        """Shortest text that completes the response from `state`."""
+        text = ""
+        while not self.is_complete(state):
+            fallback = self.fallback(state)
+            state = self.step(state, fallback)
+            text += fallback
+        return text
+
+    def to_regex(self) -> str:
+        """
+        Regular expression accepting the same responses (for guided decoding in vLLM).
+        Parentheses are balanced up to `max_depth` levels of nesting; the length of free
+        text is left to the request's `max_tokens`.
+        """
+        comment = r";[^\n]*"
+
+        # parenthesized groups may span several lines
+        group = rf"\((?:[^()`;]|{comment})*\)"
+        for _ in range(self.max_depth - 1):
+            group = rf"\((?:[^()`;]|{comment}|{group})*\)"
+
+        item = rf"(?:[^()`;\n]|{comment}|{group})"
+        line = rf"(?:(?:[^#()`;\n]|{comment}|{group}){item}*)?\n"
+        body = rf"(?:{line})*"
+
+        # text between sections ends with a newline, so headings start a line
+        if self.allow_preamble:
+            free = r"(?:(?:[^#`\n][^`\n]*)?\n)*"
+            after_fence = r"[^`\n]*\n" + free
+        else:
+            free = r"\n{0,3}"
+            after_fence = r"\n{1,3}"
+
+        sections = [
+            rf"{free if i == 0 else after_fence}### {re.escape(heading)}\n\n{{0,2}}```\n{body}```"
+            for i, heading in enumerate(self.headings)
+        ]
+        return "".join(sections) + r"[ \n]*"
+
+
+class GrammarLogitsProcessor:
+    def __init__(
+        self,
+        grammar: SectionGrammar,
+        tokenizer,
+        prompt_length: int,
+        max_new_tokens: int | None = None,
+        top_k: int = 32,
+    ) -> None:
+        """
+        Logits processor for HUGGING_FACE `generate` that only allows tokens keeping the
+        response valid under `grammar`. The `top_k` highest scoring tokens are checked at
+        each step; if none is valid, the grammar's fallback text is forced. The fallback is
+        also forced once the remaining tokens are just enough to complete the response.
+
+        Args:
+            grammar (SectionGrammar): grammar of the response
+            tokenizer: tokenizer of the model
+            prompt_length (int): # of (padded) prompt tokens in `input_ids`
+            max_new_tokens (int): token budget of the response, defaults to None (unbounded)
+            top_k (int): # of candidate tokens checked per step, defaults to 32
+        """
+        self.grammar = grammar
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+        self.top_k = top_k
+        self.eos_token_id = tokenizer.eos_token_id
+
+        self._states: list[State | None] = []
+        self._seen = prompt_length
+        self._texts: dict[int, str] = {}
+
+        # single tokens are decoded after an anchor token, so tokenizers that drop a
+        # leading space at the start of a sequence (i.e. SentencePiece) decode correctly
+        self._anchor = tokenizer.encode("\n", add_special_tokens=False)[-1:]
+        self._anchor_text = tokenizer.decode(self._anchor)
+
+    def _token_text(self, token_id: int) -> str:
+        text = self._texts.get(token_id)
+        if text is None:
+            if token_id == self.eos_token_id:
+                text = ""
+            else:
+                text = self.tokenizer.decode(self._anchor + [token_id])
+                text = text[len(self._anchor_text) :]
+            self._texts[token_id] = text
+        return text
+
+    def _fallback_token(self, state: State) -> int:
+        text = self.grammar.fallback(state)
+        if not text:
+            return self.eos_token_id
+
+        for candidate in (text, text[0]):
+            ids = self.tokenizer.encode(candidate, add_special_tokens=False)
+            if ids and self.grammar.step(state, self._token_text(ids[0])) is not None:
+                return ids[0]
+        raise RuntimeError(f"No token can continue the grammar with {text!r}.")
+
+    def __call__(self, input_ids, scores):
+        if not self._states:
+            self._states = [self.grammar.start() for _ in range(input_ids.shape[0])]
+
+        # advance each row over the tokens chosen since the last call
+        for row, state in enumerate(self._states):
+            for token_id in input_ids[row, self._seen :].tolist():
+                if state is not None and not self.grammar.is_complete(state):
+                    state = self.grammar.step(state, self._token_text(token_id))
+            self._states[row] = state
+        self._seen = input_ids.shape[1]
+
+        masked = scores.new_full(scores.shape, float("-inf"))
+        candidates = scores.topk(min(self.top_k, scores.shape[1]), dim=-1).indices
+
+        for row, state in enumerate(self._states):
+            if state is None:
+                masked[row] = scores[row]
+                continue
+            if self.grammar.is_complete(state):
+                masked[row, self.eos_token_id] = 0.0
+                continue
+
+            # every token decodes to at least one character, so the completion needs
+            # at most len(completion) tokens
+            remaining = None
+            if self.max_new_tokens is not None:
+                remaining = self.max_new_tokens - (self._seen - self.prompt_length)
+            if remaining is not None and remaining <= len(
+                self.grammar.completion(state)
+            ):
+                allowed = [self._fallback_token(state)]
+                masked[row, allowed] = scores[row, allowed]
+                continue
+
+            allowed = [
+                token_id
+                for token_id in candidates[row].tolist()
+                if token_id != self.eos_token_id
+                and self._token_text(token_id)
+                and self.grammar.step(state, self._token_text(token_id)) is not None
+            ]
+            if not allowed:
+                allowed = [self._fallback_token(state)]
+            masked[row, allowed] = scores[row, allowed]
+
+        return masked
@@ -0,0 +1,194 @@
+"""
+This file contains request hedging for OpenAI-compatible providers (OPENAI, VLLMServer).
+When a request has not completed after a percentile (i.e. p95) of recent request latency,
+a duplicate is sent to the same or an alternate endpoint. The first response wins and the
+other request is cancelled by closing its connection. Both requests are recorded in the
+provider's usage and query log, and hedges are counted in `metrics_registry`.
+
+Hedging is configured per model in 'l2p/llm/utils/llm.yaml':
+    hedging:
+      percentile: 0.95     # hedge requests slower than this percentile of recent latency
+      min_delay: 1.0       # never hedge before this many seconds
+      min_samples: 20      # recent requests needed before hedging starts
+      base_url: null       # alternate endpoint for the duplicate (default: same endpoint)
+"""
+
+import queue, threading, time
+from typing import Any, Callable
+from .metrics import Histogram, metrics_registry
+from .usage import in_context
+
+
+class HedgeAttempt:
+    def __init__(self, index: int) -> None:
+        """
+        One of the requests sent for a hedged call. Request functions register callbacks
+        with `on_cancel` that abort the request (i.e. close its connection).
+
+        Args:
+            index (int): 0 for the original request, 1 or more for duplicates
+        """
+        self.index = index
+        self.cancelled = threading.Event()
+        self._callbacks: list[Callable[[], Any]] = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, callback: Callable[[], Any]) -> None:
+        """Call `callback` when the attempt is cancelled (right away if it already is)."""
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self) -> None:
+        """Cancel the attempt; callbacks run on a separate thread so the winner returns at once."""
+        with self._lock:
+            if self.cancelled.is_set():
+                return
+            self.cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        def run() -> None:
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception:
+                    pass
+
+        if callbacks:
+            threading.Thread(target=run, daemon=True).start()
+
+
+class HedgePolicy:
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        min_delay: float = 1.0,
+        max_delay: float | None = None,
+        min_samples: int = 20,
+        max_hedges: int = 1,
+        base_url: str | None = None,
+        window: int = 256,
+    ) -> None:
+        """
+        Initializes a hedging policy.
+
+        Args:
+            percentile (float): percentile (0 to 1) of recent latency after which a request is duplicated, defaults to 0.95
+            min_delay (float): lower bound of the hedging delay in seconds, defaults to 1.0
+            max_delay (float): upper bound of the hedging delay in seconds, defaults to None
+            min_samples (int): # of completed requests needed before hedging starts, defaults to 20
+            max_hedges (int): max # of duplicates per request, defaults to 1
+            base_url (str): alternate endpoint duplicates are sent to, defaults to None (same endpoint)
+            window (int): # of recent latencies the percentile is computed over, defaults to 256
+        """
+        if not 0 < percentile <= 1:
+            raise ValueError("percentile must be in (0, 1].")
+
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.base_url = base_url
+
+        self.latency = Histogram(window=window)
+        self.hedges = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: "HedgePolicy | dict | None") -> "HedgePolicy | None":
+        """Build a policy from the `hedging` entry of a model configuration (None: no hedging)."""
+        if config is None or isinstance(config, HedgePolicy):
+            return config
+        return cls(**config)
+
+    def delay(self) -> float | None:
+        """Seconds to wait before sending a duplicate, or None until enough requests completed."""
+        if self.latency.count < self.min_samples:
+            return None
+        delay = max(self.min_delay, self.latency.percentile(self.percentile) or 0.0)
+        return min(delay, self.max_delay) if self.max_delay is not None else delay
+
+    def call(
+        self,
+        requests: list[Callable[[HedgeAttempt], Any]],
+        labels: dict | None = None,
+        unhedged: Callable[[], Any] | None = None,
+    ) -> Any:
+        """
+        Send a request, hedging it if it is slow. Latency is measured from the first
+        request, so a slow request won by its duplicate still counts as slow.
+
+        Args:
+            requests (list[Callable]): functions sending the request to each endpoint; attempt `i` uses `requests[min(i, len(requests) - 1)]`
+            labels (dict): labels of the hedging metrics (i.e. provider and engine), defaults to None
+            unhedged (Callable): function sending the request when no duplicate can be sent (i.e. without streaming), defaults to None (`requests[0]`)
+
+        Returns:
+            result (Any): result of the first attempt to succeed; if all fail, the first error is raised
+        """
+        delay = self.delay()
+        started = time.perf_counter()
+        if delay is None or self.max_hedges < 1:
+            if unhedged is not None:
+                result = unhedged()
+            else:
+                result = requests[0](HedgeAttempt(0))
+            self.latency.observe(time.perf_counter() - started)
+            return result
+
+        done: queue.Queue = queue.Queue()
+        attempts: list[HedgeAttempt] = []
+
+        def launch() -> None:
+            attempt = HedgeAttempt(len(attempts))
+            request = requests[min(attempt.index, len(requests) - 1)]
+
+            def run() -> None:
+                try:
+                    done.put((attempt, request(attempt), None))
+                except BaseException as e:
+                    done.put((attempt, None, e))
+
+            attempts.append(attempt)
+            # attempts record usage, waits and tokens in the caller's scopes and timer
+            threading.Thread(target=in_context(run), daemon=True).start()
+
+        launch()
+        pending, errors = 1, []
+        while True:
+            can_hedge = len(attempts) <= self.max_hedges and not errors
+            try:
+                attempt, result, error = done.get(timeout=delay if can_hedge else None)
+            except queue.Empty:
+                with self._lock:
+                    self.hedges += 1
+                metrics_registry.counter("l2p_llm_hedges_total", labels).inc()
+                print(f"[INFO] no response after {delay:.2f}s, hedging request...")
+                launch()
+                pending += 1
+                continue
+
+            pending -= 1
+            if error is None and not attempt.cancelled.is_set():
+                for other in attempts:
+                    if other is not attempt:
+                        other.cancel()
+                # latency seen by the caller, so the percentile keeps slow requests
+                self.latency.observe(time.perf_counter() - started)
+                if attempt.index:
+                    with self._lock:
+                        self.wins += 1
+                    metrics_registry.counter("l2p_llm_hedge_wins_total", labels).inc()
+                return result
+
+            errors.append(error)
+            if pending == 0:
+                raise next(e for e in errors if e is not None)
+
+    def stats(self) -> dict:
+        """Return the # of hedged requests, hedges that won and the current delay."""
+        return {"hedges": self.hedges, "wins": self.wins, "delay_s": self.delay()}
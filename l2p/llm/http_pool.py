@@ -0,0 +1,231 @@
+"""
+This file contains a small keep-alive HTTP connection pool for LLM servers that expose an
+OpenAI-compatible REST API (i.e. `vllm serve`). It only depends on the standard library.
+
+Pools are shared process-wide per server URL (see `get_connection_pool`), so every provider
+instance and worker thread talking to the same server reuses the same open connections
+instead of paying a TCP (and TLS) handshake per request.
+"""
+
+import http.client, json, queue, socket, threading, time
+from collections.abc import Iterator
+from typing import Any, Callable
+from urllib.parse import urlsplit
+from .metrics import record_wait
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status_code: int, message: str, response: Any = None) -> None:
+        """
+        Error raised for non-2xx responses. `status_code` and `response.headers` are
+        read by `RetryPolicy` to classify the error and honor `Retry-After`.
+
+        Args:
+            status_code (int): HTTP status code of the response
+            message (str): response body or error message
+            response (http.client.HTTPResponse): the response, defaults to None
+        """
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.response = response
+
+
+class ConnectionPool:
+    def __init__(
+        self, base_url: str, maxsize: int = 16, timeout: float = 600.0
+    ) -> None:
+        """
+        Thread-safe pool of persistent HTTP/1.1 connections to a single server.
+
+        Args:
+            base_url (str): server URL, including the API prefix (i.e. 'http://localhost:8000/v1')
+            maxsize (int): max # of concurrently open connections, defaults to 16
+            timeout (float): socket timeout in seconds, defaults to 600.0
+        """
+        url = urlsplit(base_url)
+        if url.scheme not in ("http", "https") or not url.hostname:
+            raise ValueError(f"Invalid server URL: '{base_url}'.")
+
+        self.base_url = base_url
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.prefix = url.path.rstrip("/")
+        self.maxsize = maxsize
+        self.timeout = timeout
+
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self.connections_opened = 0
+        self._lock = threading.Lock()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        with self._lock:
+            self.connections_opened += 1
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        """Take a connection slot; returns the connection and whether it was reused."""
+        started = time.perf_counter()
+        self._slots.acquire()
+        record_wait(time.perf_counter() - started)
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def _release(self, conn: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable:
+            self._idle.put(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def _send(
+        self, method: str, path: str, body: dict | None, headers: dict
+    ) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """Send a request on a pooled connection, reconnecting once if the server closed it."""
+
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json", **headers}
+
+        conn, reused = self._acquire()
+        while True:
+            try:
+                conn.request(method, self.prefix + path, body=payload, headers=headers)
+                return conn, conn.getresponse()
+            except (
+                http.client.RemoteDisconnected,
+                ConnectionResetError,
+                BrokenPipeError,
+            ):
+                conn.close()
+                # idle keep-alive connections may have been closed by the server
+                if not reused:
+                    self._slots.release()
+                    raise
+                conn, reused = self._new_connection(), False
+            except BaseException:
+                self._release(conn, reusable=False)
+                raise
+
+    @staticmethod
+    def _check_status(response: http.client.HTTPResponse) -> None:
+        if response.status >= 400:
+            message = response.read().decode("utf-8", errors="replace")
+            raise HTTPStatusError(response.status, message, response)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: dict | None = None,
+        headers: dict | None = None,
+    ) -> dict:
+        """
+        Send a JSON request and return the decoded JSON response.
+
+        Args:
+            method (str): HTTP method (i.e. 'POST')
+            path (str): path relative to the base URL (i.e. '/completions')
+            body (dict): JSON request body, defaults to None
+            headers (dict): extra request headers, defaults to None
+
+        Returns:
+            response (dict): decoded JSON response body
+        """
+        conn, response = self._send(method, path, body, headers or {})
+        try:
+            self._check_status(response)
+            data = response.read()
+        except BaseException:
+            self._release(conn, reusable=False)
+            raise
+        self._release(conn, reusable=not response.will_close)
+        return json.loads(data)
+
+    def stream(
+        self,
+        method: str,
+        path: str,
+        body: dict | None = None,
+        headers: dict | None = None,
+        on_open: Callable[[Callable[[], None]], Any] | None = None,
+    ) -> Iterator[dict]:
+        """
+        Send a JSON request and yield the events of a server-sent event (SSE) response.
+        The connection is returned to the pool only if the stream was fully consumed.
+
+        `on_open`, if given, receives a function that aborts the stream from another
+        thread (i.e. to cancel a hedged request) by shutting down its connection.
+        """
+        conn, response = self._send(method, path, body, headers or {})
+        if on_open is not None:
+            on_open(lambda: self._abort(conn))
+        completed = False
+        try:
+            self._check_status(response)
+            for line in response:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                yield json.loads(data)
+            # drain the remaining body so the connection can be reused
+            response.read()
+            completed = True
+        finally:
+            self._release(conn, reusable=completed and not response.will_close)
+
+    @staticmethod
+    def _abort(conn: http.client.HTTPConnection) -> None:
+        """Shut down a connection's socket, unblocking a thread reading from it."""
+        if conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# process-wide pools, shared by all provider instances of the same server
+_connection_pools: dict[str, ConnectionPool] = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(
+    base_url: str, maxsize: int = 16, timeout: float = 600.0
+) -> ConnectionPool:
+    """
+    Retrieve the process-wide connection pool of a server, creating it on first use.
+    The settings given on first use apply to every later instance using the same server.
+
+    Args:
+        base_url (str): server URL, including the API prefix (i.e. 'http://localhost:8000/v1')
+        maxsize (int): max # of concurrently open connections, defaults to 16
+        timeout (float): socket timeout in seconds, defaults to 600.0
+
+    Returns:
+        pool (ConnectionPool): shared connection pool
+    """
+    base_url = base_url.rstrip("/")
+    with _connection_pools_lock:
+        pool = _connection_pools.get(base_url)
+        if pool is None:
+            pool = _connection_pools[base_url] = ConnectionPool(
+                base_url, maxsize=maxsize, timeout=timeout
+            )
+        return pool
@@ -10,13 +10,113 @@ Users can also define their own custom models and parameters by extending the YA
 configuration using the same format template.
 """
 
+import copy, glob, json, mmap, os, struct, sys, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from collections.abc import Iterator
 from typing_extensions import override
 from .base import BaseLLM, load_yaml
-from .utils.prompt_template import prompt_templates
+from .chat_template import ChatTemplate
+from .grammar import GrammarLogitsProcessor, SectionGrammar
+from .loading import ModelLoader
+from .metrics import measured, record_output_tokens
+from .query_log import QueryLog
+from .registry import model_registry
+from .retry_policy import RetryPolicy
+from .usage import UsageMeter
 import warnings
 
 warnings.filterwarnings("ignore", message="`do_sample` is set to `False`.*")
 
+# safetensors dtype names -> torch dtype names
+_SAFETENSORS_DTYPES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+}
+
+# creating modules with empty parameters patches torch globally, so it is serialized
+_empty_parameters_lock = threading.Lock()
+
+
+@contextmanager
+def _empty_parameters(torch):
+    """Create module parameters on the meta device (no memory), keeping buffers on CPU."""
+
+    register_parameter = torch.nn.Module.register_parameter
+
+    def register_empty_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            module._parameters[name] = torch.nn.Parameter(
+                param.to("meta"), requires_grad=param.requires_grad
+            )
+
+    with _empty_parameters_lock:
+        torch.nn.Module.register_parameter = register_empty_parameter
+        try:
+            yield
+        finally:
+            torch.nn.Module.register_parameter = register_parameter
+
+
+def _memory_usage() -> dict[str, float]:
+    """Current, file-backed and peak resident memory of this process in MiB, where reported."""
+
+    usage = {}
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        usage["peak_rss_mb"] = peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    except ImportError:
+        pass
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "VmRSS":
+                    usage["rss_mb"] = int(value.split()[0]) / 1024
+                elif key == "RssFile":
+                    usage["file_rss_mb"] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+
+    return usage
+
+
+class _StopOnStrings:
+    """
+    Stopping criteria for `generate` that ends each sequence once it produces one of the
+    stop strings. Only the last few generated tokens are decoded at every step.
+    """
+
+    def __init__(self, tokenizer, stop: str | list[str], prompt_length: int) -> None:
+        self.tokenizer = tokenizer
+        self.stops = [stop] if isinstance(stop, str) else list(stop)
+        self.prompt_length = prompt_length
+
+        # every token decodes to at least one character, so a stop string spans at most
+        # len(stop) tokens (+1 for a token that the stop string starts in the middle of)
+        self.tail_tokens = max(len(s) for s in self.stops) + 1
+
+    def __call__(self, input_ids, scores, **kwargs):
+        is_done = []
+        for ids in input_ids:
+            tail = ids[max(self.prompt_length, len(ids) - self.tail_tokens) :]
+            text = self.tokenizer.decode(tail, skip_special_tokens=True)
+            is_done.append(any(s in text for s in self.stops))
+        return input_ids.new_tensor(is_done, dtype=bool)
+
 
 class HUGGING_FACE(BaseLLM):
     def __init__(
@@ -26,16 +126,26 @@ class HUGGING_FACE(BaseLLM):
         config_path: str = "l2p/llm/utils/llm.yaml",
         provider: str = "huggingface",
         api_key: str | None = None,  # only if model is affiliated w/ private repo
+        retry_policy: RetryPolicy | None = None,
+        lazy: bool = False,  # return immediately and load weights in the background
+        background: bool = True,  # with `lazy`, False defers loading to the first query
+        warmup: bool = False,  # run a short generation after loading
     ) -> None:
 
         # attempt to import neccessary libraries
         try:
             import transformers
-            from transformers import AutoTokenizer, AutoConfig, AutoModelForCausalLM
+            from transformers import (
+                AutoTokenizer,
+                AutoConfig,
+                AutoModelForCausalLM,
+                TextIteratorStreamer,
+            )
 
             self.AutoTokenizer = AutoTokenizer
             self.AutoConfig = AutoConfig
             self.AutoModelForCausalLM = AutoModelForCausalLM
+            self.TextIteratorStreamer = TextIteratorStreamer
         except ImportError:
             raise ImportError(
                 "The 'transformers' library (and its components like AutoTokenizer) is required for HUGGING_FACE "
@@ -68,41 +178,277 @@ class HUGGING_FACE(BaseLLM):
         model_config = self._config.get(self.provider, {}).get(model, {})
         self.model_engine = model_config.get("engine", model)
         self.model_path = model_path
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_site = f"{self.provider}:{self.model_engine}"
 
-        # check/load model
-        self._load_transformer()
+        # context length defaults to the model's, which is known once the config is loaded
+        self.context_length = None
+
+        # prompt template; the tokenizer's chat template replaces it once loaded
+        self.chat_template = ChatTemplate(self.model_engine)
 
         # set parameters for model
         self._set_parameters(model_config)
 
         # set model configuration
         self._set_configs(model_config)
+        if self.num_threads:
+            self.torch.set_num_threads(self.num_threads)
+
+        # recording logs (aggregate usage; see `usage_scope` for the usage of a single request)
+        self.usage = UsageMeter()
+        self.query_log = QueryLog.from_config(model_config.get("query_log"))
+
+        # cached key/values of registered static prompt prefixes (see `register_prefix`)
+        self._prefix_cache = OrderedDict()
+        self._prefix_lock = threading.Lock()
+        self.prefix_hits = 0
+
+        # optional grammar constraining every response (see `SectionGrammar`)
+        self.grammar = None
+
+        # tokenizer and model are shared by all instances with the same weights, placement
+        # and loading mode (a compiled model is only shared with other compiled instances)
+        quantization = "8bit" if self.use_8bit else "4bit" if self.use_4bit else None
+        quantization = quantization or self.cpu_quantization
+        self._tokenizer_key = ("tokenizer", self.model_path)
+        self._model_key = (
+            "model",
+            self.model_path,
+            str(self.dtype),
+            quantization,
+            repr(self.device_map),
+            self.mmap,
+            self.compile,
+        )
+        self.tokenizer = None
+        self.llm = None
+        self.load_stats = None
+
+        # load now, or lazily in the background / on first query
+        self.warmup = warmup
+        self._loader = ModelLoader(self._load, name=self.model_engine)
+        if not lazy:
+            self._loader.start(background=False)
+        elif background:
+            self._loader.start(background=True)
+
+    def _load(self) -> None:
+        """Load (or acquire shared) tokenizer and model, then optionally warm up."""
+
+        tokenizer, context_length = model_registry.acquire(
+            self._tokenizer_key, self._load_transformer
+        )
+        try:
+            # instances sharing the model report the stats of the load that created it
+            llm, self.load_stats = model_registry.acquire(
+                self._model_key, self._load_model
+            )
+        except BaseException:
+            model_registry.release(self._tokenizer_key)
+            raise
+
+        self.tokenizer = tokenizer
+        self.chat_template = ChatTemplate.from_tokenizer(self.model_engine, tokenizer)
+        if self.context_length is None:
+            self.context_length = context_length
 
         # assign other default model parameters
-        self.batch_size = 1
         self.pad_token_id = self.tokenizer.eos_token_id
         self.eos_token_id = self.tokenizer.eos_token_id
 
-        # recording logs
-        self.in_tokens = 0
-        self.out_tokens = 0
-        self.query_log = []
+        self.llm = llm
+        if self.warmup:
+            self._warmup()
+
+    def _warmup(self) -> None:
+        """Run a short generation so the first query does not pay one-time setup costs."""
+
+        input = self.tokenizer(["Warm-up"], return_tensors="pt")
+        input = {k: v.to(self.device) for k, v in input.items()}
+        with self.torch.no_grad():
+            self.llm.generate(
+                **input,
+                max_new_tokens=4,
+                do_sample=False,
+                pad_token_id=self.pad_token_id,
+            )
+
+    def ready(self) -> bool:
+        """True if the model is loaded and can serve queries without waiting."""
+        return self._loader.ready()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the model is loaded (starting a deferred load in the background).
+
+        Args:
+            timeout (float): max seconds to wait, defaults to None (no limit)
+
+        Returns:
+            ready (bool): True if loaded, False if `timeout` expired first
+        """
+        return self._loader.wait(timeout)
+
+    def _load_model(self):
+        """
+        Load model weights (called once per registry key), returning the model and its load
+        time and memory usage.
+        """
+
+        start = time.perf_counter()
+
+        llm = None
+        if self.mmap and not self.quantization_config and self.device == "cpu":
+            llm = self._load_model_mmap()
+
+        if llm is None:
+            load_args = {
+                "pretrained_model_name_or_path": self.model_path,
+                "device_map": self.device_map,
+            }
+
+            if self.quantization_config:
+                load_args["quantization_config"] = self.quantization_config
+            else:
+                load_args["torch_dtype"] = self.dtype
 
-        # set model
-        load_args = {
-            "pretrained_model_name_or_path": self.model_path,
-            "device_map": self.device_map,
+            if self.mmap:
+                # load shard by shard instead of materializing a second copy of the weights
+                load_args["low_cpu_mem_usage"] = True
+                load_args["use_safetensors"] = bool(self._safetensors_files())
+
+            llm = self.AutoModelForCausalLM.from_pretrained(**load_args)
+
+            # with a `device_map` the weights are already placed; moving them again copies them
+            if not self.quantization_config and self.device_map is None:
+                llm.to(self.device)
+
+        if self.cpu_quantization == "int8":
+            llm = self.torch.ao.quantization.quantize_dynamic(
+                llm, {self.torch.nn.Linear}, dtype=self.torch.qint8
+            )
+
+        # transformers compiles the decoding step itself only on accelerators (see
+        # `compile_config`); on CPU the forward pass is compiled with `torch.compile`
+        if self.compile and self.device == "cpu":
+            llm.forward = self.torch.compile(llm.forward)
+
+        load_stats = {
+            "load_time_s": time.perf_counter() - start,
+            **_memory_usage(),
         }
+        print(
+            f"[INFO] loaded {self.model_engine} in {load_stats['load_time_s']:.1f}s"
+            + "".join(
+                f", {label}: {load_stats[key]:.0f} MiB"
+                for key, label in (
+                    ("peak_rss_mb", "peak RSS"),
+                    ("file_rss_mb", "file-backed RSS"),
+                )
+                if key in load_stats
+            )
+        )
+        return llm, load_stats
 
-        if self.quantization_config:
-            load_args["quantization_config"] = self.quantization_config
-        else:
-            load_args["torch_dtype"] = self.dtype
-        
-        self.llm = self.AutoModelForCausalLM.from_pretrained(**load_args)
-        if not self.quantization_config:
-            self.llm.to(self.device)
+    def _safetensors_files(self) -> list[str]:
+        """Return the safetensors shards of the model, if stored locally."""
+        return sorted(glob.glob(os.path.join(self.model_path, "*.safetensors")))
+
+    def _load_model_mmap(self):
+        """
+        Build the model with empty parameters and assign them tensors memory-mapped from the
+        safetensors shards. Weights then stay read-only file pages that every process loading
+        the same files shares. Returns None if the checkpoint cannot be mapped directly.
+        """
 
+        files = self._safetensors_files()
+        if not files:
+            print(f"[WARNING] No safetensors files in '{self.model_path}', loading without mmap.")
+            return None
+
+        state_dict = {}
+        converted = False
+        for path in files:
+            with open(path, "rb") as f:
+                # copy-on-write mapping: pages are shared until written (weights never are)
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+            header_size = struct.unpack("<Q", buffer[:8])[0]
+            header = json.loads(buffer[8 : 8 + header_size])
+
+            for name, info in header.items():
+                if name == "__metadata__":
+                    continue
+                if info["dtype"] not in _SAFETENSORS_DTYPES:
+                    return None
+
+                dtype = getattr(self.torch, _SAFETENSORS_DTYPES[info["dtype"]])
+                begin, end = info["data_offsets"]
+                if end == begin:
+                    tensor = self.torch.empty(info["shape"], dtype=dtype)
+                else:
+                    tensor = self.torch.frombuffer(
+                        buffer,
+                        dtype=dtype,
+                        count=(end - begin) // dtype.itemsize,
+                        offset=8 + header_size + begin,
+                    ).view(info["shape"])
+
+                # converting to the configured dtype copies the tensor
+                if tensor.is_floating_point() and tensor.dtype != self.dtype:
+                    tensor = tensor.to(self.dtype)
+                    converted = True
+                state_dict[name] = tensor
+
+        if converted:
+            print(
+                f"[WARNING] Weights of '{self.model_path}' are stored in another dtype than "
+                f"{self.dtype}; converted weights are not shared between processes."
+            )
+
+        config = self.AutoConfig.from_pretrained(self.model_path)
+        with _empty_parameters(self.torch):
+            llm = self.AutoModelForCausalLM.from_config(config, torch_dtype=self.dtype)
+
+        _, unexpected = llm.load_state_dict(state_dict, strict=False, assign=True)
+        llm.tie_weights()
+
+        # i.e. checkpoint keys that `from_pretrained` would rename
+        if unexpected or any(p.is_meta for p in llm.parameters()):
+            print(
+                f"[WARNING] Checkpoint of '{self.model_path}' cannot be memory-mapped directly, "
+                "loading without mmap."
+            )
+            return None
+
+        try:
+            from transformers import GenerationConfig
+
+            llm.generation_config = GenerationConfig.from_pretrained(self.model_path)
+        except (ImportError, OSError):
+            pass
+
+        return llm.eval()
+
+    def unload(self) -> None:
+        """
+        Release this instance's shared model and tokenizer and its cached prefixes. Weights
+        are freed once no other instance uses them; a later query loads them again.
+        """
+        if self._loader.started:
+            self._loader.wait()
+        if self.llm is None:
+            return
+
+        self.llm = None
+        self.clear_prefixes()
+        freed = model_registry.release(self._model_key)
+        model_registry.release(self._tokenizer_key)
+        self._loader = ModelLoader(self._load, name=self.model_engine)
+
+        if freed and self.torch.cuda.is_available():
+            self.torch.cuda.empty_cache()
 
     def _load_transformer(self):
         """Checks and loads model tokenizer/context length if exists."""
@@ -110,16 +456,23 @@ class HUGGING_FACE(BaseLLM):
         try:
             # lightweight check — will raise OSError if the model path is invalid
             if self.api_key:
-                self.tokenizer = self.AutoTokenizer.from_pretrained(
+                tokenizer = self.AutoTokenizer.from_pretrained(
                     self.model_path, token=self.api_key
                 )
             else:
-                self.tokenizer = self.AutoTokenizer.from_pretrained(self.model_path)
+                tokenizer = self.AutoTokenizer.from_pretrained(self.model_path)
+
+            # decoder-only models must be left-padded for batched generation
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
 
-            self.context_length = self.AutoConfig.from_pretrained(
+            context_length = self.AutoConfig.from_pretrained(
                 self.model_path
             ).max_position_embeddings
 
+            return tokenizer, context_length
+
         except OSError as e:
             # if model_path is not found, raise an error
             raise ValueError(
@@ -145,6 +498,7 @@ class HUGGING_FACE(BaseLLM):
         parameters = model_config.get("model_params", {})
         for key, default in defaults.items():
             setattr(self, key, parameters.get(key, default))
+        self.sampling_parameter_names = tuple(defaults)
 
     def _set_configs(self, model_config: dict) -> None:
         """Set model hardware configuration and quantization setup."""
@@ -154,6 +508,7 @@ class HUGGING_FACE(BaseLLM):
             "float32": self.torch.float32,
             "float16": self.torch.float16,
             "bfloat16": self.torch.bfloat16,
+            "auto": self._auto_dtype(),
         }
 
         configs = model_config.get("model_config", {})
@@ -192,142 +547,482 @@ class HUGGING_FACE(BaseLLM):
             self.quantization_config = None  # not used
         self.device_map = configs.get("device_map", "auto")
 
+        # 3. CPU acceleration: dynamic int8 quantization of linear layers
+        self.cpu_quantization = configs.get("cpu_quantization")
+        if self.cpu_quantization not in (None, "int8"):
+            raise ValueError("cpu_quantization must be 'int8' or null.")
+        if self.cpu_quantization and self.device != "cpu":
+            print("[WARNING] cpu_quantization only applies to CPU inference; ignoring it.")
+            self.cpu_quantization = None
+        if self.cpu_quantization and self.dtype != self.torch.float32:
+            # dynamically quantized layers take float32 activations
+            if configs.get("dtype") != "auto":
+                print("[WARNING] cpu_quantization requires float32; using dtype float32.")
+            self.dtype = self.torch.float32
+
+        # # of intra-op threads used by torch (process-wide), defaults to torch's choice
+        num_threads = configs.get("num_threads")
+        if num_threads is None or (isinstance(num_threads, int) and num_threads > 0):
+            self.num_threads = num_threads
+        else:
+            raise TypeError("num_threads must be a positive integer or null.")
+        if hasattr(os, "sched_getaffinity"):
+            cores = len(os.sched_getaffinity(0))
+        else:
+            cores = os.cpu_count()
+        if self.num_threads and cores and self.num_threads > cores:
+            # more threads than cores makes every matmul slower
+            print(
+                f"[WARNING] num_threads={self.num_threads} exceeds the {cores} available cores; "
+                f"using {cores}."
+            )
+            self.num_threads = cores
+
+        # generate with a static KV cache and a compiled decoding step
+        self.compile = configs.get("compile", False)
+        if not isinstance(self.compile, bool):
+            raise TypeError("compile must be a boolean.")
+        self._compile_config = None
+        if self.compile and self.device != "cpu":
+            try:
+                from transformers import CompileConfig
+
+                self._compile_config = CompileConfig()
+            except ImportError:
+                print("[WARNING] compile requires a newer `transformers`; generating without it.")
+                self.compile = False
+
+        # map safetensors weights into memory instead of copying them (CPU only)
+        mmap = configs.get("mmap", False)
+        if isinstance(mmap, bool):
+            self.mmap = mmap
+        else:
+            raise TypeError("mmap must be a boolean.")
+        if self.mmap and self.cpu_quantization:
+            # quantizing copies the mapped weights into float32 first, raising peak RSS
+            print("[WARNING] mmap has no effect with cpu_quantization; loading without mmap.")
+            self.mmap = False
+
+        # number of prompts generated together in `query_batch`
+        batch_size = configs.get("batch_size", 8)
+        if isinstance(batch_size, int) and batch_size > 0:
+            self.batch_size = batch_size
+        else:
+            raise TypeError("batch_size must be a positive integer.")
+
+        # number of registered prefixes whose key/values are kept in memory
+        prefix_cache_size = configs.get("prefix_cache_size", 4)
+        if isinstance(prefix_cache_size, int) and prefix_cache_size >= 0:
+            self.prefix_cache_size = prefix_cache_size
+        else:
+            raise TypeError("prefix_cache_size must be a non-negative integer.")
+
+    def _auto_dtype(self):
+        """Fastest supported half-precision dtype of the device, float32 if none."""
+
+        if self.device == "cuda":
+            if self.torch.cuda.is_bf16_supported():
+                return self.torch.bfloat16
+            return self.torch.float16
+        try:
+            # CPUs with AVX512-BF16 / AMX run bfloat16 matmuls natively
+            if self.torch.ops.mkldnn._is_mkldnn_bf16_supported():
+                return self.torch.bfloat16
+        except (AttributeError, RuntimeError):
+            pass
+        return self.torch.float32
+
     def generate_prompt(self, system_message, prompt):
         """Generate prompt structure for specific LLM."""
-        system_message = (
-            system_message
-            or "You are a PDDL coding assistant. Provide concise, correct code only.\n"
+        return self.chat_template.render(system_message, prompt)
+
+    def register_prefix(self, prefix: str, system_prompt: str = None) -> int:
+        """
+        Register a static prompt prefix (i.e. role, format and few-shot examples shared by
+        many prompts). Its key/values are computed once and reused by every single-prompt
+        query whose tokenized full prompt starts with it, so only the remaining tokens are
+        prefilled. The `prefix_cache_size` most recently used prefixes are kept. Prefixes are
+        not cached with `compile`, whose static KV cache cannot start from them.
+
+        Args:
+            prefix (str): static beginning of the prompts passed to `query`
+            system_prompt (str): system prompt used with these prompts, defaults to None
+
+        Returns:
+            prefix_tokens (int): number of cached prefix tokens
+        """
+
+        if self.prefix_cache_size == 0:
+            return 0
+        if self.compile:
+            print(f"[WARNING] prefix caching is not supported with `compile`; prefix of {self.model_engine} not registered.")
+            return 0
+        self._loader.ensure()
+
+        # tokenize the prompt template up to the end of the prefix, dropping the last
+        # token, which may merge with the text that follows the prefix
+        _, prefix_ids = self.chat_template.encode(system_prompt, prefix, complete=False)
+        prefix_ids = prefix_ids[:-1]
+        if not prefix_ids:
+            return 0
+
+        key = tuple(prefix_ids)
+        with self._prefix_lock:
+            if key in self._prefix_cache:
+                self._prefix_cache.move_to_end(key)
+                return len(prefix_ids)
+
+        input_ids = self.torch.tensor([prefix_ids], device=self.device)
+        with self.torch.no_grad():
+            past_key_values = self.llm(input_ids, use_cache=True).past_key_values
+
+        with self._prefix_lock:
+            self._prefix_cache[key] = past_key_values
+            while len(self._prefix_cache) > self.prefix_cache_size:
+                self._prefix_cache.popitem(last=False)
+
+        return len(prefix_ids)
+
+    def clear_prefixes(self) -> None:
+        """Remove all cached prefixes."""
+        with self._prefix_lock:
+            self._prefix_cache.clear()
+
+    def _match_prefix(self, input_ids):
+        """Return a copy of the cached key/values of the longest registered prefix of `input_ids`."""
+
+        if input_ids.shape[0] != 1 or not self._prefix_cache:
+            return None
+
+        ids = input_ids[0].tolist()
+        with self._prefix_lock:
+            # at least one prompt token must be left to prefill
+            matches = [
+                key for key in self._prefix_cache
+                if len(key) < len(ids) and tuple(ids[: len(key)]) == key
+            ]
+            if not matches:
+                return None
+
+            key = max(matches, key=len)
+            self._prefix_cache.move_to_end(key)
+            self.prefix_hits += 1
+
+            # `generate` extends the cache in place, so the stored prefix is copied
+            return copy.deepcopy(self._prefix_cache[key])
+
+    def _prepare_input(self, prompt: str, system_prompt: str, est_margin: int):
+        """Build and tokenize the full prompt and size the number of new tokens."""
+
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError("Prompt must be a non-empty string.")
+        self._loader.ensure()
+
+        full_prompt, input_ids = self.chat_template.encode(system_prompt, prompt)
+        input = self.tokenizer.pad({"input_ids": [input_ids]}, return_tensors="pt")
+        requested_tokens = len(input_ids)
+
+        available_context = self.context_length - requested_tokens - est_margin
+        max_new_tokens = min(self.max_new_tokens, max(0, available_context))
+
+        print(
+            f"Requesting {max_new_tokens} tokens "
+            f"(estimated prompt: {requested_tokens} tokens, margin: {est_margin}, window: {self.context_length})"
         )
-        model_name = self.model_engine.lower()
 
-        # try to find matching template key from the prompt_templates
-        for key in prompt_templates:
-            if key in model_name:
-                template = prompt_templates[key]
-                return template.format(
-                    system_prompt=system_message, prompt=prompt
-                ).strip()
+        # print token information
+        print(f"[INFO] connecting to {self.model_engine} ({requested_tokens} tokens)...")
+        if requested_tokens >= self.context_length:
+            print(
+                f"[WARNING] Prompt is {requested_tokens} tokens and exceeds context length "
+                f"({self.context_length}). It will be truncated."
+            )
 
-        # default fallback if no template matched
-        return prompt
+        return full_prompt, input, requested_tokens, max_new_tokens
 
     @override
+    @measured
     def query(
         self,
         prompt: str,
         system_prompt: str = None,
         end_when_error: bool = False,
-        max_retry: int = 3,
+        max_retry: int | None = None,
         est_margin: int = 200,
+        grammar: SectionGrammar | None = None,
     ) -> str:
-        """Generate a response from HuggingFace model based on the prompt."""
+        """
+        Generate a response from HuggingFace model based on the prompt. If a `grammar` is
+        given (or set as `self.grammar`), decoding is constrained to responses it accepts.
+        """
 
-        if not isinstance(prompt, str) or not prompt.strip():
-            raise ValueError("Prompt must be a non-empty string.")
+        full_prompt, input, requested_tokens, max_new_tokens = self._prepare_input(
+            prompt, system_prompt, est_margin
+        )
 
-        full_prompt = self.generate_prompt(system_prompt, prompt)
-        assert full_prompt is not None
+        # request response
+        max_attempts = 1 if end_when_error else max_retry
+        try:
+            llm_output, output_tokens = self.retry_policy.call(
+                self._generate,
+                input,
+                max_new_tokens,
+                grammar=grammar,
+                site=self.retry_site,
+                max_attempts=max_attempts,
+            )[0]
+        except Exception as e:
+            if not self.retry_policy.is_retryable(e):
+                raise
+            raise ConnectionError(
+                f"Failed to generate response after {max_attempts or self.retry_policy.max_attempts} attempts."
+            ) from e
 
-        input = self.tokenizer([full_prompt], return_tensors="pt")
-        requested_tokens = len(input.input_ids[0])
+        self._record_query(full_prompt, requested_tokens, output_tokens, llm_output)
 
-        available_context = self.context_length - requested_tokens - est_margin
-        max_new_tokens = min(self.max_new_tokens, max(0, available_context))
+        return llm_output
 
-        print(
-            f"Requesting {max_new_tokens} tokens "
-            f"(estimated prompt: {requested_tokens} tokens, margin: {est_margin}, window: {self.context_length})"
+    @override
+    @measured
+    def query_stream(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        est_margin: int = 200,
+        grammar: SectionGrammar | None = None,
+    ) -> Iterator[str]:
+        """
+        Generate a response from HuggingFace model based on the prompt, yielding decoded text
+        as it is generated. Generation runs on a background thread and is stopped as soon as
+        the generator is closed or the configured stop string is produced.
+        """
+
+        full_prompt, input, requested_tokens, max_new_tokens = self._prepare_input(
+            prompt, system_prompt, est_margin
         )
 
-        # request response
-        conn_success, n_retry = False, 0
-        while not conn_success and n_retry < max_retry:
+        streamer = self.TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+        cancel = threading.Event()
+        outputs, errors = [], []
+
+        def generate():
             try:
-                # print token information
-                print(
-                    f"[INFO] connecting to {self.model_engine} ({requested_tokens} tokens)..."
+                output = self._generate_ids(
+                    input,
+                    max_new_tokens,
+                    grammar=grammar,
+                    streamer=streamer,
+                    stopping_criteria=[lambda input_ids, scores, **_: cancel.is_set()],
                 )
-                if requested_tokens >= self.context_length:
-                    print(
-                        f"[WARNING] Prompt is {requested_tokens} tokens and exceeds context length "
-                        f"({self.context_length}). It will be truncated."
-                    )
+                outputs.append(output[0, input["input_ids"].shape[1] :])
+            except Exception as e:
+                errors.append(e)
+                streamer.end()  # unblock the consumer
 
-                input = {k: v.to(self.device) for k, v in input.items()}
-
-                # get response from LLM
-                with self.torch.no_grad():
-                    outputs = self.llm.generate(
-                        **input,
-                        max_new_tokens=max_new_tokens,
-                        temperature=self.temperature,
-                        top_p=self.top_p,
-                        pad_token_id=self.pad_token_id,
-                        eos_token_id=self.eos_token_id,
-                        do_sample=self.do_sample,
-                    )
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+
+        llm_output = ""
+        try:
+            for text in streamer:
+                # exclude texts after stop token, and stop generating
+                if self.stop is not None and self.stop in llm_output + text:
+                    text = (llm_output + text).split(self.stop)[0][len(llm_output) :]
+                    llm_output += text
+                    if text:
+                        yield text
+                    break
 
-                # retrieve output content from LLM response
-                llm_output = self.tokenizer.decode(
-                    outputs[0][requested_tokens:], skip_special_tokens=True
+                llm_output += text
+                if text:
+                    yield text
+        finally:
+            cancel.set()
+            thread.join()
+            output_tokens = self._count_generated(outputs[0]) if outputs else 0
+            self._record_query(full_prompt, requested_tokens, output_tokens, llm_output)
+
+        if errors:
+            raise errors[0]
+
+    @override
+    @measured
+    def query_batch(
+        self,
+        prompts: list[str],
+        system_prompt: str = None,
+        est_margin: int = 200,
+        grammar: SectionGrammar | None = None,
+    ) -> list[str]:
+        """
+        Generate responses for a batch of prompts. Prompts are sorted by length and split
+        into chunks of `batch_size`, so each padded chunk is generated in one call.
+        """
+
+        for prompt in prompts:
+            if not isinstance(prompt, str) or not prompt.strip():
+                raise ValueError("Prompt must be a non-empty string.")
+        self._loader.ensure()
+
+        encoded = [self.chat_template.encode(system_prompt, p) for p in prompts]
+        full_prompts = [full_prompt for full_prompt, _ in encoded]
+        lengths = [len(input_ids) for _, input_ids in encoded]
+
+        # sort longest first so prompts of similar length share a padded chunk
+        order = sorted(range(len(full_prompts)), key=lambda i: -lengths[i])
+        outputs = [None] * len(full_prompts)
+
+        for start in range(0, len(order), self.batch_size):
+            chunk = order[start : start + self.batch_size]
+
+            input = self.tokenizer.pad(
+                {"input_ids": [encoded[i][1] for i in chunk]}, return_tensors="pt"
+            )
+            available_context = self.context_length - lengths[chunk[0]] - est_margin
+            max_new_tokens = min(self.max_new_tokens, max(0, available_context))
+
+            print(
+                f"[INFO] generating batch of {len(chunk)} prompts with {self.model_engine} "
+                f"(longest prompt: {lengths[chunk[0]]} tokens, {max_new_tokens} new tokens)..."
+            )
+
+            llm_outputs = self._generate(input, max_new_tokens, grammar=grammar)
+            for i, (llm_output, output_tokens) in zip(chunk, llm_outputs):
+                self._record_query(
+                    full_prompts[i], lengths[i], output_tokens, llm_output
                 )
+                outputs[i] = llm_output
 
-                # exclude texts after stop token
-                if self.stop is not None:
-                    llm_output = llm_output.split(self.stop)[0]
+        return outputs
 
-                conn_success = True
+    def _generate_ids(
+        self,
+        input,
+        max_new_tokens: int,
+        grammar: SectionGrammar | None = None,
+        **generate_kwargs,
+    ):
+        """Run `generate` over a tokenized (optionally padded) batch; returns token ids."""
 
-            except Exception as e:
-                print(f"[ERROR] LLM error: {e}")
-                if end_when_error:
-                    break
-                n_retry += 1
+        input = {k: v.to(self.device) for k, v in input.items()}
 
-        if not conn_success:
-            raise ConnectionError(
-                f"Failed to generate response after {max_retry} retries."
+        # compiled decoding needs a static cache of fixed shape
+        if self.compile:
+            generate_kwargs.setdefault("cache_implementation", "static")
+            if self._compile_config is not None:
+                generate_kwargs.setdefault("compile_config", self._compile_config)
+
+        # reuse key/values of a registered prefix, if the prompt starts with one
+        elif "past_key_values" not in generate_kwargs:
+            past_key_values = self._match_prefix(input["input_ids"])
+            if past_key_values is not None:
+                generate_kwargs["past_key_values"] = past_key_values
+
+        # end each sequence as soon as it produces the stop string
+        if self.stop:
+            generate_kwargs["stopping_criteria"] = [
+                *generate_kwargs.get("stopping_criteria", []),
+                _StopOnStrings(self.tokenizer, self.stop, input["input_ids"].shape[1]),
+            ]
+
+        # mask tokens that would make the response violate the grammar
+        grammar = grammar or self.grammar
+        if grammar is not None:
+            generate_kwargs["logits_processor"] = [
+                *generate_kwargs.get("logits_processor", []),
+                GrammarLogitsProcessor(
+                    grammar,
+                    self.tokenizer,
+                    input["input_ids"].shape[1],
+                    max_new_tokens=max_new_tokens,
+                ),
+            ]
+
+        # get response from LLM
+        with self.torch.no_grad():
+            return self.llm.generate(
+                **input,
+                max_new_tokens=max_new_tokens,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                pad_token_id=self.pad_token_id,
+                eos_token_id=self.eos_token_id,
+                do_sample=self.do_sample,
+                **generate_kwargs,
             )
 
-        # retrieve output tokens
-        output_ids = self.tokenizer(
-            llm_output, return_tensors="pt", truncation=True
-        ).input_ids
-        output_token_count = len(output_ids[0])
+    def _generate(
+        self, input, max_new_tokens: int, grammar: SectionGrammar | None = None
+    ) -> list[tuple[str, int]]:
+        """
+        Run `generate` over a tokenized (optionally padded) batch and decode new tokens.
+        Returns the text and # of generated tokens of each sequence.
+        """
+
+        input_length = input["input_ids"].shape[1]
+        outputs = self._generate_ids(input, max_new_tokens, grammar=grammar)
+
+        llm_outputs = []
+        for output in outputs:
+            # retrieve output content from LLM response
+            generated = output[input_length:]
+            llm_output = self.tokenizer.decode(generated, skip_special_tokens=True)
+
+            # exclude texts after stop token
+            if self.stop is not None:
+                llm_output = llm_output.split(self.stop)[0]
+
+            llm_outputs.append((llm_output, self._count_generated(generated)))
+
+        return llm_outputs
+
+    def _count_generated(self, generated) -> int:
+        """# of generated tokens of a sequence, up to its first EOS (the rest is padding)."""
+        ids = generated.tolist()
+        return ids.index(self.eos_token_id) if self.eos_token_id in ids else len(ids)
+
+    def _record_query(
+        self,
+        full_prompt: str,
+        requested_tokens: int,
+        output_tokens: int,
+        llm_output: str,
+    ) -> None:
+        """Record token counts and query log for a single generated response."""
 
         # record token counts
-        self.in_tokens += requested_tokens
-        self.out_tokens += output_token_count
+
+        self.usage.record(requested_tokens, output_tokens)
+        record_output_tokens(output_tokens)
 
         self.query_log.append(
             {
                 "model": self.model_engine,
                 "prompt_tokens": requested_tokens,
-                "completion_tokens": output_token_count,
-                "total_tokens": requested_tokens + output_token_count,
+                "completion_tokens": output_tokens,
+                "total_tokens": requested_tokens + output_tokens,
                 "prompt": full_prompt,
                 "output": llm_output,
             }
         )
 
-        return llm_output
-
     def get_tokens(self) -> tuple[int, int]:
         """Return input and output token counts."""
-        return self.in_tokens, self.out_tokens
+        return self.usage.get_tokens()
 
     def reset_tokens(self) -> None:
-        """Reset token counts."""
-        self.in_tokens = 0
-        self.out_tokens = 0
+        """Reset aggregate token counts (prefer `usage_scope` to measure a single request)."""
+        self.usage.reset()
 
     def get_query_log(self) -> list:
         """Retrieve query log."""
-        return self.query_log
+        return list(self.query_log)
 
     def reset_query_log(self) -> None:
         """Reset query log."""
-        self.query_log = []
+        self.query_log.clear()
 
     @override
     def valid_models(self) -> list[str]:
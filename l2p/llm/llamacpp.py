@@ -0,0 +1,538 @@
+"""
+This is a subclass (LLAMA_CPP) for abstract class (BaseLLM) that implements an interface
+to run quantized GGUF models on CPU through llama.cpp (`llama-cpp-python` bindings).
+
+Compared with HUGGING_FACE, weights are already quantized (i.e. Q4_K_M) and memory-mapped
+from the GGUF file, so a model starts in seconds and runs several times faster on CPU-only
+hosts.
+
+A YAML configuration file is required to specify model parameters and other
+provider-specific settings. By default, the l2p library includes a configuration file
+located at 'l2p/llm/utils/llm.yaml'.
+
+Users can also define their own custom models and parameters by extending the YAML
+configuration using the same format template.
+"""
+
+import glob, os, threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from typing_extensions import override
+from .base import BaseLLM, load_yaml
+from .chat_template import ChatTemplate
+from .loading import ModelLoader
+from .metrics import measured, queued, record_output_tokens
+from .query_log import QueryLog
+from .registry import model_registry
+from .retry_policy import RetryPolicy
+from .usage import UsageMeter
+
+
+class LLAMA_CPP(BaseLLM):
+    def __init__(
+        self,
+        model: str,
+        model_path: str,  # GGUF file, or directory containing it
+        config_path: str = "l2p/llm/utils/llm.yaml",
+        provider: str = "llama_cpp",
+        api_key: str | None = None,
+        retry_policy: RetryPolicy | None = None,
+        lazy: bool = False,  # return immediately and load weights in the background
+        background: bool = True,  # with `lazy`, False defers loading to the first query
+        warmup: bool = False,  # run a short generation after loading
+    ) -> None:
+
+        # attempt to import neccessary libraries
+        try:
+            from llama_cpp import Llama
+
+            self.Llama = Llama
+        except ImportError:
+            raise ImportError(
+                "The 'llama-cpp-python' library is required for LLAMA_CPP but is not installed. "
+                "Install it using: `pip install llama-cpp-python`."
+            )
+
+        self.api_key = api_key
+
+        # load yaml configuration path
+        self.provider = provider
+        self._config = load_yaml(config_path)
+
+        # retrieve model configurations
+        model_config = self._config.get(self.provider, {}).get(model, {})
+        self.model_engine = model_config.get("engine", model)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_site = f"{self.provider}:{self.model_engine}"
+
+        # set parameters for model
+        self._set_parameters(model_config)
+
+        # set model configurations
+        self._set_configs(model_config)
+        self.model_path = self._resolve_model_path(model_path)
+
+        # prompt template; the GGUF file's chat template replaces it once loaded
+        self.chat_template = ChatTemplate(self.model_engine)
+
+        # recording logs (aggregate usage; see `usage_scope` for the usage of a single request)
+        self.usage = UsageMeter()
+        self.query_log = QueryLog.from_config(model_config.get("query_log"))
+
+        # saved states of registered static prompt prefixes (see `register_prefix`)
+        self._prefix_cache = OrderedDict()
+        self.prefix_hits = 0
+
+        # a llama.cpp context is shared by all instances with the same file and settings
+        # (including how weights are loaded); it holds the evaluated tokens of the last
+        # prompt, so calls are serialized
+        self._model_key = (
+            "llama_cpp",
+            self.model_path,
+            self.context_length,
+            self.num_threads,
+            self.n_batch,
+            self.n_gpu_layers,
+            self.mmap,
+            self.mlock,
+        )
+        self.llm = None
+        self._lock = None
+
+        # load now, or lazily in the background / on first query
+        self.warmup = warmup
+        self._loader = ModelLoader(self._load, name=self.model_engine)
+        if not lazy:
+            self._loader.start(background=False)
+        elif background:
+            self._loader.start(background=True)
+
+    def _resolve_model_path(self, model_path: str) -> str:
+        """Return the GGUF file of `model_path`, matching `filename` if it is a directory."""
+
+        if not os.path.isdir(model_path):
+            if not os.path.isfile(model_path):
+                raise FileNotFoundError(f"GGUF model '{model_path}' does not exist.")
+            return os.path.abspath(model_path)
+
+        files = sorted(glob.glob(os.path.join(model_path, self.filename)))
+        # split models (i.e. '*-00001-of-00003.gguf') are loaded from their first part
+        files = [f for f in files if "-of-" not in f or "-00001-of-" in f]
+        if len(files) != 1:
+            raise FileNotFoundError(
+                f"Expected one GGUF file matching '{self.filename}' in '{model_path}', "
+                f"found {len(files)}. Set `filename` in the model_config."
+            )
+        return os.path.abspath(files[0])
+
+    def _load(self) -> None:
+        """Load (or acquire shared) llama.cpp model, then optionally warm up."""
+
+        self.llm, self._lock = model_registry.acquire(self._model_key, self._load_model)
+
+        self.chat_template = self._build_chat_template()
+
+        # the model's own context window applies when none is configured
+        if self.context_length is None:
+            self.context_length = self.llm.n_ctx()
+
+        if self.warmup:
+            with self._lock:
+                self.llm.create_completion("Warm-up", max_tokens=4)
+
+    def _load_model(self):
+        """Load the GGUF file, returning the model and the lock serializing its use."""
+
+        llm = self.Llama(
+            model_path=self.model_path,
+            n_ctx=self.context_length or 0,  # 0: the model's training context
+            n_batch=self.n_batch,
+            n_threads=self.num_threads,
+            n_threads_batch=self.num_threads,
+            n_gpu_layers=self.n_gpu_layers,
+            use_mmap=self.mmap,
+            use_mlock=self.mlock,
+            verbose=False,
+        )
+        print(f"[INFO] loaded {self.model_engine} from {self.model_path}")
+        return llm, threading.Lock()
+
+    def ready(self) -> bool:
+        """True if the model is loaded and can serve queries without waiting."""
+        return self._loader.ready()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the model is loaded (starting a deferred load in the background).
+
+        Args:
+            timeout (float): max seconds to wait, defaults to None (no limit)
+
+        Returns:
+            ready (bool): True if loaded, False if `timeout` expired first
+        """
+        return self._loader.wait(timeout)
+
+    def unload(self) -> None:
+        """
+        Release this instance's model and its saved prefixes; the model is freed once no
+        instance uses it, and a later query loads it again.
+        """
+
+        if self._loader.started:
+            self._loader.wait()
+        if self.llm is not None:
+            model_registry.release(self._model_key)
+            self.llm = None
+            self._loader = ModelLoader(self._load, name=self.model_engine)
+        self._prefix_cache.clear()
+
+    def _set_parameters(self, model_config: dict) -> None:
+        """Set parameters from the model configuration"""
+
+        # default values for parameters if none exists
+        defaults = {
+            "context_length": None,
+            "max_new_tokens": 2048,
+            "temperature": 0.0,
+            "top_p": 1.0,
+            "top_k": 40,
+            "repeat_penalty": 1.0,
+            "stop": None,
+            "seed": None,
+        }
+
+        parameters = model_config.get("model_params", {})
+        for key, default in defaults.items():
+            setattr(self, key, parameters.get(key, default))
+        self.sampling_parameter_names = tuple(defaults)
+
+    def _set_configs(self, model_config: dict) -> None:
+        """Set model hardware configuration."""
+
+        # extract inner config if it exists
+        configs = model_config.get("model_config", {})
+
+        # GGUF file to load when `model_path` is a directory
+        filename = configs.get("filename", "*.gguf")
+        if isinstance(filename, str):
+            self.filename = filename
+        else:
+            raise TypeError("filename must be a string.")
+
+        # # of CPU threads, defaults to llama.cpp's choice (physical cores)
+        num_threads = configs.get("num_threads")
+        if num_threads is None or (isinstance(num_threads, int) and num_threads > 0):
+            self.num_threads = num_threads
+        else:
+            raise TypeError("num_threads must be a positive integer or null.")
+
+        # # of prompt tokens evaluated per step
+        n_batch = configs.get("n_batch", 512)
+        if isinstance(n_batch, int) and n_batch > 0:
+            self.n_batch = n_batch
+        else:
+            raise TypeError("n_batch must be a positive integer.")
+
+        # # of layers offloaded to a GPU (if llama.cpp was built with GPU support)
+        n_gpu_layers = configs.get("n_gpu_layers", 0)
+        if isinstance(n_gpu_layers, int):
+            self.n_gpu_layers = n_gpu_layers
+        else:
+            raise TypeError("n_gpu_layers must be an integer.")
+
+        # map weights from the GGUF file instead of reading them, and optionally lock
+        # them in RAM so they are never paged out
+        for key, default in (("mmap", True), ("mlock", False)):
+            value = configs.get(key, default)
+            if not isinstance(value, bool):
+                raise TypeError(f"{key} must be a boolean.")
+            setattr(self, key, value)
+
+        # number of registered prompt prefixes whose state is kept (0 disables them)
+        prefix_cache_size = configs.get("prefix_cache_size", 4)
+        if isinstance(prefix_cache_size, int) and prefix_cache_size >= 0:
+            self.prefix_cache_size = prefix_cache_size
+        else:
+            raise TypeError("prefix_cache_size must be a non-negative integer.")
+
+    def _build_chat_template(self) -> ChatTemplate:
+        """Prompt template of the model, using the GGUF file's chat template if it has one."""
+
+        def token_text(token_id: int) -> str:
+            if token_id < 0:
+                return ""
+            return self.llm.detokenize([token_id], special=True).decode(
+                "utf-8", "ignore"
+            )
+
+        bos_token = token_text(self.llm.token_bos())
+        apply_chat_template = None
+        template = self.llm.metadata.get("tokenizer.chat_template")
+        if template:
+            from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+
+            formatter = Jinja2ChatFormatter(
+                template,
+                eos_token=token_text(self.llm.token_eos()),
+                bos_token=bos_token,
+            )
+            apply_chat_template = lambda messages: formatter(messages=messages).prompt
+
+        return ChatTemplate(
+            self.model_engine,
+            apply_chat_template=apply_chat_template,
+            tokenize=lambda text, special: self.llm.tokenize(
+                text.encode("utf-8"), add_bos=special, special=True
+            ),
+            bos_token=bos_token,
+        )
+
+    def generate_prompt(self, system_message, prompt):
+        """Generate prompt structure for specific LLM."""
+        return self.chat_template.render(system_message, prompt)
+
+    def register_prefix(self, prefix: str, system_prompt: str = None) -> int:
+        """
+        Register a static prompt prefix (i.e. role, format and few-shot examples shared by
+        many prompts). It is evaluated once and its llama.cpp state is saved; a later query
+        whose full prompt starts with it restores that state, so only the remaining tokens
+        are evaluated. The `prefix_cache_size` most recently used prefixes are kept.
+
+        Args:
+            prefix (str): static beginning of the prompts passed to `query`
+            system_prompt (str): system prompt used with these prompts, defaults to None
+
+        Returns:
+            prefix_tokens (int): number of cached prefix tokens
+        """
+
+        if self.prefix_cache_size == 0:
+            return 0
+        self._loader.ensure()
+
+        # tokenize the prompt template up to the end of the prefix, dropping the last
+        # token, which may merge with the text that follows the prefix
+        _, prefix_ids = self.chat_template.encode(system_prompt, prefix, complete=False)
+        prefix_ids = prefix_ids[:-1]
+        if not prefix_ids:
+            return 0
+
+        key = tuple(prefix_ids)
+        with self._lock:
+            if key in self._prefix_cache:
+                self._prefix_cache.move_to_end(key)
+                return len(prefix_ids)
+
+            self.llm.reset()
+            self.llm.eval(prefix_ids)
+            self._prefix_cache[key] = self.llm.save_state()
+            while len(self._prefix_cache) > self.prefix_cache_size:
+                self._prefix_cache.popitem(last=False)
+
+        return len(prefix_ids)
+
+    def clear_prefixes(self) -> None:
+        """Remove all cached prefixes."""
+        with self._lock or threading.Lock():
+            self._prefix_cache.clear()
+
+    def _restore_prefix(self, prompt_ids: list[int]) -> None:
+        """
+        Restore the state of the longest registered prefix of `prompt_ids`, unless the
+        model already holds at least as many of its tokens. Called with `_lock` held.
+        """
+
+        matches = [
+            key
+            for key in self._prefix_cache
+            if len(key) < len(prompt_ids) and tuple(prompt_ids[: len(key)]) == key
+        ]
+        if not matches:
+            return
+
+        key = max(matches, key=len)
+        self._prefix_cache.move_to_end(key)
+
+        # llama.cpp itself reuses the tokens shared with the previous prompt
+        evaluated = self.llm.longest_token_prefix(
+            self.llm.input_ids.tolist(), prompt_ids
+        )
+        if evaluated < len(key):
+            self.llm.load_state(self._prefix_cache[key])
+        self.prefix_hits += 1
+
+    def _prepare_input(self, prompt: str, system_prompt: str, est_margin: int):
+        """Build and tokenize the full prompt and size the number of new tokens."""
+
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError("Prompt must be a non-empty string.")
+        self._loader.ensure()
+
+        full_prompt, prompt_ids = self.chat_template.encode(system_prompt, prompt)
+        requested_tokens = len(prompt_ids)
+
+        available_context = self.context_length - requested_tokens - est_margin
+        max_new_tokens = min(self.max_new_tokens, max(0, available_context))
+
+        print(
+            f"Requesting {max_new_tokens} tokens "
+            f"(estimated prompt: {requested_tokens} tokens, margin: {est_margin}, window: {self.context_length})"
+        )
+
+        # print token information
+        print(
+            f"[INFO] connecting to {self.model_engine} ({requested_tokens} tokens)..."
+        )
+        # llama.cpp cannot truncate the prompt, and reads 0 new tokens as "no limit"
+        if max_new_tokens == 0:
+            raise ValueError(
+                f"Prompt is {requested_tokens} tokens and leaves no room for new tokens "
+                f"in the context length ({self.context_length}, margin: {est_margin})."
+            )
+
+        return full_prompt, prompt_ids, max_new_tokens
+
+    def _completion(self, prompt_ids: list[int], max_new_tokens: int, stream: bool):
+        """Start a llama.cpp completion of the tokenized prompt. Called with `_lock` held."""
+
+        if self._prefix_cache:
+            self._restore_prefix(prompt_ids)
+
+        return self.llm.create_completion(
+            prompt_ids,
+            max_tokens=max_new_tokens,
+            temperature=self.temperature,
+            top_p=self.top_p,
+            top_k=self.top_k,
+            repeat_penalty=self.repeat_penalty,
+            stop=self.stop,
+            seed=self.seed,
+            stream=stream,
+        )
+
+    def _generate(self, prompt_ids: list[int], max_new_tokens: int) -> dict:
+        with queued(self._lock):
+            return self._completion(prompt_ids, max_new_tokens, stream=False)
+
+    @override
+    @measured
+    def query(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        end_when_error: bool = False,
+        max_retry: int | None = None,
+        est_margin: int = 200,
+    ) -> str:
+        """Generate a response from the GGUF model based on the prompt."""
+
+        full_prompt, prompt_ids, max_new_tokens = self._prepare_input(
+            prompt, system_prompt, est_margin
+        )
+
+        # request response
+        max_attempts = 1 if end_when_error else max_retry
+        try:
+            completion = self.retry_policy.call(
+                self._generate,
+                prompt_ids,
+                max_new_tokens,
+                site=self.retry_site,
+                max_attempts=max_attempts,
+            )
+        except Exception as e:
+            if not self.retry_policy.is_retryable(e):
+                raise
+            raise ConnectionError(
+                f"Failed to generate response after {max_attempts or self.retry_policy.max_attempts} attempts."
+            ) from e
+
+        llm_output = completion["choices"][0]["text"]
+        usage = completion["usage"]
+        self._record_query(
+            full_prompt, usage["prompt_tokens"], usage["completion_tokens"], llm_output
+        )
+
+        return llm_output
+
+    @override
+    @measured
+    def query_stream(
+        self, prompt: str, system_prompt: str = None, est_margin: int = 200
+    ) -> Iterator[str]:
+        """
+        Generate a response from the GGUF model based on the prompt, yielding text as it is
+        generated. Generation stops as soon as the generator is closed.
+        """
+
+        full_prompt, prompt_ids, max_new_tokens = self._prepare_input(
+            prompt, system_prompt, est_margin
+        )
+
+        llm_output = ""
+        with queued(self._lock):
+            chunks = self._completion(prompt_ids, max_new_tokens, stream=True)
+            try:
+                for chunk in chunks:
+                    text = chunk["choices"][0]["text"]
+                    llm_output += text
+                    if text:
+                        yield text
+            finally:
+                chunks.close()
+                output_tokens = len(
+                    self.llm.tokenize(llm_output.encode("utf-8"), add_bos=False)
+                )
+                self._record_query(
+                    full_prompt, len(prompt_ids), output_tokens, llm_output
+                )
+
+    def _record_query(
+        self,
+        full_prompt: str,
+        requested_tokens: int,
+        output_tokens: int,
+        llm_output: str,
+    ) -> None:
+        """Record token counts and query log for a single generated response."""
+
+        # record token counts
+
+        self.usage.record(requested_tokens, output_tokens)
+        record_output_tokens(output_tokens)
+
+        self.query_log.append(
+            {
+                "model": self.model_engine,
+                "prompt_tokens": requested_tokens,
+                "completion_tokens": output_tokens,
+                "total_tokens": requested_tokens + output_tokens,
+                "prompt": full_prompt,
+                "output": llm_output,
+            }
+        )
+
+    def get_tokens(self) -> tuple[int, int]:
+        """Return input and output token counts."""
+        return self.usage.get_tokens()
+
+    def reset_tokens(self) -> None:
+        """Reset aggregate token counts (prefer `usage_scope` to measure a single request)."""
+        self.usage.reset()
+
+    def get_query_log(self) -> list:
+        """Retrieve query log."""
+        return list(self.query_log)
+
+    def reset_query_log(self) -> None:
+        """Reset query log."""
+        self.query_log.clear()
+
+    @override
+    def valid_models(self) -> list[str]:
+        """Returns a list of valid model engines."""
+        try:
+            return list(self._config.get(self.provider, {}).keys())
+        except KeyError:
+            return []
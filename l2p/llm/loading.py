@@ -0,0 +1,100 @@
+"""
+This file contains the loader used by local model providers (HUGGING_FACE, VLLM) to load
+their weights lazily. A provider created with `lazy=True` returns immediately and loads on
+a background thread (or on its first query), while `ready()` / `wait_ready(timeout)` report
+whether it can serve requests.
+"""
+
+import threading, time
+from typing import Callable
+
+
+class ModelLoader:
+    def __init__(self, load: Callable[[], None], name: str = "model") -> None:
+        """
+        Runs a provider's (blocking) load function once, either in the calling thread or on
+        a background thread, and lets any number of threads wait for it.
+
+        Args:
+            load (Callable): function loading the model
+            name (str): model name used in log messages, defaults to 'model'
+        """
+        self._load = load
+        self.name = name
+        self.load_time: float | None = None
+
+        self._started = False
+        self._done = threading.Event()
+        self._error: BaseException | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        """True once loading has started."""
+        return self._started
+
+    def _claim(self) -> bool:
+        """Mark loading as started; returns False if it already was."""
+        with self._lock:
+            if self._started:
+                return False
+            self._started = True
+            return True
+
+    def _run(self) -> None:
+        start = time.perf_counter()
+        try:
+            self._load()
+        except BaseException as e:
+            self._error = e
+            raise
+        finally:
+            self.load_time = time.perf_counter() - start
+            self._done.set()
+
+    def _run_background(self) -> None:
+        try:
+            self._run()
+        except BaseException as e:
+            # the error is raised again by `wait` in the threads that use the model
+            print(f"[ERROR] Failed to load {self.name}: {e}")
+
+    def start(self, background: bool = True) -> None:
+        """
+        Start loading unless it already started.
+
+        Args:
+            background (bool): load on a background thread instead of blocking, defaults to True
+        """
+        if not self._claim():
+            return
+        if background:
+            threading.Thread(target=self._run_background, daemon=True).start()
+        else:
+            self._run()
+
+    def ensure(self) -> None:
+        """Block until loaded, loading in the calling thread if loading has not started."""
+        self.start(background=False)
+        self.wait()
+
+    def ready(self) -> bool:
+        """True if the model is loaded and can serve requests."""
+        return self._done.is_set() and self._error is None
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Wait for loading to finish. If loading has not started, it is started in the background.
+
+        Args:
+            timeout (float): max seconds to wait, defaults to None (no limit)
+
+        Returns:
+            ready (bool): True if loaded, False if `timeout` expired first
+        """
+        self.start(background=True)
+        if not self._done.wait(timeout):
+            return False
+        if self._error is not None:
+            raise RuntimeError(f"Failed to load {self.name}.") from self._error
+        return True
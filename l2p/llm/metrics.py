@@ -0,0 +1,447 @@
+"""
+This file contains the latency and throughput telemetry of LLM queries. Provider query
+methods are decorated with `measured`, which times each query and records, per provider
+and engine, in the process-wide `metrics_registry`:
+    1. l2p_llm_request_seconds - wall time of successful queries
+    2. l2p_llm_time_to_first_token_seconds - time until the first streamed chunk
+    3. l2p_llm_wait_seconds - time spent waiting for rate-limit quota or a free model / connection
+    4. l2p_llm_output_tokens_per_second - output tokens over generation time (wall time minus waiting)
+    5. l2p_llm_requests_total, l2p_llm_errors_total, l2p_llm_retries_total,
+       l2p_llm_output_tokens_total - counters
+
+Histograms keep cumulative buckets and a window of recent values for percentiles. Export
+a snapshot with `metrics_registry.to_json()` or `metrics_registry.to_prometheus()`.
+"""
+
+import bisect, functools, inspect, json, math, threading, time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+METRICS = {
+    "l2p_llm_request_seconds": ("histogram", "Wall time of successful LLM queries."),
+    "l2p_llm_time_to_first_token_seconds": (
+        "histogram",
+        "Time until the first chunk of streamed LLM queries.",
+    ),
+    "l2p_llm_wait_seconds": (
+        "histogram",
+        "Time LLM queries waited for rate-limit quota, a free model or a connection.",
+    ),
+    "l2p_llm_output_tokens_per_second": (
+        "histogram",
+        "Output tokens per second of generation (wall time minus waiting).",
+    ),
+    "l2p_llm_requests_total": ("counter", "LLM queries sent."),
+    "l2p_llm_errors_total": ("counter", "LLM queries that raised an error."),
+    "l2p_llm_retries_total": ("counter", "Retried LLM request attempts."),
+    "l2p_llm_output_tokens_total": ("counter", "Output tokens of LLM queries."),
+    "l2p_llm_failovers_total": (
+        "counter",
+        "Queries a router moved to another backend.",
+    ),
+    "l2p_llm_hedges_total": (
+        "counter",
+        "Duplicate requests sent for slow LLM requests.",
+    ),
+    "l2p_llm_hedge_wins_total": ("counter", "Duplicate requests that responded first."),
+}
+
+
+class Counter:
+    def __init__(self) -> None:
+        """Thread-safe monotonic counter."""
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def summary(self) -> dict:
+        return {"value": self.value}
+
+
+class Histogram:
+    def __init__(
+        self, buckets: tuple[float, ...] = LATENCY_BUCKETS, window: int = 1024
+    ) -> None:
+        """
+        Thread-safe histogram with cumulative buckets (for Prometheus) and a window of
+        recent values (for percentiles).
+
+        Args:
+            buckets (tuple[float, ...]): upper bounds of the buckets, defaults to LATENCY_BUCKETS
+            window (int): # of recent values kept for percentiles, defaults to 1024
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.count = 0
+        self.sum = 0.0
+        self._bucket_counts = [0] * (len(self.buckets) + 1)  # last: +Inf
+        self._recent: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self._bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._recent.append(value)
+
+    def percentile(self, q: float) -> float | None:
+        """
+        Return the `q` percentile (0 to 1) of recent values, or None if there are none.
+        """
+        with self._lock:
+            values = sorted(self._recent)
+        if not values:
+            return None
+        index = min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))
+        return values[index]
+
+    def cumulative_buckets(self) -> list[tuple[float, int]]:
+        """Return (upper bound, # of values <= bound) pairs, ending with +Inf."""
+        with self._lock:
+            counts = list(self._bucket_counts)
+        total, cumulative = 0, []
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+        }
+
+
+def _label_key(labels: dict | None) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = []
+    for k, v in labels + extra:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{k}="{v}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        """Thread-safe registry of labelled counters and histograms."""
+        self._metrics: dict[str, dict[tuple, Counter | Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, labels: dict | None, factory: Callable) -> Any:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._metrics.setdefault(name, {})
+            metric = series.get(key)
+            if metric is None:
+                metric = series[key] = factory()
+            return metric
+
+    def counter(self, name: str, labels: dict | None = None) -> Counter:
+        """Return the counter `name` with `labels`, creating it on first use."""
+        return self._get(name, labels, Counter)
+
+    def histogram(
+        self,
+        name: str,
+        labels: dict | None = None,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """Return the histogram `name` with `labels`, creating it on first use."""
+        return self._get(name, labels, lambda: Histogram(buckets))
+
+    def find(self, name: str, labels: dict | None = None) -> Counter | Histogram | None:
+        """Return the metric `name` with `labels` if it has been recorded."""
+        with self._lock:
+            return self._metrics.get(name, {}).get(_label_key(labels))
+
+    def snapshot(self, labels: dict | None = None) -> dict[str, list[dict]]:
+        """
+        Return the summaries of all metrics.
+
+        Args:
+            labels (dict): only include series with these labels (i.e. {'engine': 'gpt-4o-mini'}), defaults to None
+
+        Returns:
+            snapshot (dict): metric name -> list of {'labels': ..., **summary}
+        """
+        wanted = set((labels or {}).items())
+        with self._lock:
+            metrics = {name: dict(series) for name, series in self._metrics.items()}
+
+        snapshot = {}
+        for name, series in sorted(metrics.items()):
+            entries = [
+                {"labels": dict(key), **metric.summary()}
+                for key, metric in series.items()
+                if wanted <= set(key)
+            ]
+            if entries:
+                snapshot[name] = entries
+        return snapshot
+
+    def to_json(self, **kwargs) -> str:
+        """Return `snapshot()` as JSON (keyword arguments are passed to `json.dumps`)."""
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = {name: dict(series) for name, series in self._metrics.items()}
+
+        lines = []
+        for name, series in sorted(metrics.items()):
+            kind, help_text = METRICS.get(name, (None, None))
+            if kind is None:
+                kind = (
+                    "histogram"
+                    if isinstance(next(iter(series.values())), Histogram)
+                    else "counter"
+                )
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for key, metric in sorted(series.items()):
+                if isinstance(metric, Counter):
+                    lines.append(f"{name}{_format_labels(key)} {metric.value}")
+                    continue
+                for bound, count in metric.cumulative_buckets():
+                    le = "+Inf" if bound == math.inf else repr(float(bound))
+                    lines.append(
+                        f"{name}_bucket{_format_labels(key, (('le', le),))} {count}"
+                    )
+                lines.append(f"{name}_sum{_format_labels(key)} {metric.sum}")
+                lines.append(f"{name}_count{_format_labels(key)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Remove all metrics."""
+        with self._lock:
+            self._metrics.clear()
+
+
+# process-wide metrics shared by all providers
+metrics_registry = MetricsRegistry()
+
+# timer of the query running in the current context
+_current: ContextVar["QueryTimer | None"] = ContextVar("query_timer", default=None)
+
+
+class QueryTimer:
+    def __init__(
+        self,
+        labels: dict,
+        owner: Any = None,
+        registry: MetricsRegistry = metrics_registry,
+    ) -> None:
+        """
+        Timing of a single query, recorded in `registry` when it finishes.
+
+        Args:
+            labels (dict): labels of the recorded metrics (i.e. provider and engine)
+            owner (Any): LLM instance running the query; its nested queries are not timed again, defaults to None
+            registry (MetricsRegistry): registry to record in, defaults to `metrics_registry`
+        """
+        self.labels = labels
+        self.owner = owner
+        self.registry = registry
+        self.started = time.perf_counter()
+        self.ended: float | None = None
+        self.ttft_s: float | None = None
+        self.wait_s = 0.0
+        self.retries = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed_s(self) -> float:
+        return (self.ended or time.perf_counter()) - self.started
+
+    def first_token(self) -> None:
+        """Mark the arrival of the first streamed chunk."""
+        if self.ttft_s is None:
+            self.ttft_s = time.perf_counter() - self.started
+
+    def add_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.wait_s += seconds
+
+    def add_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def add_output_tokens(self, tokens: int) -> None:
+        with self._lock:
+            self.output_tokens += tokens
+
+    @contextmanager
+    def active(self):
+        """Make this the current query timer, so waits, retries and tokens are recorded in it."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def finish(self, error: BaseException | None = None) -> None:
+        """Record the query's metrics; a failed query only counts as an error."""
+        if self.ended is not None:
+            return
+        self.ended = time.perf_counter()
+
+        registry, labels = self.registry, self.labels
+        registry.counter("l2p_llm_requests_total", labels).inc()
+        if self.retries:
+            registry.counter("l2p_llm_retries_total", labels).inc(self.retries)
+        if error is not None:
+            registry.counter("l2p_llm_errors_total", labels).inc()
+            return
+
+        elapsed = self.ended - self.started
+        registry.histogram("l2p_llm_request_seconds", labels).observe(elapsed)
+        registry.histogram("l2p_llm_wait_seconds", labels).observe(self.wait_s)
+        if self.ttft_s is not None:
+            registry.histogram("l2p_llm_time_to_first_token_seconds", labels).observe(
+                self.ttft_s
+            )
+        if self.output_tokens:
+            registry.counter("l2p_llm_output_tokens_total", labels).inc(
+                self.output_tokens
+            )
+            generation_s = elapsed - self.wait_s
+            if generation_s > 0:
+                registry.histogram(
+                    "l2p_llm_output_tokens_per_second", labels, THROUGHPUT_BUCKETS
+                ).observe(self.output_tokens / generation_s)
+
+
+def current_timer() -> QueryTimer | None:
+    """Return the timer of the query running in the current context, if any."""
+    return _current.get()
+
+
+def record_wait(seconds: float) -> None:
+    """Add rate-limit or queue wait time to the current query."""
+    timer = _current.get()
+    if timer is not None and seconds:
+        timer.add_wait(seconds)
+
+
+def record_retry() -> None:
+    """Count a retried attempt of the current query."""
+    timer = _current.get()
+    if timer is not None:
+        timer.add_retry()
+
+
+def record_output_tokens(tokens: int) -> None:
+    """Add output tokens to the current query."""
+    timer = _current.get()
+    if timer is not None and tokens:
+        timer.add_output_tokens(tokens)
+
+
+@contextmanager
+def queued(lock):
+    """Acquire `lock`, recording the time spent waiting for it as queue wait."""
+    started = time.perf_counter()
+    with lock:
+        record_wait(time.perf_counter() - started)
+        yield
+
+
+def measured(func: Callable) -> Callable:
+    """
+    Decorator timing a query method of a BaseLLM (a function, coroutine function or
+    generator function). Queries an instance makes from within one of its own timed
+    queries (i.e. `query_stream` falling back to `query`) are part of the outer query.
+    """
+
+    def nested(self) -> bool:
+        timer = _current.get()
+        return timer is not None and timer.owner is self and timer.ended is None
+
+    if inspect.isgeneratorfunction(func):
+
+        @functools.wraps(func)
+        def stream_wrapper(self, *args, **kwargs):
+            if nested(self):
+                yield from func(self, *args, **kwargs)
+                return
+
+            timer = self._query_timer()
+            chunks = func(self, *args, **kwargs)
+            error = None
+            try:
+                while True:
+                    # each step of the generator runs with the timer active
+                    with timer.active():
+                        try:
+                            chunk = next(chunks)
+                        except StopIteration:
+                            break
+                    if chunk:
+                        timer.first_token()
+                    yield chunk
+            except GeneratorExit:
+                raise
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                with timer.active():
+                    chunks.close()
+                timer.finish(error)
+
+        return stream_wrapper
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            if nested(self):
+                return await func(self, *args, **kwargs)
+
+            timer = self._query_timer()
+            with timer.active():
+                try:
+                    result = await func(self, *args, **kwargs)
+                except BaseException as e:
+                    timer.finish(e)
+                    raise
+            timer.finish()
+            return result
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if nested(self):
+            return func(self, *args, **kwargs)
+
+        timer = self._query_timer()
+        with timer.active():
+            try:
+                result = func(self, *args, **kwargs)
+            except BaseException as e:
+                timer.finish(e)
+                raise
+        timer.finish()
+        return result
+
+    return wrapper
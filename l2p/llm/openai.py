@@ -11,9 +11,17 @@ Users can also define their own custom models and parameters by extending the YA
 configuration using the same format template.
 """
 
-from retry import retry
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from typing_extensions import override
 from .base import BaseLLM, load_yaml
+from .hedging import HedgeAttempt, HedgePolicy
+from .metrics import measured, record_output_tokens, record_wait
+from .query_log import QueryLog
+from .rate_limit import get_rate_limiter
+from .retry_policy import RetryPolicy
+from .tokens import get_encoding, get_token_counter, usage_counts
+from .usage import UsageMeter, in_context
 
 
 class OPENAI(BaseLLM):
@@ -24,6 +32,8 @@ class OPENAI(BaseLLM):
         provider: str = "openai",
         api_key: str | None = None,
         base_url: str = "https://api.openai.com/v1/",
+        retry_policy: RetryPolicy | None = None,
+        hedging: HedgePolicy | dict | None = None,
     ) -> None:
 
         # load yaml configuration path
@@ -32,37 +42,55 @@ class OPENAI(BaseLLM):
 
         # attempt to import necessary OPENAI modules
         try:
-            from openai import OpenAI
+            from openai import AsyncOpenAI, OpenAI
         except ImportError:
             raise ImportError(
                 "The 'openai' library is required for OPENAI but is not installed. "
                 "Install it using: `pip install openai`."
             )
 
-        try:
-            import tiktoken
-        except ImportError:
-            raise ImportError(
-                "The 'tiktoken' library is required for token processing but is not installed. "
-                "Install it using: `pip install tiktoken`."
-            )
-
         # retrieve model configurations
         model_config = self._config.get(self.provider, {}).get(model, {})
         self.model_engine = model_config.get("engine", model)
 
         # call the parent class constructor to handle model and api_key
         super().__init__(model, api_key)
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # retries are handled by `retry_policy`, so the SDK's own retries are disabled
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_site = f"{self.provider}:{self.model_engine}"
+        self.base_url = base_url
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.async_client = AsyncOpenAI(
+            api_key=api_key, base_url=base_url, max_retries=0
+        )
+
+        # optional hedging of slow requests (see `HedgePolicy`), to the same or an alternate endpoint
+        self.hedging = HedgePolicy.from_config(
+            hedging if hedging is not None else model_config.get("hedging")
+        )
+        self.hedge_client = self.client
+        if self.hedging is not None and self.hedging.base_url:
+            self.hedge_client = OpenAI(
+                api_key=api_key, base_url=self.hedging.base_url, max_retries=0
+            )
 
         # set model parameters
         self._set_parameters(model_config)
 
-        # initialize tokenizer and metadata storage
-        self.tok = tiktoken.get_encoding("cl100k_base")
-        self.in_tokens = 0
-        self.out_tokens = 0
-        self.query_log = []  # per-query metadata storage
+        # optional requests/tokens per minute quota, shared by all instances of this engine
+        rate_limits = model_config.get("rate_limits") or {}
+        self.rate_limiter = get_rate_limiter(
+            self.model_engine, rpm=rate_limits.get("rpm"), tpm=rate_limits.get("tpm")
+        )
+
+        # the tokenizer is loaded once per process; its counter memoizes the counts of
+        # recurring message contents (i.e. system prompts) for all instances
+        self.tok = get_encoding("cl100k_base")
+        self.token_counter = get_token_counter("cl100k_base")
+
+        # metadata storage (aggregate usage; see `usage_scope` for the usage of a single request)
+        self.usage = UsageMeter()
+        self.query_log = QueryLog.from_config(model_config.get("query_log"))
 
         # Retrieve cost information for the model from the YAML
         self.cost_per_input_token = model_config.get("cost_usd_mtok", {}).get(
@@ -90,23 +118,24 @@ class OPENAI(BaseLLM):
         parameters = model_config.get("model_params", {})
         for key, default in defaults.items():
             setattr(self, key, parameters.get(key, default))
+        self.sampling_parameter_names = tuple(defaults)
 
-    @retry(tries=2, delay=60)
     def connect_openai(self, client, model, messages, **kwargs):
         """Send a request to OpenAI API"""
 
         return client.chat.completions.create(model=model, messages=messages, **kwargs)
 
-    @override
-    def query(
-        self,
-        prompt: str,
-        messages=None,
-        end_when_error=False,
-        max_retry=3,
-        est_margin=200,
-    ) -> str:
-        """Generate a response from OpenAI based on the prompt."""
+    async def aconnect_openai(self, client, model, messages, **kwargs):
+        """Send an asynchronous request to OpenAI API"""
+
+        return await client.chat.completions.create(
+            model=model, messages=messages, **kwargs
+        )
+
+    def _prepare_request(
+        self, prompt: str, messages=None, est_margin: int = 200
+    ) -> tuple[list, dict, int]:
+        """Build chat messages and completion kwargs for a single request."""
 
         if not isinstance(prompt, str) or not prompt.strip():
             raise ValueError("Prompt must be a non-empty string.")
@@ -114,7 +143,7 @@ class OPENAI(BaseLLM):
         messages = messages or [{"role": "user", "content": prompt}]
 
         # estimate current usage of tokens
-        current_tokens = sum(len(self.tok.encode(m["content"])) for m in messages)
+        current_tokens = self.token_counter.count_messages(messages)
         requested_tokens = min(
             self.max_completion_tokens,
             self.context_length - current_tokens - est_margin,
@@ -125,85 +154,74 @@ class OPENAI(BaseLLM):
             f"(estimated prompt: {current_tokens} tokens, margin: {est_margin}, window: {self.context_length})"
         )
 
-        # request response
-        conn_success, n_retry = False, 0
-        while not conn_success and n_retry < max_retry:
-            try:
-                print(
-                    f"[INFO] connecting to {self.model_engine} ({requested_tokens} tokens)..."
-                )
-
-                kwargs = {
-                    "temperature": self.temperature,
-                    "max_completion_tokens": requested_tokens,
-                    "top_p": self.top_p,
-                    "frequency_penalty": self.frequency_penalty,
-                    "presence_penalty": self.presence_penalty,
-                    "stop": self.stop,
-                }
-
-                # only add reasoning_effort if it is not None
-                if self.reasoning_effort is not None:
-                    kwargs["reasoning_effort"] = self.reasoning_effort
-
-                # retrieve completion
-                response = self.connect_openai(
-                    client=self.client,
-                    model=self.model_engine,
-                    messages=messages,
-                    **kwargs,
-                )
-
-                llm_output = response.choices[
-                    0
-                ].message.content  # retrieve output from completion
-
-                # record token usage
-                usage = getattr(response, "usage", None)
-                if usage:
-                    self.in_tokens += usage.prompt_tokens
-                    self.out_tokens += usage.completion_tokens
-                else:
-                    self.in_tokens += current_tokens
-                    self.out_tokens += len(self.tok.encode(llm_output))
-
-                # calculate cost (USD) per million tokens
-                input_cost = (self.in_tokens / 1_000_000) * self.cost_per_input_token
-                output_cost = (self.out_tokens / 1_000_000) * self.cost_per_output_token
-                total_cost = input_cost + output_cost
-
-                conn_success = True
-
-            except Exception as e:
-                print(f"[ERROR] LLM error: {e}")
-                if end_when_error:
-                    break
+        kwargs = {
+            "temperature": self.temperature,
+            "max_completion_tokens": requested_tokens,
+            "top_p": self.top_p,
+            "frequency_penalty": self.frequency_penalty,
+            "presence_penalty": self.presence_penalty,
+            "stop": self.stop,
+        }
 
-            n_retry += 1
+        # only add reasoning_effort if it is not None
+        if self.reasoning_effort is not None:
+            kwargs["reasoning_effort"] = self.reasoning_effort
 
-        if not conn_success:
-            raise ConnectionError(
-                f"Failed to connect to the LLM after {max_retry} retries"
-            )
+        return messages, kwargs, current_tokens
+
+    def _record_response(self, response, messages: list, current_tokens: int) -> str:
+        """Record token usage, cost and query log of a completion; return its text."""
+
+        llm_output = response.choices[
+            0
+        ].message.content  # retrieve output from completion
+
+        self._record_usage(
+            llm_output, getattr(response, "usage", None), messages, current_tokens
+        )
+        return llm_output
+
+    def _record_usage(
+        self,
+        llm_output: str,
+        usage,
+        messages: list,
+        current_tokens: int,
+        hedge: HedgeAttempt | None = None,
+    ) -> None:
+        """Record token usage, cost and query log of an output (full or streamed)."""
+
+        # record token usage, as reported by the provider when available
+        counts = usage_counts(usage)
+        if counts:
+            prompt_tokens, completion_tokens = counts
+        else:
+            prompt_tokens = current_tokens
+            completion_tokens = self.token_counter.count(llm_output, cache=False)
+        details = getattr(usage, "completion_tokens_details", None)
+
+        # calculate cost (USD) per million tokens of this query
+        input_cost = (prompt_tokens / 1_000_000) * self.cost_per_input_token
+        output_cost = (completion_tokens / 1_000_000) * self.cost_per_output_token
+        total_cost = input_cost + output_cost
+        self.usage.record(prompt_tokens, completion_tokens, total_cost)
+        record_output_tokens(completion_tokens)
 
         # log query information
+        entry = {}
+        if hedge is not None:
+            entry = {
+                "hedge_attempt": hedge.index,
+                "cancelled": hedge.cancelled.is_set(),
+            }
         self.query_log.append(
             {
+                **entry,
                 "model": self.model_engine,
-                "prompt_tokens": usage.prompt_tokens if usage else current_tokens,
-                "completion_tokens": (
-                    usage.completion_tokens
-                    if usage
-                    else len(self.tok.encode(llm_output))
-                ),
-                "reasoning_tokens": (
-                    usage.completion_tokens_details.reasoning_tokens if usage else 0
-                ),
-                "total_tokens": (
-                    usage.total_tokens
-                    if usage
-                    else current_tokens + len(self.tok.encode(llm_output))
-                ),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "reasoning_tokens": (getattr(details, "reasoning_tokens", None) or 0),
+                "total_tokens": prompt_tokens + completion_tokens,
                 "input_cost_usd": input_cost,
                 "output_cost_usd": output_cost,
                 "total_cost_usd": total_cost,
@@ -212,24 +230,273 @@ class OPENAI(BaseLLM):
             }
         )
 
-        return llm_output
+    def _connect(self, messages: list, kwargs: dict, current_tokens: int, client=None):
+        """Send one request attempt, waiting for rate-limit quota first."""
+
+        print(
+            f"[INFO] connecting to {self.model_engine} ({kwargs['max_completion_tokens']} tokens)..."
+        )
+
+        # wait for quota (estimated prompt + requested completion tokens)
+        if self.rate_limiter:
+            waited = self.rate_limiter.acquire(
+                current_tokens + kwargs["max_completion_tokens"]
+            )
+            if waited:
+                record_wait(waited)
+                print(f"[INFO] rate limited for {waited:.2f}s")
+
+        # retrieve completion
+        return self.connect_openai(
+            client=client or self.client,
+            model=self.model_engine,
+            messages=messages,
+            **kwargs,
+        )
+
+    def _attempt(self, messages: list, kwargs: dict, current_tokens: int) -> str:
+        """Send one request attempt (hedged if `hedging` is set) and record its response."""
+
+        if self.hedging is not None:
+            return self.hedging.call(
+                [
+                    lambda attempt, client=client: self._hedged_attempt(
+                        attempt, client, messages, kwargs, current_tokens
+                    )
+                    for client in (self.client, self.hedge_client)
+                ],
+                labels=self.metric_labels(),
+                unhedged=lambda: self._record_response(
+                    self._connect(messages, kwargs, current_tokens),
+                    messages,
+                    current_tokens,
+                ),
+            )
+
+        response = self._connect(messages, kwargs, current_tokens)
+        return self._record_response(response, messages, current_tokens)
+
+    def _hedged_attempt(
+        self,
+        attempt: HedgeAttempt,
+        client,
+        messages: list,
+        kwargs: dict,
+        current_tokens: int,
+    ) -> str:
+        """
+        Send one of the requests of a hedged attempt. The response is streamed, so a
+        cancelled request stops generating (and billing) as soon as its stream is closed.
+        """
+
+        stream = self._connect(
+            messages,
+            {**kwargs, "stream": True, "stream_options": {"include_usage": True}},
+            current_tokens,
+            client=client,
+        )
+        if hasattr(stream, "close"):
+            attempt.on_cancel(stream.close)
+
+        chunks, usage = [], None
+        try:
+            for chunk in stream:
+                if attempt.cancelled.is_set():
+                    break
+                # final chunk carries usage and no choices
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            self._record_usage(
+                "".join(chunks), usage, messages, current_tokens, hedge=attempt
+            )
+        return "".join(chunks)
+
+    async def _aattempt(self, messages: list, kwargs: dict, current_tokens: int) -> str:
+        """Send one asynchronous request attempt, waiting for rate-limit quota first."""
+
+        print(
+            f"[INFO] connecting to {self.model_engine} ({kwargs['max_completion_tokens']} tokens)..."
+        )
+
+        # wait for quota (estimated prompt + requested completion tokens)
+        if self.rate_limiter:
+            waited = await self.rate_limiter.aacquire(
+                current_tokens + kwargs["max_completion_tokens"]
+            )
+            if waited:
+                record_wait(waited)
+                print(f"[INFO] rate limited for {waited:.2f}s")
+
+        # retrieve completion without blocking the event loop
+        response = await self.aconnect_openai(
+            client=self.async_client,
+            model=self.model_engine,
+            messages=messages,
+            **kwargs,
+        )
+        return self._record_response(response, messages, current_tokens)
+
+    @override
+    @measured
+    def query(
+        self,
+        prompt: str,
+        messages=None,
+        end_when_error=False,
+        max_retry=None,
+        est_margin=200,
+    ) -> str:
+        """
+        Generate a response from OpenAI based on the prompt. Transient errors are retried
+        by `retry_policy`; `max_retry` overrides its max # of attempts, `end_when_error`
+        disables retries.
+        """
+
+        messages, kwargs, current_tokens = self._prepare_request(
+            prompt, messages, est_margin
+        )
+
+        max_attempts = 1 if end_when_error else max_retry
+        try:
+            return self.retry_policy.call(
+                self._attempt,
+                messages,
+                kwargs,
+                current_tokens,
+                site=self.retry_site,
+                max_attempts=max_attempts,
+            )
+        except Exception as e:
+            if not self.retry_policy.is_retryable(e):
+                raise
+            raise ConnectionError(
+                f"Failed to connect to the LLM after {max_attempts or self.retry_policy.max_attempts} attempts"
+            ) from e
+
+    @override
+    @measured
+    async def aquery(
+        self,
+        prompt: str,
+        messages=None,
+        end_when_error=False,
+        max_retry=None,
+        est_margin=200,
+    ) -> str:
+        """Asynchronously generate a response from OpenAI based on the prompt."""
+
+        messages, kwargs, current_tokens = self._prepare_request(
+            prompt, messages, est_margin
+        )
+
+        max_attempts = 1 if end_when_error else max_retry
+        try:
+            return await self.retry_policy.acall(
+                self._aattempt,
+                messages,
+                kwargs,
+                current_tokens,
+                site=self.retry_site,
+                max_attempts=max_attempts,
+            )
+        except Exception as e:
+            if not self.retry_policy.is_retryable(e):
+                raise
+            raise ConnectionError(
+                f"Failed to connect to the LLM after {max_attempts or self.retry_policy.max_attempts} attempts"
+            ) from e
+
+    @override
+    @measured
+    def query_stream(
+        self,
+        prompt: str,
+        messages=None,
+        end_when_error=False,
+        max_retry=None,
+        est_margin=200,
+    ) -> Iterator[str]:
+        """
+        Generate a response from OpenAI based on the prompt, yielding text chunks as they
+        arrive. Closing the generator early closes the underlying HTTP stream; usage is
+        recorded for whatever was generated.
+        """
+
+        messages, kwargs, current_tokens = self._prepare_request(
+            prompt, messages, est_margin
+        )
+        kwargs["stream"] = True
+        kwargs["stream_options"] = {"include_usage": True}
+
+        # only opening the stream is retried; a broken stream is raised to the caller
+        max_attempts = 1 if end_when_error else max_retry
+        try:
+            stream = self.retry_policy.call(
+                self._connect,
+                messages,
+                kwargs,
+                current_tokens,
+                site=self.retry_site,
+                max_attempts=max_attempts,
+            )
+        except Exception as e:
+            if not self.retry_policy.is_retryable(e):
+                raise
+            raise ConnectionError(
+                f"Failed to connect to the LLM after {max_attempts or self.retry_policy.max_attempts} attempts"
+            ) from e
+
+        chunks, usage = [], None
+        try:
+            for chunk in stream:
+                # final chunk carries usage and no choices
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            self._record_usage("".join(chunks), usage, messages, current_tokens)
+
+    @override
+    def query_batch(
+        self,
+        prompts: list[str],
+        max_workers: int = 8,
+        **kwargs,
+    ) -> list[str]:
+        """Generate responses for a batch of prompts concurrently over a bounded thread pool."""
+
+        if not prompts:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(prompts))) as pool:
+            # workers record usage in the caller's scopes
+            query = in_context(lambda prompt: self.query(prompt, **kwargs))
+            return list(pool.map(query, prompts))
 
     def get_tokens(self) -> tuple[int, int]:
         """Return input and output token counts."""
-        return self.in_tokens, self.out_tokens
+        return self.usage.get_tokens()
 
     def reset_tokens(self) -> None:
-        """Reset token counts."""
-        self.in_tokens = 0
-        self.out_tokens = 0
+        """Reset aggregate token counts (prefer `usage_scope` to measure a single request)."""
+        self.usage.reset()
 
     def get_query_log(self) -> list:
         """Retrieve query log."""
-        return self.query_log
+        return list(self.query_log)
 
     def reset_query_log(self) -> None:
         """Reset query log."""
-        self.query_log = []
+        self.query_log.clear()
 
     @override
     def valid_models(self) -> list[str]:
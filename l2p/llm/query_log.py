@@ -0,0 +1,236 @@
+"""
+This file contains the bounded query log used by all providers (`llm.query_log`). Recent
+entries are kept in an in-memory ring buffer, and every entry can optionally be streamed to
+a gzip-compressed JSONL file, so long-running workers keep a flat memory footprint while
+the full history stays available through `QueryLog.history()`.
+
+The log is configured per model in 'l2p/llm/utils/llm.yaml':
+    query_log:
+      maxlen: 1000                   # entries kept in memory (null: unbounded)
+      path: logs/gpt-4o-mini.jsonl.gz  # spill file (null: no spill)
+      retention: full                # fields kept in memory: full | metadata
+      spill_retention: full          # fields written to the spill file: full | metadata
+"""
+
+import contextvars, gzip, json, os, threading, weakref
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+# entry fields holding prompt and response text, dropped by the "metadata" retention
+TEXT_FIELDS = ("prompt", "messages", "output")
+RETENTIONS = ("full", "metadata")
+
+# (log, entries) of the captures entered in the current context (see `QueryLog.capture`)
+_captures: contextvars.ContextVar[tuple[tuple["QueryLog", list], ...]] = (
+    contextvars.ContextVar("query_log_captures", default=())
+)
+
+
+def _retain(entry: dict, retention: str) -> dict:
+    if retention == "metadata":
+        return {k: v for k, v in entry.items() if k not in TEXT_FIELDS}
+    return entry
+
+
+class _SpillWriter:
+    def __init__(self, path: str) -> None:
+        """Appends JSON lines to a gzip file; shared by all logs spilling to the same path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = gzip.open(path, "at", encoding="utf-8")
+        self.unflushed = 0
+        weakref.finalize(self, self.file.close)
+
+    def write(self, entry: dict, flush_every: int) -> None:
+        line = json.dumps(entry, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.unflushed += 1
+            if self.unflushed >= flush_every:
+                self._flush()
+
+    def _flush(self) -> None:
+        # a sync flush makes every written line readable before the file is closed
+        self.file.flush()
+        self.unflushed = 0
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.unflushed:
+                self._flush()
+
+
+# process-wide spill writers, so logs sharing a path never interleave gzip streams
+_writers: dict[str, _SpillWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def _get_writer(path: str) -> _SpillWriter:
+    path = os.path.abspath(path)
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = _SpillWriter(path)
+        return writer
+
+
+class QueryLog:
+    def __init__(
+        self,
+        maxlen: int | None = 1000,
+        path: str | None = None,
+        retention: str = "full",
+        spill_retention: str = "full",
+        flush_every: int = 32,
+    ) -> None:
+        """
+        Thread-safe log of query entries (dicts), used like a list: `append`, `len`,
+        indexing (i.e. `log[-1]`), iteration and `clear` apply to the in-memory entries.
+
+        Args:
+            maxlen (int): # of most recent entries kept in memory, defaults to 1000 (None: unbounded)
+            path (str): gzip JSONL file every entry is appended to, defaults to None (no spill)
+            retention (str): fields kept in memory, 'full' or 'metadata' (no prompt/output text), defaults to 'full'
+            spill_retention (str): fields written to `path`, 'full' or 'metadata', defaults to 'full'
+            flush_every (int): # of entries buffered before the spill file is flushed, defaults to 32
+        """
+        for name, value in (
+            ("retention", retention),
+            ("spill_retention", spill_retention),
+        ):
+            if value not in RETENTIONS:
+                raise ValueError(f"{name} must be one of {RETENTIONS}, got '{value}'.")
+        if maxlen is not None and (not isinstance(maxlen, int) or maxlen < 0):
+            raise ValueError("maxlen must be a non-negative integer or None.")
+
+        self.maxlen = maxlen
+        self.path = path
+        self.retention = retention
+        self.spill_retention = spill_retention
+        self.flush_every = max(1, flush_every)
+
+        # total # of entries ever appended (not reset by `clear`)
+        self.total = 0
+
+        self._entries: deque = deque(maxlen=maxlen)
+        self._writer = _get_writer(path) if path else None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict | None) -> "QueryLog":
+        """
+        Build a query log from the `query_log` entry of a model configuration.
+
+        Args:
+            config (dict): keys `maxlen`, `path`, `retention`, `spill_retention` and `flush_every`, defaults to None (default log)
+
+        Returns:
+            log (QueryLog): configured query log
+        """
+        if config is None:
+            return cls()
+        if not isinstance(config, dict):
+            raise TypeError("query_log must be a mapping of settings.")
+
+        unknown = set(config) - {
+            "maxlen",
+            "path",
+            "retention",
+            "spill_retention",
+            "flush_every",
+        }
+        if unknown:
+            raise ValueError(f"Unknown query_log settings: {sorted(unknown)}.")
+        return cls(**config)
+
+    def append(self, entry: dict) -> None:
+        """Record an entry in memory and, if spilling, in the spill file."""
+        with self._lock:
+            self._entries.append(_retain(entry, self.retention))
+            self.total += 1
+        for log, entries in _captures.get():
+            if log is self:
+                entries.append(entry)
+        if self._writer is not None:
+            self._writer.write(_retain(entry, self.spill_retention), self.flush_every)
+
+    def since(self, mark: int) -> list[dict]:
+        """
+        Return the in-memory entries appended after `total` was `mark`.
+
+        Args:
+            mark (int): earlier value of `total`
+
+        Returns:
+            entries (list[dict]): newer entries, oldest first (older ones may have been evicted)
+        """
+        with self._lock:
+            n = min(self.total - mark, len(self._entries))
+            return list(self._entries)[len(self._entries) - n :] if n > 0 else []
+
+    @contextmanager
+    def capture(self) -> Iterator[list[dict]]:
+        """
+        Collect the entries appended in the current context (the current thread or asyncio
+        task, and work it hands to `in_context`), so a caller sees only the entries of its
+        own queries while other threads share the log.
+
+        Yields:
+            entries (list[dict]): entries appended while the capture is active, oldest first
+        """
+        entries: list[dict] = []
+        token = _captures.set(_captures.get() + ((self, entries),))
+        try:
+            yield entries
+        finally:
+            _captures.reset(token)
+
+    def clear(self) -> None:
+        """Remove the in-memory entries (the spill file is kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def flush(self) -> None:
+        """Write buffered entries to the spill file."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def history(self) -> Iterator[dict]:
+        """
+        Iterate over the full history, oldest first: the spill file if spilling (with its
+        `spill_retention` fields, including entries of earlier runs and other logs using
+        the same path), otherwise the in-memory entries.
+        """
+        if self._writer is None:
+            yield from list(self)
+            return
+
+        self.flush()
+        with gzip.open(self._writer.path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            except EOFError:
+                # the stream written by this process is not closed yet
+                return
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                return list(self._entries)[index]
+            return self._entries[index]
+
+    def __iter__(self) -> Iterator[dict]:
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __repr__(self) -> str:
+        return f"QueryLog(entries={len(self)}, total={self.total}, path={self.path!r})"
@@ -0,0 +1,118 @@
+"""
+This file contains a token-bucket rate limiter for API-based LLM providers. Limits are
+given as requests per minute (rpm) and tokens per minute (tpm), i.e. through the
+optional `rate_limits` entry of a model in 'l2p/llm/utils/llm.yaml'.
+
+Limiters are shared process-wide per model engine (see `get_rate_limiter`), so every
+provider instance using the same engine draws from the same quota. Each request is
+admitted based on its estimated prompt tokens plus requested completion tokens, which
+keeps a pipeline running at quota instead of hitting rate-limit (429) errors.
+"""
+
+import asyncio, threading, time
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_rate: float) -> None:
+        """
+        Token bucket that refills continuously up to `capacity`. Reservations may
+        drive the level negative; the deficit is the time the caller has to wait.
+
+        Args:
+            capacity (float): maximum number of tokens held by the bucket
+            refill_rate (float): tokens added per second
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` tokens from the bucket and return seconds to wait until they are available."""
+
+        now = time.monotonic()
+        self.level = min(
+            self.capacity, self.level + (now - self.updated) * self.refill_rate
+        )
+        self.updated = now
+
+        self.level -= amount
+        return max(0.0, -self.level / self.refill_rate)
+
+
+class RateLimiter:
+    def __init__(self, rpm: int | None = None, tpm: int | None = None) -> None:
+        """
+        Rate limiter enforcing requests per minute and tokens per minute quotas.
+
+        Args:
+            rpm (int): max requests per minute, defaults to None (unlimited)
+            tpm (int): max tokens (prompt + completion) per minute, defaults to None (unlimited)
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = TokenBucket(rpm, rpm / 60) if rpm else None
+        self._tokens = TokenBucket(tpm, tpm / 60) if tpm else None
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserve quota for one request of `tokens` tokens.
+
+        Args:
+            tokens (int): estimated prompt tokens plus requested completion tokens
+
+        Returns:
+            delay (float): seconds the caller must wait before sending the request
+        """
+        with self._lock:
+            delay = 0.0
+            if self._requests:
+                delay = max(delay, self._requests.reserve(1))
+            if self._tokens:
+                delay = max(delay, self._tokens.reserve(tokens))
+            return delay
+
+    def acquire(self, tokens: int) -> float:
+        """Block until a request of `tokens` tokens is admitted; returns seconds waited."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def aacquire(self, tokens: int) -> float:
+        """Asynchronously wait until a request of `tokens` tokens is admitted; returns seconds waited."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+# process-wide limiters, shared by all provider instances of the same engine
+_rate_limiters: dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    engine: str, rpm: int | None = None, tpm: int | None = None
+) -> RateLimiter | None:
+    """
+    Retrieve the process-wide rate limiter of a model engine, creating it on first use.
+    The limits given on first use apply to every later instance of the same engine.
+
+    Args:
+        engine (str): model engine name (i.e. 'gpt-4o-mini')
+        rpm (int): max requests per minute, defaults to None (unlimited)
+        tpm (int): max tokens per minute, defaults to None (unlimited)
+
+    Returns:
+        rate_limiter (RateLimiter | None): shared limiter, or None if no limits are set
+    """
+    if not rpm and not tpm:
+        return None
+
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(engine)
+        if limiter is None:
+            limiter = _rate_limiters[engine] = RateLimiter(rpm=rpm, tpm=tpm)
+        return limiter
@@ -0,0 +1,101 @@
+"""
+This file contains a process-wide registry of loaded models. Local providers (i.e.
+HUGGING_FACE) acquire their model and tokenizer through it, so every instance built for the
+same model (same path, dtype, quantization, device map and loading mode) shares one copy of
+the weights instead of loading its own.
+
+Entries are reference counted: each `acquire` must be paired with a `release` (i.e. through
+`HUGGING_FACE.unload()`), and an entry is dropped once no instance uses it anymore.
+"""
+
+import threading
+from typing import Any, Callable, Hashable
+
+
+class _Entry:
+    def __init__(self, value: Any) -> None:
+        self.value = value
+        self.refs = 1
+
+
+class ModelRegistry:
+    def __init__(self) -> None:
+        """Thread-safe registry of shared, reference-counted objects (i.e. models)."""
+        self._entries: dict[Hashable, _Entry] = {}
+        self._loading: dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Return the object registered under `key`, loading it with `loader` on first use.
+        Concurrent first uses of the same key load it only once.
+
+        Args:
+            key (Hashable): identity of the object (i.e. model path, dtype, quantization, device map)
+            loader (Callable): function loading the object
+
+        Returns:
+            value (Any): shared object; its reference count is incremented
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refs += 1
+                    return entry.value
+                load_lock = self._loading.setdefault(key, threading.Lock())
+
+            # only one thread loads a key; the others wait and then find the entry
+            with load_lock:
+                with self._lock:
+                    if key in self._entries or self._loading.get(key) is not load_lock:
+                        continue
+
+                try:
+                    value = loader()
+                except BaseException:
+                    with self._lock:
+                        self._loading.pop(key, None)
+                    raise
+
+                with self._lock:
+                    self._entries[key] = _Entry(value)
+                    self._loading.pop(key, None)
+                return value
+
+    def release(self, key: Hashable) -> bool:
+        """
+        Release one reference to `key`; the entry is dropped when none remain.
+
+        Returns:
+            unloaded (bool): True if the entry was dropped
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry.refs -= 1
+            if entry.refs > 0:
+                return False
+            del self._entries[key]
+            return True
+
+    def unload(self, key: Hashable) -> bool:
+        """Drop the entry of `key` regardless of its references; returns False if not registered."""
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def refcount(self, key: Hashable) -> int:
+        """Return the number of references to `key` (0 if not registered)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.refs if entry is not None else 0
+
+    def keys(self) -> list[Hashable]:
+        """Return the keys of all registered entries."""
+        with self._lock:
+            return list(self._entries)
+
+
+# process-wide registry used by local providers
+model_registry = ModelRegistry()
@@ -0,0 +1,229 @@
+"""
+This file contains the retry policy shared by L2P's LLM providers. A single policy object
+replaces fixed delays with exponential backoff and jitter, honors `Retry-After` headers
+sent with rate-limit responses, and classifies errors so that only transient failures
+(transport errors, timeouts, rate limits and 5xx responses) are retried; requests which can
+never succeed (i.e. 400 bad request, authentication errors or bugs) fail at once.
+
+Each call site (i.e. 'openai:gpt-4o-mini') can additionally be given a retry budget: the
+maximum number of retries allowed within a sliding time window. This stops an outage from
+multiplying every request into `max_attempts` calls.
+"""
+
+import asyncio, http.client, random, threading, time
+from collections import defaultdict, deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable
+from .metrics import record_retry
+
+# HTTP status codes worth retrying: timeout, conflict, too early, rate limit
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429}
+
+# transport errors: the connection failed, timed out or was closed mid-response
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, http.client.HTTPException)
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        multiplier: float = 2.0,
+        jitter: bool = True,
+        retry_budget: int | None = None,
+        budget_window: float = 60.0,
+    ) -> None:
+        """
+        Initializes a retry policy.
+
+        Args:
+            max_attempts (int): max # of attempts per call (first try included), defaults to 3
+            base_delay (float): delay in seconds before the first retry, defaults to 1.0
+            max_delay (float): upper bound of the backoff delay (including `Retry-After`) in seconds, defaults to 60.0
+            multiplier (float): backoff growth factor per attempt, defaults to 2.0
+            jitter (bool): randomize delays to avoid synchronized retries, defaults to True
+            retry_budget (int): max # of retries per call site within `budget_window`, defaults to None (unlimited)
+            budget_window (float): sliding window of the retry budget in seconds, defaults to 60.0
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.retry_budget = retry_budget
+        self.budget_window = budget_window
+
+        self._retries: dict[str, deque] = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """
+        Classify an error as transient (retryable) or fatal. Only transport errors,
+        timeouts and retryable HTTP status codes (408, 409, 425, 429 and 5xx) are
+        transient; any other error (i.e. a bad request or a bug) is fatal.
+
+        Args:
+            error (BaseException): error raised by a request
+
+        Returns:
+            retryable (bool): True if retrying the same request may succeed
+        """
+
+        status_code = getattr(error, "status_code", None)
+        if status_code is None:
+            status_code = getattr(getattr(error, "response", None), "status_code", None)
+
+        if isinstance(status_code, int):
+            return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+
+        if isinstance(error, TRANSIENT_ERRORS):
+            return True
+
+        # i.e. openai.APIConnectionError, openai.APITimeoutError
+        if any(
+            word in cls.__name__
+            for cls in type(error).__mro__
+            for word in ("Timeout", "Connection")
+        ):
+            return True
+
+        return False
+
+    def retry_after(self, error: BaseException) -> float | None:
+        """Return the delay in seconds requested by the server (`Retry-After`), if any."""
+
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if not headers:
+            return None
+
+        try:
+            if headers.get("retry-after-ms") is not None:
+                return float(headers["retry-after-ms"]) / 1000
+
+            value = headers.get("retry-after")
+            if value is None:
+                return None
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                # HTTP-date format
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt: int, error: BaseException | None = None) -> float:
+        """
+        Delay in seconds before retry number `attempt` (starting at 1). A delay requested by
+        the server (`Retry-After`) is used instead, clamped to `max_delay`.
+
+        Args:
+            attempt (int): retry number
+            error (BaseException): error that caused the retry, defaults to None
+
+        Returns:
+            delay (float): seconds to wait before retrying
+        """
+        if error is not None:
+            retry_after = self.retry_after(error)
+            if retry_after is not None:
+                return min(retry_after, self.max_delay)
+
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            # "equal jitter": keep half of the delay, randomize the other half
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        return delay
+
+    def allow_retry(self, site: str) -> bool:
+        """Consume one retry from the budget of a call site; returns False if exhausted."""
+
+        if self.retry_budget is None:
+            return True
+
+        with self._lock:
+            now = time.monotonic()
+            retries = self._retries[site]
+            while retries and now - retries[0] > self.budget_window:
+                retries.popleft()
+
+            if len(retries) >= self.retry_budget:
+                return False
+            retries.append(now)
+            return True
+
+    def _next_delay(
+        self, error: Exception, attempt: int, max_attempts: int, site: str
+    ) -> float | None:
+        """Return the delay before the next attempt, or None if the error must be raised."""
+
+        if not self.is_retryable(error):
+            print(f"[ERROR] LLM error (not retryable): {error}")
+            return None
+        if attempt >= max_attempts:
+            print(f"[ERROR] LLM error: {error}")
+            return None
+        if not self.allow_retry(site):
+            print(f"[ERROR] LLM error: {error}. Retry budget of '{site}' exhausted.")
+            return None
+
+        delay = self.backoff(attempt, error)
+        print(
+            f"[ERROR] LLM error: {error}. Retrying in {delay:.1f}s "
+            f"(attempt {attempt + 1}/{max_attempts})..."
+        )
+        return delay
+
+    def call(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        site: str = "default",
+        max_attempts: int | None = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Call `fn(*args, **kwargs)`, retrying transient errors. The last error is re-raised
+        when it is fatal, attempts run out or the call site's retry budget is exhausted.
+
+        Args:
+            fn (Callable): function to call
+            site (str): call site name used for the retry budget, defaults to 'default'
+            max_attempts (int): overrides the policy's max # of attempts, defaults to None
+        """
+        max_attempts = max_attempts or self.max_attempts
+
+        attempt = 1
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(e, attempt, max_attempts, site)
+                if delay is None:
+                    raise
+            record_retry()
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        site: str = "default",
+        max_attempts: int | None = None,
+        **kwargs,
+    ) -> Any:
+        """Asynchronous version of `call` for coroutine functions."""
+        max_attempts = max_attempts or self.max_attempts
+
+        attempt = 1
+        while True:
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(e, attempt, max_attempts, site)
+                if delay is None:
+                    raise
+            record_retry()
+            await asyncio.sleep(delay)
+            attempt += 1
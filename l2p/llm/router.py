@@ -0,0 +1,312 @@
+"""
+This file contains RouterLLM, a BaseLLM that spreads queries over several backends (i.e.
+OPENAI instances with different `base_url`s, a local HUGGING_FACE model and a VLLMServer).
+Each query goes to the backend with the lowest expected wait: its recent latency times the
+number of queries it is already serving. A backend that fails is skipped for a cool-down
+period (doubling with consecutive failures) and the query fails over to the next backend,
+so builders keep working through a single-backend outage.
+
+Backends whose `query` takes `end_when_error` (i.e. OPENAI, VLLMServer) are queried with
+`end_when_error=True` while other backends remain, so a transient error fails over at once
+instead of after the backend's own retries and backoff; the last backend tried keeps its
+retry policy. Other backends (i.e. a CachedLLM) keep the retries of the model they wrap;
+give it a `RetryPolicy(max_attempts=1)` to fail over just as fast.
+"""
+
+import inspect, threading, time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing_extensions import override
+from .base import BaseLLM
+from .metrics import measured, metrics_registry
+from .retry_policy import RetryPolicy
+from .usage import in_context
+
+
+class _Backend:
+    def __init__(self, name: str, llm: BaseLLM) -> None:
+        self.name = name
+        self.llm = llm
+        self.fails_fast = _accepts_end_when_error(llm)
+        self.in_flight = 0
+        self.latency: float | None = None  # moving average of query wall time
+        self.queries = 0
+        self.failures = 0  # consecutive failures
+        self.errors = 0
+        self.unhealthy_until = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "in_flight": self.in_flight,
+            "latency_s": self.latency,
+            "queries": self.queries,
+            "errors": self.errors,
+            "healthy": self.unhealthy_until <= time.monotonic(),
+        }
+
+
+def _accepts_end_when_error(llm: BaseLLM) -> bool:
+    try:
+        return "end_when_error" in inspect.signature(llm.query).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _backend_name(llm: BaseLLM) -> str:
+    labels = llm.metric_labels()
+    name = f"{labels['provider']}:{labels['engine']}"
+    base_url = getattr(llm, "base_url", None) or getattr(
+        getattr(llm, "pool", None), "base_url", None
+    )
+    return f"{name}@{base_url}" if base_url else name
+
+
+class RouterLLM(BaseLLM):
+    def __init__(
+        self,
+        backends: list[BaseLLM] | dict[str, BaseLLM],
+        max_in_flight: int | None = None,
+        cooldown: float = 10.0,
+        max_cooldown: float = 300.0,
+        latency_decay: float = 0.3,
+        retry_policy: RetryPolicy | None = None,
+        name: str = "router",
+    ) -> None:
+        """
+        Routes each query to one of several backends, failing over to the others on error.
+
+        Args:
+            backends (list[BaseLLM] | dict[str, BaseLLM]): backends in order of preference, optionally by name
+            max_in_flight (int): # of concurrent queries at which a backend counts as saturated and is only used when all others are, defaults to None (unlimited)
+            cooldown (float): seconds a failed backend is skipped, doubled per consecutive failure, defaults to 10.0
+            max_cooldown (float): upper bound of the cool-down in seconds, defaults to 300.0
+            latency_decay (float): weight of the newest latency in the moving average, defaults to 0.3
+            retry_policy (RetryPolicy): classifies errors; fatal errors (i.e. bad requests) are raised without failing over, defaults to RetryPolicy()
+            name (str): name of the router in metrics, defaults to 'router'
+        """
+        if not backends:
+            raise ValueError("RouterLLM requires at least one backend.")
+
+        if not isinstance(backends, dict):
+            names = [_backend_name(llm) for llm in backends]
+            backends = {
+                n if names.count(n) == 1 else f"{n}#{i}": llm
+                for i, (n, llm) in enumerate(zip(names, backends))
+            }
+
+        self.backends = [_Backend(n, llm) for n, llm in backends.items()]
+        self.max_in_flight = max_in_flight
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.latency_decay = latency_decay
+        self.retry_policy = retry_policy or RetryPolicy()
+
+        self.provider = "router"
+        self.model = self.model_engine = name
+        self.failovers = 0
+        self._lock = threading.Lock()
+
+    def _ranked(self) -> list[_Backend]:
+        """Backends in the order they should be tried for the next query."""
+
+        with self._lock:
+            now = time.monotonic()
+            known = [b.latency for b in self.backends if b.latency is not None]
+            average = sum(known) / len(known) if known else 0.0
+
+            def rank(item: tuple[int, _Backend]) -> tuple:
+                i, b = item
+                unhealthy = b.unhealthy_until > now
+                saturated = (
+                    self.max_in_flight is not None and b.in_flight >= self.max_in_flight
+                )
+                latency = b.latency
+                if latency is None:
+                    # idle new backends are tried first; while busy, assumed average
+                    latency = average if b.in_flight else 0.0
+                return (
+                    unhealthy,
+                    b.unhealthy_until if unhealthy else 0.0,
+                    saturated,
+                    latency * (b.in_flight + 1),
+                    b.in_flight,
+                    i,
+                )
+
+            return [b for _, b in sorted(enumerate(self.backends), key=rank)]
+
+    def _start(self, backend: _Backend) -> None:
+        with self._lock:
+            backend.in_flight += 1
+
+    def _succeeded(self, backend: _Backend, latency: float | None) -> None:
+        with self._lock:
+            backend.in_flight -= 1
+            backend.queries += 1
+            backend.failures = 0
+            backend.unhealthy_until = 0.0
+            if latency is not None:
+                backend.latency = (
+                    latency
+                    if backend.latency is None
+                    else self.latency_decay * latency
+                    + (1 - self.latency_decay) * backend.latency
+                )
+
+    def _failed(
+        self, backend: _Backend, error: Exception, failover: bool = True
+    ) -> bool:
+        """Record a failed query; returns True if it should fail over to another backend."""
+
+        retryable = self.retry_policy.is_retryable(error)
+        failover = failover and retryable
+        with self._lock:
+            backend.in_flight -= 1
+            backend.queries += 1
+            backend.errors += 1
+            if retryable:
+                backend.failures += 1
+                cooldown = self.cooldown * 2 ** (backend.failures - 1)
+                backend.unhealthy_until = time.monotonic() + min(
+                    cooldown, self.max_cooldown
+                )
+                self.failovers += failover
+
+        if failover:
+            metrics_registry.counter(
+                "l2p_llm_failovers_total",
+                {**self.metric_labels(), "backend": backend.name},
+            ).inc()
+            print(f"[WARNING] {backend.name} failed ({error}), failing over...")
+        return retryable
+
+    def _all_failed(self) -> ConnectionError:
+        return ConnectionError(
+            f"All {len(self.backends)} backends of {self.model_engine} failed."
+        )
+
+    @override
+    @measured
+    def query(self, prompt: str, **kwargs) -> str:
+        """
+        Query the backend with the lowest expected wait, failing over to the others. Unless
+        `end_when_error` is given, backends taking it do not retry while others remain.
+        """
+
+        error = None
+        ranked = self._ranked()
+        for i, backend in enumerate(ranked):
+            backend_kwargs = kwargs
+            if (
+                backend.fails_fast
+                and i < len(ranked) - 1
+                and "end_when_error" not in kwargs
+            ):
+                backend_kwargs = {**kwargs, "end_when_error": True}
+
+            self._start(backend)
+            started = time.perf_counter()
+            try:
+                llm_output = backend.llm.query(prompt, **backend_kwargs)
+            except Exception as e:
+                if not self._failed(backend, e):
+                    raise
+                error = e
+                continue
+            self._succeeded(backend, time.perf_counter() - started)
+            return llm_output
+
+        raise self._all_failed() from error
+
+    @override
+    @measured
+    def query_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Stream the response of the backend with the lowest expected wait. Fails over to
+        the others only until the first chunk has been received.
+        """
+
+        error = None
+        for backend in self._ranked():
+            self._start(backend)
+            stream = None
+            try:
+                stream = backend.llm.query_stream(prompt, **kwargs)
+                first = next(stream, None)
+            except Exception as e:
+                if stream is not None:
+                    stream.close()
+                if not self._failed(backend, e):
+                    raise
+                error = e
+                continue
+
+            try:
+                if first is not None:
+                    yield first
+                    yield from stream
+            except GeneratorExit:
+                stream.close()
+                self._succeeded(backend, None)
+                raise
+            except Exception as e:
+                # chunks were already returned, so the query cannot move to another backend
+                self._failed(backend, e, failover=False)
+                raise
+            self._succeeded(backend, None)
+            return
+
+        raise self._all_failed() from error
+
+    @override
+    def query_batch(
+        self, prompts: list[str], max_workers: int = 8, **kwargs
+    ) -> list[str]:
+        """Route the prompts of a batch concurrently, so they spread over the backends."""
+
+        if not prompts:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(prompts))) as pool:
+            # workers record usage in the caller's scopes
+            query = in_context(lambda prompt: self.query(prompt, **kwargs))
+            return list(pool.map(query, prompts))
+
+    def get_backend_stats(self) -> list[dict]:
+        """Return load, latency and error counts of each backend."""
+        with self._lock:
+            return [b.stats() for b in self.backends]
+
+    def get_tokens(self) -> tuple[int, int]:
+        """Return input and output token counts summed over all backends."""
+        counts = [
+            b.llm.get_tokens() for b in self.backends if hasattr(b.llm, "get_tokens")
+        ]
+        return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+    def reset_tokens(self) -> None:
+        """Reset token counts of all backends."""
+        for b in self.backends:
+            if hasattr(b.llm, "reset_tokens"):
+                b.llm.reset_tokens()
+
+    def get_query_log(self) -> list:
+        """Retrieve query logs of all backends."""
+        return [
+            entry
+            for b in self.backends
+            if hasattr(b.llm, "get_query_log")
+            for entry in b.llm.get_query_log()
+        ]
+
+    def reset_query_log(self) -> None:
+        """Reset query logs of all backends."""
+        for b in self.backends:
+            if hasattr(b.llm, "reset_query_log"):
+                b.llm.reset_query_log()
+
+    @override
+    def valid_models(self) -> list[str]:
+        """Returns the model engines of the backends."""
+        return [b.llm.metric_labels()["engine"] for b in self.backends]
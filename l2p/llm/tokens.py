@@ -0,0 +1,146 @@
+"""
+This file contains the token accounting shared by all providers:
+    1. get_encoding - `tiktoken` encodings, loaded once per process
+    2. TokenCounter - counts tokens with any tokenizer, memoizing the counts of recurring
+       texts (i.e. system prompts, templates and few-shot examples)
+    3. usage_counts - token counts reported by a provider's response, which are always
+       preferred over counting locally
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Sequence
+
+# process-wide tiktoken encodings and their counters
+_encodings: dict[str, Any] = {}
+_counters: dict[str, "TokenCounter"] = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(name: str = "cl100k_base"):
+    """
+    Retrieve a `tiktoken` encoding, loading it on first use in the process.
+
+    Args:
+        name (str): encoding name, defaults to 'cl100k_base'
+
+    Returns:
+        encoding (tiktoken.Encoding): shared encoding
+    """
+    with _encodings_lock:
+        encoding = _encodings.get(name)
+        if encoding is None:
+            try:
+                import tiktoken
+            except ImportError:
+                raise ImportError(
+                    "The 'tiktoken' library is required for token processing but is not installed. "
+                    "Install it using: `pip install tiktoken`."
+                )
+            encoding = _encodings[name] = tiktoken.get_encoding(name)
+        return encoding
+
+
+def get_token_counter(encoding: str = "cl100k_base") -> "TokenCounter":
+    """
+    Retrieve the process-wide counter of a `tiktoken` encoding, so every instance using
+    the same encoding shares its memoized counts.
+
+    Args:
+        encoding (str): encoding name, defaults to 'cl100k_base'
+
+    Returns:
+        counter (TokenCounter): shared token counter
+    """
+    counter = _counters.get(encoding)
+    if counter is None:
+        tok = get_encoding(encoding)
+        with _encodings_lock:
+            counter = _counters.setdefault(encoding, TokenCounter(tok.encode))
+    return counter
+
+
+class TokenCounter:
+    def __init__(
+        self,
+        encode: Callable[[str], Sequence[int]],
+        cache_size: int = 1024,
+    ) -> None:
+        """
+        Thread-safe token counter. Counts of the `cache_size` most recently counted texts
+        are memoized, so recurring texts are only tokenized once.
+
+        Args:
+            encode (Callable): function returning the tokens of a text
+            cache_size (int): # of memoized counts, defaults to 1024
+        """
+        self.encode = encode
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+        self._counts: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str, cache: bool = True) -> int:
+        """
+        Return the number of tokens of `text`.
+
+        Args:
+            text (str): text to count
+            cache (bool): memoize the count; disable for texts that will not recur (i.e. outputs), defaults to True
+
+        Returns:
+            tokens (int): number of tokens
+        """
+        if not text:
+            return 0
+        if not cache:
+            return len(self.encode(text))
+
+        with self._lock:
+            count = self._counts.get(text)
+            if count is not None:
+                self._counts.move_to_end(text)
+                self.hits += 1
+                return count
+            self.misses += 1
+
+        count = len(self.encode(text))
+        with self._lock:
+            self._counts[text] = count
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_messages(self, messages: list[dict]) -> int:
+        """Return the number of tokens of the contents of chat messages."""
+        return sum(self.count(m.get("content") or "") for m in messages)
+
+    def clear(self) -> None:
+        """Remove all memoized counts."""
+        with self._lock:
+            self._counts.clear()
+
+
+def usage_counts(usage: Any) -> tuple[int, int] | None:
+    """
+    Return the (prompt, completion) token counts reported by a provider.
+
+    Args:
+        usage (Any): usage of a response, as an object (i.e. OpenAI SDK) or dict (i.e. REST API), may be None
+
+    Returns:
+        counts (tuple[int, int] | None): prompt and completion tokens, or None if not reported
+    """
+    if not usage:
+        return None
+    if isinstance(usage, dict):
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+    else:
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+    if prompt_tokens is None or completion_tokens is None:
+        return None
+    return prompt_tokens, completion_tokens
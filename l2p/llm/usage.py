@@ -0,0 +1,140 @@
+"""
+This file contains the usage accounting shared by all providers. Each provider records
+the tokens and cost of every query in its UsageMeter (`llm.usage`), an aggregate that is
+safe to update from many threads at once. The usage of a single request (i.e. one builder
+call) is measured with a scope, instead of resetting the model's counters:
+
+    with usage_scope() as usage:
+        types, llm_output, _ = domain_builder.formalize_types(model=llm, ...)
+    print(usage.prompt_tokens, usage.completion_tokens, usage.cost_usd, usage.elapsed_s)
+
+A scope only records queries made in its own context (the current thread or asyncio task,
+and work it hands to `in_context`), so concurrent requests sharing one model instance
+each see their own usage.
+"""
+
+import contextvars, threading, time
+from contextlib import contextmanager
+from collections.abc import Iterator
+from typing import Callable
+
+# usages of the scopes entered in the current context (innermost last)
+_scopes: contextvars.ContextVar[tuple["Usage", ...]] = contextvars.ContextVar(
+    "usage_scopes", default=()
+)
+
+
+class Usage:
+    def __init__(self) -> None:
+        """Thread-safe token, cost and query counts."""
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def add(
+        self, prompt_tokens: int, completion_tokens: int, cost_usd: float = 0.0
+    ) -> None:
+        """Add the usage of one query."""
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost_usd += cost_usd
+            self.queries += 1
+
+    def get_tokens(self) -> tuple[int, int]:
+        """Return input and output token counts, read together."""
+        with self._lock:
+            return self.prompt_tokens, self.completion_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "cost_usd": self.cost_usd,
+                "queries": self.queries,
+            }
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()})"
+
+
+class UsageMeter(Usage):
+    """Aggregate usage of a model; every recorded query is also added to the active scopes."""
+
+    def record(
+        self, prompt_tokens: int, completion_tokens: int, cost_usd: float = 0.0
+    ) -> None:
+        """
+        Record the usage of one query.
+
+        Args:
+            prompt_tokens (int): input tokens of the query
+            completion_tokens (int): output tokens of the query
+            cost_usd (float): cost of the query, defaults to 0.0
+        """
+        self.add(prompt_tokens, completion_tokens, cost_usd)
+        for scope in _scopes.get():
+            scope.add(prompt_tokens, completion_tokens, cost_usd)
+
+    def reset(self) -> None:
+        """Reset the aggregate counts (active scopes are not affected)."""
+        with self._lock:
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.cost_usd = 0.0
+            self.queries = 0
+
+
+class ScopedUsage(Usage):
+    def __init__(self) -> None:
+        """Usage of the queries made within a `usage_scope`, and its wall time."""
+        super().__init__()
+        self.started = time.perf_counter()
+        self.ended: float | None = None
+
+    @property
+    def elapsed_s(self) -> float:
+        """Wall time of the scope (so far, if it is still active)."""
+        return (self.ended or time.perf_counter()) - self.started
+
+    def to_dict(self) -> dict:
+        return {**super().to_dict(), "elapsed_s": self.elapsed_s}
+
+
+@contextmanager
+def usage_scope() -> Iterator[ScopedUsage]:
+    """
+    Measure the usage of the queries made by the calling request, across all models.
+    Scopes can be nested; a query is added to every enclosing scope.
+
+    Yields:
+        usage (ScopedUsage): token, cost and query counts of the scope
+    """
+    usage = ScopedUsage()
+    token = _scopes.set(_scopes.get() + (usage,))
+    try:
+        yield usage
+    finally:
+        usage.ended = time.perf_counter()
+        _scopes.reset(token)
+
+
+def in_context(func: Callable) -> Callable:
+    """
+    Wrap `func` to run in a copy of the caller's context, so work handed to other threads
+    (i.e. a thread pool of `query_batch`) is recorded in the caller's scopes.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return run
@@ -0,0 +1,109 @@
+"""
+Benchmark of HUGGING_FACE CPU inference: compares generation throughput (tokens/sec) of a
+CPU profile in 'l2p/llm/utils/llm.yaml' (i.e. `llama3.1-8b-cpu`) against the plain float32
+path of the same model.
+
+Usage:
+    python -m l2p.llm.utils.benchmark_cpu --model llama3.1-8b-cpu --model_path <path>
+"""
+
+import argparse, copy, os, tempfile, time
+import yaml
+from ..base import load_yaml
+from ..huggingface import HUGGING_FACE
+
+DEFAULT_PROMPT = (
+    "Write the PDDL action 'pick-up' for the blocksworld domain, with its parameters, "
+    "preconditions and effects."
+)
+
+
+def baseline_config(model_config: dict) -> dict:
+    """Return the model entry with its `model_config` reset to the plain float32 path."""
+    baseline = copy.deepcopy(model_config)
+    baseline["model_config"] = {"dtype": "float32", "device_map": None}
+    return baseline
+
+
+def benchmark(
+    llm: HUGGING_FACE, prompt: str, max_new_tokens: int, runs: int
+) -> dict[str, float]:
+    """
+    Measure generation throughput of a model.
+
+    Args:
+        llm (HUGGING_FACE): model to benchmark
+        prompt (str): prompt to generate from
+        max_new_tokens (int): # of tokens to generate per run
+        runs (int): # of timed runs (after one untimed warm-up run)
+
+    Returns:
+        results (dict[str, float]): load time, mean latency and tokens/sec
+    """
+    llm.max_new_tokens = max_new_tokens
+    llm.stop = None
+
+    # warm-up run (i.e. compilation of the decoding step)
+    llm.query(prompt)
+
+    tokens, elapsed = 0, 0.0
+    for _ in range(runs):
+        start = time.perf_counter()
+        llm.query(prompt)
+        elapsed += time.perf_counter() - start
+        tokens += llm.query_log[-1]["completion_tokens"]
+
+    return {
+        "load_time_s": (llm.load_stats or {}).get("load_time_s", 0.0),
+        "latency_s": elapsed / runs,
+        "tokens_per_s": tokens / elapsed if elapsed else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", required=True, help="CPU profile in the config")
+    parser.add_argument("--model_path", required=True, help="directory of the model")
+    parser.add_argument("--config_path", default="l2p/llm/utils/llm.yaml")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--max_new_tokens", type=int, default=128)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    config = load_yaml(args.config_path)
+    model_config = config.get("huggingface", {}).get(args.model)
+    if model_config is None:
+        raise ValueError(f"Model '{args.model}' not found in '{args.config_path}'.")
+
+    # write the float32 baseline next to the profile in a temporary config
+    config["huggingface"]["float32-baseline"] = baseline_config(model_config)
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+        yaml.safe_dump(config, f)
+        tmp_config_path = f.name
+
+    results = {}
+    try:
+        for name in ("float32-baseline", args.model):
+            print(f"[INFO] benchmarking {name}...")
+            llm = HUGGING_FACE(
+                model=name, model_path=args.model_path, config_path=tmp_config_path
+            )
+            results[name] = benchmark(llm, args.prompt, args.max_new_tokens, args.runs)
+            llm.unload()
+    finally:
+        os.remove(tmp_config_path)
+
+    baseline = results["float32-baseline"]["tokens_per_s"]
+    print(
+        f"\n{'profile':<24}{'load (s)':>10}{'latency (s)':>14}{'tokens/s':>10}{'speedup':>10}"
+    )
+    for name, result in results.items():
+        speedup = result["tokens_per_s"] / baseline if baseline else 0.0
+        print(
+            f"{name:<24}{result['load_time_s']:>10.1f}{result['latency_s']:>14.2f}"
+            f"{result['tokens_per_s']:>10.1f}{speedup:>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
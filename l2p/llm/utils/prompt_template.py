@@ -1,48 +1,47 @@
+# Prompt templates of local models, matched by key against the model engine name (first match
+# wins) when the tokenizer has no native chat template. Templates are kept free of indentation
+# and blank padding, which would otherwise be tokenized with every prompt.
 prompt_templates = {
-    "deepseek": """
-                {system_prompt}
-
-                USER: {prompt}<｜end▁of▁sentence｜>
-                
-                ASSISTANT: 
-            """,
-    "codellama-13b": """
-                <s>
-                <<SYS>>
-                {system_prompt}
-                <</SYS>>
-                [INST]{prompt}[/INST]
-            """,
-    "codellama-34b": """
-                <s>[INST]{system_prompt}{prompt}[/INST]
-            """,
-    "llama": """
-                <<SYS>>
-                {system_prompt}
-                <</SYS>>
-                [INST]{prompt}[/INST]
-            """,
-    "lemur": """
-                <|im_start|>system
-                {system_prompt}
-                <|im_end|>
-                <|im_start|>user
-                {prompt}<|im_end|>
-                <|im_start|>assistant\n
-            """,
-    "vicuna": """
-            {system_prompt}
-
-            USER: {prompt}</s>
-            ASSISTANT: 
-            """,
-    "mistral": """
-            <s>
-            {system_prompt}
-            </s>
-            [INST]{prompt}[/INST]
-            """,
-    "llama3": """
-            <|begin_of_text|><|start_header_id|>system<|end_header_id|>{system_prompt}<|eot_id|><|start_header_id|>user<|end_header_id|>{prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-            """,
+    "deepseek": (
+        "{system_prompt}\n"
+        "\n"
+        "USER: {prompt}<｜end▁of▁sentence｜>\n"
+        "\n"
+        "ASSISTANT:"
+    ),
+    "codellama-13b": (
+        "<s>\n"
+        "<<SYS>>\n"
+        "{system_prompt}\n"
+        "<</SYS>>\n"
+        "[INST]{prompt}[/INST]"
+    ),
+    "codellama-34b": "<s>[INST]{system_prompt}{prompt}[/INST]",
+    "llama": (
+        "<<SYS>>\n"
+        "{system_prompt}\n"
+        "<</SYS>>\n"
+        "[INST]{prompt}[/INST]"
+    ),
+    "lemur": (
+        "<|im_start|>system\n"
+        "{system_prompt}\n"
+        "<|im_end|>\n"
+        "<|im_start|>user\n"
+        "{prompt}<|im_end|>\n"
+        "<|im_start|>assistant"
+    ),
+    "vicuna": (
+        "{system_prompt}\n"
+        "\n"
+        "USER: {prompt}</s>\n"
+        "ASSISTANT:"
+    ),
+    "mistral": (
+        "<s>\n"
+        "{system_prompt}\n"
+        "</s>\n"
+        "[INST]{prompt}[/INST]"
+    ),
+    "llama3": "<|begin_of_text|><|start_header_id|>system<|end_header_id|>{system_prompt}<|eot_id|><|start_header_id|>user<|end_header_id|>{prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>",
 }
@@ -12,13 +12,26 @@ Users can also define their own custom models and parameters by extending the YA
 configuration using the same format template.
 
 There are two variations that users can use vLLM:
-    1. Native vLLM
-    2. OpenAI-Compatible Server (currently not supported by l2p)
+    1. Native vLLM (VLLM) - loads the model into the current Python process
+    2. OpenAI-Compatible Server (VLLMServer) - client of a running `vllm serve` endpoint,
+       so many processes and workers can share one loaded model
 """
 
+import uuid
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from typing_extensions import override
 from .base import BaseLLM, load_yaml
-from .utils.prompt_template import prompt_templates
+from .chat_template import DEFAULT_SYSTEM_PROMPT, ChatTemplate
+from .grammar import SectionGrammar
+from .hedging import HedgeAttempt, HedgePolicy
+from .http_pool import get_connection_pool
+from .loading import ModelLoader
+from .metrics import measured, record_output_tokens
+from .query_log import QueryLog
+from .retry_policy import RetryPolicy
+from .tokens import get_token_counter, usage_counts
+from .usage import UsageMeter, in_context
 
 class VLLM(BaseLLM):
     def __init__(
@@ -28,6 +41,10 @@ class VLLM(BaseLLM):
             config_path: str = "l2p/llm/utils/llm.yaml",
             provider: str = "huggingface",
             api_key: str | None = None, # only if model is affiliated w/ private repo
+            retry_policy: RetryPolicy | None = None,
+            lazy: bool = False, # return immediately and load weights in the background
+            background: bool = True, # with `lazy`, False defers loading to the first query
+            warmup: bool = False, # run a short generation after loading
         ) -> None:
 
         try:
@@ -37,6 +54,15 @@ class VLLM(BaseLLM):
                 "The 'vllm' library is required for VLLM but is not installed or "
                 "failed to import properly. Install it using: `pip install vllm`."
             )
+        try:
+            import torch
+
+            self.torch = torch
+        except ImportError:
+            raise ImportError(
+                "The 'torch' library is required for VLLM but is not installed. "
+                "Install it using: `pip install torch`."
+            )
         
         self.api_key = api_key
         
@@ -48,6 +74,8 @@ class VLLM(BaseLLM):
         model_config = self._config.get(self.provider, {}).get(model, {})
         self.model_engine = model_config.get("engine", model)
         self.model_path = model_path
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_site = f"{self.provider}:{self.model_engine}"
 
         # set parameters for model
         self._set_parameters(model_config)
@@ -55,6 +83,11 @@ class VLLM(BaseLLM):
         # set model configurations
         self._set_configs(model_config)
 
+        # prompt template; the tokenizer's chat template replaces it once loaded
+        self.chat_template = ChatTemplate(self.model_engine)
+
+        self.LLM = LLM
+        self.SamplingParams = SamplingParams
         self.sampling_params = SamplingParams(
             temperature = self.temperature,
             top_p = self.top_p,
@@ -62,13 +95,28 @@ class VLLM(BaseLLM):
             max_tokens = self.max_new_tokens,
         )
 
-        # recording logs
-        self.in_tokens = 0
-        self.out_tokens = 0
-        self.query_log = []
+        # optional grammar constraining every response (see `SectionGrammar`)
+        self.grammar = None
+
+        # recording logs (aggregate usage; see `usage_scope` for the usage of a single request)
+        self.usage = UsageMeter()
+        self.query_log = QueryLog.from_config(model_config.get("query_log"))
+
+        # load now, or lazily in the background / on first query
+        self.llm = None
+        self.tokenizer = None
+        self.warmup = warmup
+        self._loader = ModelLoader(self._load, name=self.model_engine)
+        if not lazy:
+            self._loader.start(background=False)
+        elif background:
+            self._loader.start(background=True)
+
+    def _load(self) -> None:
+        """Load the vLLM engine and tokenizer, then optionally warm up."""
 
         if self.context_length > 8192:
-            self.llm = LLM(
+            llm = self.LLM(
                 model = self.model_path,
                 dtype = self.dtype,
                 tensor_parallel_size = self.ngpu,
@@ -77,7 +125,7 @@ class VLLM(BaseLLM):
                 max_model_len = 8192
                 )
         else:
-            self.llm = LLM(
+            llm = self.LLM(
                 model = self.model_path,
                 dtype = self.dtype,
                 tensor_parallel_size = self.ngpu,
@@ -85,7 +133,29 @@ class VLLM(BaseLLM):
                 max_num_batched_tokens = self.context_length,
                 )
         
-        self.tokenizer = self.llm.get_tokenizer()
+        self.tokenizer = llm.get_tokenizer()
+        self.chat_template = ChatTemplate.from_tokenizer(self.model_engine, self.tokenizer)
+        self.llm = llm
+
+        # a short generation so the first query does not pay one-time setup costs
+        if self.warmup:
+            self.llm.generate(["Warm-up"], self.SamplingParams(max_tokens=4))
+
+    def ready(self) -> bool:
+        """True if the model is loaded and can serve queries without waiting."""
+        return self._loader.ready()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the model is loaded (starting a deferred load in the background).
+
+        Args:
+            timeout (float): max seconds to wait, defaults to None (no limit)
+
+        Returns:
+            ready (bool): True if loaded, False if `timeout` expired first
+        """
+        return self._loader.wait(timeout)
     
 
     def _set_parameters(self, model_config: dict) -> None:
@@ -104,6 +174,7 @@ class VLLM(BaseLLM):
         parameters = model_config.get("model_params", {})
         for key, default in defaults.items():
             setattr(self, key, parameters.get(key, default))
+        self.sampling_parameter_names = tuple(defaults)
 
 
     def _set_configs(self, model_config: dict) -> None:
@@ -141,83 +212,189 @@ class VLLM(BaseLLM):
 
     def generate_prompt(self, system_message, prompt):
         """Generate prompt structure for specific LLM."""
-        system_message = system_message or "You are a PDDL coding assistant. Provide concise, correct code only.\n"
-        model_name = self.model_engine.lower()
+        return self.chat_template.render(system_message, prompt)
+    
+    def _sampling_params(self, grammar: SectionGrammar | None = None):
+        """Sampling parameters of a request, with guided decoding if a grammar is active."""
 
-        # try to find matching template key from the prompt_templates
-        for key in prompt_templates:
-            if key in model_name:
-                template = prompt_templates[key]
-                return template.format(system_prompt=system_message, prompt=prompt).strip()
+        grammar = grammar or self.grammar
+        if grammar is None:
+            return self.sampling_params
+
+        # guided decoding was renamed to structured outputs in recent vLLM versions
+        try:
+            from vllm.sampling_params import GuidedDecodingParams
+            guided = {"guided_decoding": GuidedDecodingParams(regex=grammar.to_regex())}
+        except ImportError:
+            from vllm.sampling_params import StructuredOutputsParams
+            guided = {"structured_outputs": StructuredOutputsParams(regex=grammar.to_regex())}
+
+        return self.SamplingParams(
+            temperature = self.temperature,
+            top_p = self.top_p,
+            stop = self.stop,
+            max_tokens = self.max_new_tokens,
+            **guided,
+        )
+
+    def _prepare_input(self, prompt: str, system_prompt: str, est_margin: int):
+        """Build and tokenize the full prompt."""
+
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError("Prompt must be a non-empty string.")
+        self._loader.ensure()
+        
+        full_prompt, input_ids = self.chat_template.encode(system_prompt, prompt)
+        requested_tokens = len(input_ids)
+
+        available_context = self.context_length - requested_tokens - est_margin
+        max_new_tokens = min(self.max_new_tokens, max(0, available_context))
+
+        print(
+            f"Requesting {max_new_tokens} tokens "
+            f"(estimated prompt: {requested_tokens} tokens, margin: {est_margin}, window: {self.context_length})"
+        )
+
+        # print token information
+        print(f"[INFO] connecting to {self.model_engine} ({requested_tokens} tokens)...")
+        if requested_tokens >= self.context_length:
+            print(
+                f"[WARNING] Prompt is {requested_tokens} tokens and exceeds context length "
+                f"({self.context_length}). It will be truncated."
+            )
+
+        # the engine receives the tokens, so the prompt is not tokenized again
+        return full_prompt, {"prompt_token_ids": input_ids}, requested_tokens
 
-        # default fallback if no template matched
-        return prompt
-    
     @override
+    @measured
     def query(
         self, 
         prompt: str,
         system_prompt: str = None,
         end_when_error: bool=False,
-        max_retry: int=3,
+        max_retry: int | None=None,
         est_margin: int=200,
+        grammar: SectionGrammar | None=None,
         ) -> str:
-        """Generate a response from model based on the prompt."""
+        """
+        Generate a response from model based on the prompt. If a `grammar` is given (or set
+        as `self.grammar`), guided decoding restricts the response to what it accepts.
+        """
         
-        if not isinstance(prompt, str) or not prompt.strip():
-            raise ValueError("Prompt must be a non-empty string.")
+        full_prompt, input, requested_tokens = self._prepare_input(prompt, system_prompt, est_margin)
+
+        # request response
+        max_attempts = 1 if end_when_error else max_retry
+        try:
+            result = self.retry_policy.call(
+                self.llm.generate,
+                [input],
+                self._sampling_params(grammar),
+                site=self.retry_site,
+                max_attempts=max_attempts,
+            )[0]
+        except Exception as e:
+            if not self.retry_policy.is_retryable(e):
+                raise
+            raise ConnectionError(
+                f"Failed to generate response after {max_attempts or self.retry_policy.max_attempts} attempts."
+            ) from e
         
-        full_prompt = self.generate_prompt(system_prompt, prompt)
-        assert full_prompt is not None
+        llm_output = result.outputs[0].text
+        self._record_query(full_prompt, requested_tokens, len(result.outputs[0].token_ids), llm_output)
+    
+        return llm_output
+    
+    @override
+    @measured
+    def query_stream(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        est_margin: int = 200,
+        grammar: SectionGrammar | None = None,
+        ) -> Iterator[str]:
+        """
+        Generate a response from model based on the prompt, yielding new text after every
+        engine step. The request is aborted in the engine once the generator is closed.
+        """
 
-        input = self.tokenizer(full_prompt)
-        requested_tokens = len(input["input_ids"])
+        full_prompt, input, requested_tokens = self._prepare_input(prompt, system_prompt, est_margin)
 
-        available_context = self.context_length - requested_tokens - est_margin
-        max_new_tokens = min(self.max_new_tokens, max(0, available_context))
+        # drive the engine step by step to receive partial outputs
+        engine = self.llm.llm_engine
+        request_id = f"l2p-stream-{uuid.uuid4().hex}"
+        engine.add_request(request_id, input, self._sampling_params(grammar))
 
-        print(
-            f"Requesting {max_new_tokens} tokens "
-            f"(estimated prompt: {requested_tokens} tokens, margin: {est_margin}, window: {self.context_length})"
-        )
+        llm_output, output_tokens, finished = "", 0, False
+        try:
+            while not finished and engine.has_unfinished_requests():
+                for output in engine.step():
+                    if output.request_id != request_id:
+                        continue
 
-        # request response
-        conn_success, n_retry = False, 0
-        while not conn_success and n_retry < max_retry:
-            try:
-                # print token information
-                print(f"[INFO] connecting to {self.model_engine} ({requested_tokens} tokens)...")
-                if requested_tokens >= self.context_length:
-                    print(
-                        f"[WARNING] Prompt is {requested_tokens} tokens and exceeds context length "
-                        f"({self.context_length}). It will be truncated."
-                    )
-                
-                llm_output = self.llm.generate([full_prompt], self.sampling_params)
-                llm_output = llm_output[0].outputs[0].text
-                    
-                conn_success = True
-
-            except Exception as e:
-                print(f"[ERROR] LLM error: {e}")
-                if end_when_error:
-                    break
-                n_retry += 1
+                    text = output.outputs[0].text
+                    output_tokens = len(output.outputs[0].token_ids)
+                    if len(text) > len(llm_output):
+                        new_text, llm_output = text[len(llm_output):], text
+                        yield new_text
+                    finished = output.finished
+        finally:
+            if not finished:
+                engine.abort_request(request_id)
+            self._record_query(full_prompt, requested_tokens, output_tokens, llm_output)
+
+    @override
+    @measured
+    def query_batch(
+        self,
+        prompts: list[str],
+        system_prompt: str = None,
+        grammar: SectionGrammar | None = None,
+        ) -> list[str]:
+        """Generate responses for a batch of prompts in a single vLLM `generate` call."""
+
+        for prompt in prompts:
+            if not isinstance(prompt, str) or not prompt.strip():
+                raise ValueError("Prompt must be a non-empty string.")
+        self._loader.ensure()
         
-        if not conn_success:
-            raise ConnectionError(
-                f"Failed to generate response after {max_retry} retries."
-            )
+        encoded = [self.chat_template.encode(system_prompt, p) for p in prompts]
+        full_prompts = [full_prompt for full_prompt, _ in encoded]
+        lengths = [len(input_ids) for _, input_ids in encoded]
+
+        print(f"[INFO] generating batch of {len(full_prompts)} prompts with {self.model_engine}...")
+
+        # vLLM schedules the whole batch itself and returns outputs in prompt order
+        inputs = [{"prompt_token_ids": input_ids} for _, input_ids in encoded]
+        results = self.llm.generate(inputs, self._sampling_params(grammar))
         
-        # retrieve output tokens
-        output_ids = self.tokenizer(llm_output)
-        output_tokens = len(output_ids["input_ids"])
+        llm_outputs = []
+        for full_prompt, requested_tokens, result in zip(full_prompts, lengths, results):
+            llm_output = result.outputs[0].text
+            self._record_query(full_prompt, requested_tokens, len(result.outputs[0].token_ids), llm_output)
+            llm_outputs.append(llm_output)
+
+        return llm_outputs
+    
+    def _record_query(
+            self,
+            full_prompt: str,
+            requested_tokens: int,
+            output_tokens: int,
+            llm_output: str,
+            extra: dict | None = None,
+        ) -> None:
+        """Record token counts and query log (with `extra` fields) for a single generated response."""
 
         # record token counts
-        self.in_tokens += requested_tokens
-        self.out_tokens += output_tokens
+
+        self.usage.record(requested_tokens, output_tokens)
+        record_output_tokens(output_tokens)
 
         self.query_log.append({
+            **(extra or {}),
             "model": self.model_engine,
             "prompt_tokens": requested_tokens,
             "completion_tokens": output_tokens,
@@ -226,24 +403,21 @@ class VLLM(BaseLLM):
             "output": llm_output,
         })
     
-        return llm_output
-    
     def get_tokens(self) -> tuple[int,int]:
         """Return input and output token counts."""
-        return self.in_tokens, self.out_tokens
+        return self.usage.get_tokens()
     
     def reset_tokens(self) -> None:
-        """Reset token counts."""
-        self.in_tokens = 0
-        self.out_tokens = 0
+        """Reset aggregate token counts (prefer `usage_scope` to measure a single request)."""
+        self.usage.reset()
 
     def get_query_log(self) -> list:
         """Retrieve query log."""
-        return self.query_log
+        return list(self.query_log)
     
     def reset_query_log(self) -> None:
         """Reset query log."""
-        self.query_log = []
+        self.query_log.clear()
 
     @override
     def valid_models(self) -> list[str]:
@@ -252,4 +426,295 @@ class VLLM(BaseLLM):
             return list(self._config.get(self.provider, {}).keys())
         except KeyError:
             return []
-            
\ No newline at end of file
+
+
+class VLLMServer(VLLM):
+    def __init__(
+            self,
+            model: str,
+            base_url: str = "http://localhost:8000/v1",
+            config_path: str = "l2p/llm/utils/llm.yaml",
+            provider: str = "huggingface",
+            api_key: str | None = None,
+            served_model: str | None = None, # name given to `vllm serve --served-model-name`
+            max_connections: int = 16,
+            timeout: float = 600.0,
+            retry_policy: RetryPolicy | None = None,
+            hedging: HedgePolicy | dict | None = None,
+        ) -> None:
+        """
+        Client of an OpenAI-compatible vLLM server. Uses the same `llm.yaml` entries as
+        VLLM, and sends chat messages to the server's `/chat/completions` endpoint, which
+        applies the served tokenizer's chat template, through a keep-alive connection pool
+        shared by all instances (and threads) using the same server. Neither `vllm` nor
+        `torch` is required.
+
+        `model` must be an entry of `llm.yaml`, unless `served_model` is given (the server's
+        model is then used with default parameters).
+        """
+
+        # load yaml configuration path
+        self.provider = provider
+        self._config = load_yaml(config_path)
+
+        # validate the model like other providers, unless the served model is named explicitly
+        if served_model is None:
+            BaseLLM.__init__(self, model, api_key)
+        else:
+            self.model = model
+            self.api_key = api_key
+
+        # retrieve model configurations
+        model_config = self._config.get(self.provider, {}).get(model, {})
+        self.model_engine = model_config.get("engine", model)
+        self.served_model = served_model or self.model_engine
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_site = f"vllm-server:{self.model_engine}"
+
+        # set parameters for model
+        self._set_parameters(model_config)
+
+        self.max_connections = max_connections
+        self.pool = get_connection_pool(base_url, maxsize=max_connections, timeout=timeout)
+
+        # optional hedging of slow requests (see `HedgePolicy`), to the same or an alternate server
+        self.hedging = HedgePolicy.from_config(
+            hedging if hedging is not None else model_config.get("hedging")
+        )
+        self.hedge_pool = self.pool
+        if self.hedging is not None and self.hedging.base_url:
+            self.hedge_pool = get_connection_pool(
+                self.hedging.base_url, maxsize=max_connections, timeout=timeout
+            )
+
+        # optional grammar constraining every response (see `SectionGrammar`)
+        self.grammar = None
+
+        # recording logs (aggregate usage; see `usage_scope` for the usage of a single request)
+        self.usage = UsageMeter()
+        self.query_log = QueryLog.from_config(model_config.get("query_log"))
+        self.token_counter = None  # local counts of responses without usage, loaded on first use
+
+        # no weights are loaded by the client
+        self._loader = ModelLoader(lambda: None, name=self.model_engine)
+        self._loader.start(background=False)
+
+    def _request_body(
+            self,
+            messages: list[dict],
+            stream: bool = False,
+            grammar: SectionGrammar | None = None,
+        ) -> dict:
+        """Build the `/chat/completions` request body from the model parameters."""
+
+        body = {
+            "model": self.served_model,
+            "messages": messages,
+            "max_tokens": self.max_new_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+        }
+        if self.stop:
+            body["stop"] = self.stop
+        grammar = grammar or self.grammar
+        if grammar is not None:
+            # vLLM's extra parameter for regex guided decoding
+            body["guided_regex"] = grammar.to_regex()
+        if stream:
+            body["stream"] = True
+            body["stream_options"] = {"include_usage": True}
+        return body
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    @override
+    def generate_prompt(self, system_message, prompt):
+        """Generate the chat messages of a prompt; the server applies the model's chat template."""
+        return [
+            {"role": "system", "content": system_message or DEFAULT_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+
+    def _prepare_prompt(self, prompt: str, system_prompt: str) -> list[dict]:
+        """Build the chat messages of a request."""
+
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError("Prompt must be a non-empty string.")
+
+        messages = self.generate_prompt(system_prompt, prompt)
+        print(f"[INFO] connecting to {self.model_engine} at {self.pool.base_url}...")
+        return messages
+
+    @override
+    @measured
+    def query(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        end_when_error: bool=False,
+        max_retry: int | None=None,
+        grammar: SectionGrammar | None=None,
+        ) -> str:
+        """Generate a response from the server based on the prompt."""
+
+        messages = self._prepare_prompt(prompt, system_prompt)
+
+        # request response
+        max_attempts = 1 if end_when_error else max_retry
+        try:
+            return self.retry_policy.call(
+                self._attempt,
+                messages,
+                grammar,
+                site=self.retry_site,
+                max_attempts=max_attempts,
+            )
+        except Exception as e:
+            if not self.retry_policy.is_retryable(e):
+                raise
+            raise ConnectionError(
+                f"Failed to generate response after {max_attempts or self.retry_policy.max_attempts} attempts."
+            ) from e
+
+    def _attempt(self, messages: list[dict], grammar: SectionGrammar | None) -> str:
+        """Send one request attempt (hedged if `hedging` is set) and record its response."""
+
+        if self.hedging is not None:
+            return self.hedging.call(
+                [
+                    lambda attempt, pool=pool: self._hedged_attempt(attempt, pool, messages, grammar)
+                    for pool in (self.pool, self.hedge_pool)
+                ],
+                labels=self.metric_labels(),
+                unhedged=lambda: self._request(messages, grammar),
+            )
+        return self._request(messages, grammar)
+
+    def _request(self, messages: list[dict], grammar: SectionGrammar | None) -> str:
+        """Send one (non-streamed) request and record its response."""
+
+        response = self.pool.request(
+            "POST", "/chat/completions", self._request_body(messages, grammar=grammar), self._headers()
+        )
+        llm_output = response["choices"][0]["message"]["content"]
+        self._record_usage(messages, response.get("usage"), llm_output)
+        return llm_output
+
+    def _hedged_attempt(
+            self,
+            attempt: HedgeAttempt,
+            pool,
+            messages: list[dict],
+            grammar: SectionGrammar | None,
+        ) -> str:
+        """
+        Send one of the requests of a hedged attempt. The response is streamed, so closing
+        the connection of a cancelled request aborts it on the server.
+        """
+
+        body = self._request_body(messages, stream=True, grammar=grammar)
+        events = pool.stream("POST", "/chat/completions", body, self._headers(), on_open=attempt.on_cancel)
+
+        llm_output, usage = "", None
+        try:
+            for event in events:
+                if attempt.cancelled.is_set():
+                    break
+                if event.get("usage"):
+                    usage = event["usage"]
+                for choice in event.get("choices") or []:
+                    llm_output += choice.get("delta", {}).get("content") or ""
+        finally:
+            events.close()
+            self._record_usage(messages, usage, llm_output, hedge=attempt)
+        return llm_output
+
+    @override
+    @measured
+    def query_stream(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        grammar: SectionGrammar | None = None,
+        ) -> Iterator[str]:
+        """
+        Generate a response from the server based on the prompt, yielding text as it is
+        generated. Closing the generator closes the connection, which aborts the request
+        on the server.
+        """
+
+        messages = self._prepare_prompt(prompt, system_prompt)
+        body = self._request_body(messages, stream=True, grammar=grammar)
+        events = self.pool.stream("POST", "/chat/completions", body, self._headers())
+
+        llm_output, usage = "", None
+        try:
+            for event in events:
+                if event.get("usage"):
+                    usage = event["usage"]
+                for choice in event.get("choices") or []:
+                    text = choice.get("delta", {}).get("content")
+                    if text:
+                        llm_output += text
+                        yield text
+        finally:
+            events.close()
+            self._record_usage(messages, usage, llm_output)
+
+    @override
+    def query_batch(
+        self,
+        prompts: list[str],
+        system_prompt: str = None,
+        max_workers: int | None = None,
+        grammar: SectionGrammar | None = None,
+        ) -> list[str]:
+        """
+        Send a batch of prompts to the server concurrently, so its continuous batching can
+        schedule them together. Responses are returned in prompt order.
+        """
+
+        max_workers = min(len(prompts), max_workers or self.max_connections) or 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # workers record usage in the caller's scopes
+            return list(executor.map(
+                in_context(lambda p: self.query(p, system_prompt=system_prompt, grammar=grammar)), prompts
+            ))
+
+    def _count_tokens(self, messages: list[dict], llm_output: str) -> tuple[int, int]:
+        """
+        Count the tokens of chat messages and an output locally, as OPENAI does, for responses the
+        server did not report usage of. Counts are approximate (`cl100k_base` encoding), and
+        zero if `tiktoken` or its encoding is not available (i.e. offline).
+        """
+
+        if self.token_counter is None:
+            try:
+                self.token_counter = get_token_counter("cl100k_base")
+            except (ImportError, OSError) as e:
+                print(f"[WARNING] cl100k_base encoding is not available ({e}); responses without usage are recorded as 0 tokens.")
+                self.token_counter = False
+        if not self.token_counter:
+            return 0, 0
+        return self.token_counter.count_messages(messages), self.token_counter.count(llm_output, cache=False)
+
+    def _record_usage(
+            self,
+            messages: list[dict],
+            usage: dict | None,
+            llm_output: str,
+            hedge: HedgeAttempt | None = None,
+        ) -> None:
+        """Record token counts (reported by the server when available) and query log of a response."""
+
+        # the server reports usage unless the stream was closed early (i.e. a cancelled hedge)
+        counts = usage_counts(usage)
+        if counts:
+            prompt_tokens, completion_tokens = counts
+        else:
+            prompt_tokens, completion_tokens = self._count_tokens(messages, llm_output)
+        extra = {"messages": messages}
+        if hedge is not None:
+            extra.update({"hedge_attempt": hedge.index, "cancelled": hedge.cancelled.is_set()})
+        self._record_query(messages[-1]["content"], prompt_tokens, completion_tokens, llm_output, extra)
@@ -9,7 +9,6 @@ how to use class functions. Refer to /templates in: https://github.com/AI-Planni
 for how to structurally prompt LLMs so they are compatible with class function parsing.
 """
 
-import time
 from .llm import BaseLLM, require_llm
 from .utils import *
 
@@ -79,7 +78,6 @@ class TaskBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)  # get BaseLLM response
 
                 # extract respective types from response
@@ -113,7 +111,6 @@ class TaskBuilder:
                     f"Error on attempt {attempt + 1}/{max_retries}: {e}\n"
                     f"LLM Output:\n{llm_output if 'llm_output' in locals() else 'None'}\nRetrying...\n"
                 )
-                time.sleep(2)
 
         raise RuntimeError("Max retries exceeded. Failed to extract objects.")
 
@@ -190,7 +187,6 @@ class TaskBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 # extract respective types from response
@@ -226,7 +222,6 @@ class TaskBuilder:
                     f"Error on attempt {attempt + 1}/{max_retries}: {e}\n"
                     f"LLM Output:\n{llm_output if 'llm_output' in locals() else 'None'}\nRetrying...\n"
                 )
-                time.sleep(2)
 
         raise RuntimeError("Max retries exceeded. Failed to extract initial states.")
 
@@ -303,7 +298,6 @@ class TaskBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 # extract respective types from response
@@ -339,7 +333,6 @@ class TaskBuilder:
                     f"Error on attempt {attempt + 1}/{max_retries}: {e}\n"
                     f"LLM Output:\n{llm_output if 'llm_output' in locals() else 'None'}\nRetrying...\n"
                 )
-                time.sleep(2)
 
         raise RuntimeError("Max retries exceeded. Failed to extract goal states.")
 
@@ -410,7 +403,6 @@ class TaskBuilder:
         # iterate through attempts in case of extraction failure
         for attempt in range(max_retries):
             try:
-                model.reset_tokens()
                 llm_output = model.query(prompt=prompt)
 
                 # extract respective types from response
@@ -462,7 +454,6 @@ class TaskBuilder:
                     f"Error on attempt {attempt + 1}/{max_retries}: {e}\n"
                     f"LLM Output:\n{llm_output if 'llm_output' in locals() else 'None'}\nRetrying...\n"
                 )
-                time.sleep(2)
 
         raise RuntimeError("Max retries exceeded. Failed to extract task.")
 
@@ -748,6 +748,29 @@ def parse_heading(llm_output: str, heading: str) -> str:
     return heading_str
 
 
+def is_section_complete(llm_output: str, heading: str) -> bool:
+    """
+    Checks whether the section under a heading is complete in a (possibly partial) LLM output,
+    i.e. while it is still being streamed. The section starts at the `### <heading>` line and
+    is complete once the next second level heading has started, since a section can hold
+    several fenced [```] blocks. The last section is only complete when the stream ends.
+
+    Args:
+        llm_output (str): raw (partial) LLM output
+        heading (str): heading of the section (i.e. 'OBJECTS')
+
+    Returns:
+        complete (bool): True if the section will not change as more output is generated
+    """
+    match = re.search(
+        rf"^###[ \t]*{re.escape(heading)}[ \t]*$", llm_output, flags=re.MULTILINE
+    )
+    if match is None:
+        return False
+
+    return "\n### " in llm_output[match.end() :]
+
+
 def parse_pddl(pddl_str: str) -> list:
     """
     Simplified PDDL parser that converts the string into a nested list structure.
@@ -20,6 +20,7 @@ Is supported in: DomainBuilder.extract_pddl_action(**kwargs, syntax_validator)
 
 import re
 from collections import OrderedDict
+from collections.abc import Iterator
 from .pddl_format import *
 from .pddl_parser import *
 from .pddl_types import Predicate, Function
@@ -1217,38 +1218,46 @@ class SyntaxValidator:
             curr_predicates.extend(new_predicates)
         curr_predicates = parse_predicates(curr_predicates)
 
-        # get action params
-        params_info = parse_params(llm_response)
-
         # check preconditions
-        precond_str = parse_preconditions(llm_response)
-        precond_str = remove_comments(precond_str)
-        precond_str = (
-            precond_str.replace("\n", " ").replace("(", " ( ").replace(")", " ) ")
-        )
-        validation_info = self.validate_pddl_action(
-            pddl=precond_str,
-            predicates=curr_predicates,
-            action_params=params_info[0],
-            functions=functions,
-            types=types,
-            part="preconditions",
+        validation_info = self._validate_usage_part(
+            llm_response, "preconditions", curr_predicates, types, functions
         )
 
         if not validation_info[0]:
             return validation_info
 
         # check effects
-        eff_str = parse_effects(llm_response)
-        eff_str = remove_comments(eff_str)
-        eff_str = eff_str.replace("\n", " ").replace("(", " ( ").replace(")", " ) ")
+        return self._validate_usage_part(
+            llm_response, "effects", curr_predicates, types, functions
+        )
+
+    def _validate_usage_part(
+        self,
+        llm_response: str,
+        part: str,
+        curr_predicates: list[Predicate],
+        types: dict[str, str] | list[dict[str, str]] | None = None,
+        functions: list[Function] | None = None,
+    ) -> tuple[bool, str]:
+        """Checks predicate/function usage of either the action 'preconditions' or 'effects'."""
+
+        # get action params
+        params_info = parse_params(llm_response)
+
+        pddl_str = (
+            parse_preconditions(llm_response)
+            if part == "preconditions"
+            else parse_effects(llm_response)
+        )
+        pddl_str = remove_comments(pddl_str)
+        pddl_str = pddl_str.replace("\n", " ").replace("(", " ( ").replace(")", " ) ")
         return self.validate_pddl_action(
-            pddl=eff_str,
+            pddl=pddl_str,
             predicates=curr_predicates,
             action_params=params_info[0],
             functions=functions,
             types=types,
-            part="effects",
+            part=part,
         )
 
     # ---- PDDL TASK CHECKS ----
@@ -1456,6 +1465,7 @@ class SyntaxValidator:
     def validate_header(
         self,
         llm_response: str,
+        headers: list[str] | None = None,
     ) -> tuple[bool, str]:
         """
         Checks if domain headers and formatted code block syntax are found in LLM output.
@@ -1463,13 +1473,14 @@ class SyntaxValidator:
 
         Args:
             llm_response (str): raw LLM output
+            headers (list[str]): subset of headers to check, defaults to None (all `self.headers`)
 
         Returns:
             validation_info (tuple[bool,str]): validation info containing pass flag and error message
         """
 
         # catches if a header is not present
-        for header in self.headers:
+        for header in self.headers if headers is None else headers:
             if header not in llm_response:
                 feedback_msg = (
                     f"[ERROR]: The header `{header}` is missing in the PDDL model. Please include the `### {header}` section following by its content enclosed by [```] like:\n\n"
@@ -1557,3 +1568,134 @@ class SyntaxValidator:
 
         feedback_msg = "[PASS]: Unsupported keywords not found in PDDL model."
         return True, feedback_msg
+
+    # ---- STREAMING CHECKS ----
+
+    def validate_stream(
+        self,
+        stream: Iterator[str],
+        types: dict[str, str] | list[dict[str, str]] | None = None,
+        predicates: list[Predicate] | None = None,
+        functions: list[Function] | None = None,
+        extract_new_preds: bool = False,
+    ) -> tuple[str, tuple[bool, str]]:
+        """
+        Validates a streamed LLM response (i.e. `BaseLLM.query_stream`) section by section.
+        Each section in `self.headers` is checked as soon as it is complete; on the first error
+        the stream is closed, which cancels generation, so a retry can start right away with the
+        error message. Once the stream ends, the full response is checked again.
+
+        Supported checks (declared in `self.error_types`): `validate_header`,
+        `validate_duplicate_headers`, `validate_unsupported_keywords`, `validate_params` and
+        `validate_usage_action`. If `extract_new_preds` is True, predicate usage is checked once
+        the 'New Predicates' section is complete.
+
+        Args:
+            stream (Iterator[str]): chunks of the LLM response
+            types (dict[str,str] | list[dict[str,str]]): current types in domain
+            predicates (list[Predicate]): current predicates in domain
+            functions (list[Function]): list of current functions in domain
+            extract_new_preds (bool): flag for if new predicates are being extracted, defaults to False
+
+        Returns:
+            llm_output (str): the (possibly partial) raw LLM output
+            validation_info (tuple[bool,str]): validation info containing pass flag and error message
+        """
+
+        llm_output = ""
+        checked_headers = set()
+        try:
+            for chunk in stream:
+                llm_output += chunk
+
+                for header in self.headers:
+                    if header in checked_headers or not is_section_complete(
+                        llm_output, header
+                    ):
+                        continue
+                    checked_headers.add(header)
+
+                    validation_info = self._validate_section(
+                        llm_output, header, types, predicates, functions, extract_new_preds
+                    )
+                    if not validation_info[0]:
+                        return llm_output, validation_info
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()  # cancels generation if still running
+
+        # checks over the full response (i.e. missing or duplicate headers)
+        for error_type in self.error_types:
+            if error_type in (
+                "validate_header",
+                "validate_duplicate_headers",
+                "validate_unsupported_keywords",
+            ):
+                validation_info = getattr(self, error_type)(llm_output)
+            elif error_type == "validate_params":
+                validation_info = self.validate_params(parse_params(llm_output)[0], types)
+            elif error_type == "validate_usage_action":
+                validation_info = self.validate_usage_action(
+                    llm_output,
+                    list(predicates) if predicates else None,
+                    types,
+                    functions,
+                    extract_new_preds,
+                )
+            else:
+                continue
+
+            if not validation_info[0]:
+                return llm_output, validation_info
+
+        return llm_output, (True, "[PASS]: All validations passed.")
+
+    def _validate_section(
+        self,
+        llm_output: str,
+        header: str,
+        types: dict[str, str] | list[dict[str, str]] | None = None,
+        predicates: list[Predicate] | None = None,
+        functions: list[Function] | None = None,
+        extract_new_preds: bool = False,
+    ) -> tuple[bool, str]:
+        """Runs the checks in `self.error_types` that apply to a single completed section."""
+
+        section = llm_output.split(header, 1)[1].split("\n### ")[0]
+
+        if "validate_header" in self.error_types:
+            validation_info = self.validate_header(llm_output, headers=[header])
+            if not validation_info[0]:
+                return validation_info
+
+        if "validate_unsupported_keywords" in self.error_types:
+            validation_info = self.validate_unsupported_keywords(section)
+            if not validation_info[0]:
+                return validation_info
+
+        if "validate_params" in self.error_types and "Parameters" in header:
+            validation_info = self.validate_params(parse_params(llm_output)[0], types)
+            if not validation_info[0]:
+                return validation_info
+
+        if "validate_usage_action" in self.error_types:
+            # new predicates are declared after they are used; wait for their section
+            if extract_new_preds:
+                if "New Predicates" in header:
+                    return self.validate_usage_action(
+                        llm_output,
+                        list(predicates) if predicates else None,
+                        types,
+                        functions,
+                        extract_new_preds,
+                    )
+            elif "Preconditions" in header or "Effects" in header:
+                return self._validate_usage_part(
+                    llm_output,
+                    "preconditions" if "Preconditions" in header else "effects",
+                    parse_predicates(list(predicates) if predicates else []),
+                    types,
+                    functions,
+                )
+
+        return True, f"[PASS]: section `{header}` is valid."
@@ -0,0 +1,148 @@
+import importlib.util, json, os, yaml
+
+HAS_TRANSFORMERS = all(
+    importlib.util.find_spec(name) for name in ("torch", "transformers", "tokenizers")
+)
+
+CORPUS = [
+    "(define (domain blocksworld) (:predicates (on ?a ?b) (clear ?b)))",
+    "### GOAL\n```\n(on a b)\n```",
+    "You are a PDDL expert. Define the blocksworld domain.",
+]
+
+
+def build_tiny_gpt2(path: str) -> None:
+    """
+    Save a randomly initialized two-layer GPT-2 and a small byte-level BPE tokenizer to
+    `path` (safetensors weights), so local providers can be tested without downloads.
+    """
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(
+        CORPUS * 10,
+        trainers.BpeTrainer(
+            vocab_size=300,
+            special_tokens=["<|endoftext|>"],
+            initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        ),
+    )
+    PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, eos_token="<|endoftext|>"
+    ).save_pretrained(path)
+
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=tokenizer.get_vocab_size(),
+        n_embd=32,
+        n_layer=2,
+        n_head=2,
+        n_positions=512,
+        bos_token_id=0,
+        eos_token_id=0,
+    )
+    GPT2LMHeadModel(config).save_pretrained(path)
+
+
+def write_config(
+    path: str,
+    provider: str,
+    model: str,
+    model_config: dict | None = None,
+    model_params: dict | None = None,
+) -> str:
+    """Write an llm.yaml with a single model to `path/llm.yaml` and return its path."""
+    config = {
+        provider: {
+            model: {
+                "engine": model,
+                "model_params": {
+                    "context_length": 512,
+                    "max_new_tokens": 16,
+                    "temperature": 0.0,
+                    "top_p": 1.0,
+                    "stop": None,
+                    **(model_params or {}),
+                },
+                "model_config": {
+                    "dtype": "float32",
+                    "device_map": None,
+                    **(model_config or {}),
+                },
+            }
+        }
+    }
+    config_path = os.path.join(path, "llm.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+    return config_path
+
+
+HAS_LLAMA_CPP = HAS_TRANSFORMERS and all(
+    importlib.util.find_spec(name) for name in ("llama_cpp", "gguf")
+)
+
+
+def build_tiny_gguf(path: str) -> str:
+    """
+    Convert the tiny GPT-2 saved in `path` (see `build_tiny_gpt2`) to a float32 GGUF file,
+    as llama.cpp's `convert_hf_to_gguf.py` would, and return the file's path.
+    """
+    import gguf
+    import numpy as np
+    from safetensors.numpy import load_file
+
+    with open(os.path.join(path, "config.json")) as f:
+        config = json.load(f)
+    with open(os.path.join(path, "tokenizer.json")) as f:
+        tokenizer = json.load(f)
+
+    vocab = tokenizer["model"]["vocab"]
+    tokens = sorted(vocab, key=vocab.get)
+    special = {token["content"] for token in tokenizer["added_tokens"]}
+    merges = [
+        merge if isinstance(merge, str) else " ".join(merge)
+        for merge in tokenizer["model"]["merges"]
+    ]
+
+    gguf_path = os.path.join(path, "tiny-gpt2-f32.gguf")
+    writer = gguf.GGUFWriter(gguf_path, "gpt2")
+    writer.add_block_count(config["n_layer"])
+    writer.add_context_length(config["n_positions"])
+    writer.add_embedding_length(config["n_embd"])
+    writer.add_feed_forward_length(4 * config["n_embd"])
+    writer.add_head_count(config["n_head"])
+    writer.add_layer_norm_eps(config["layer_norm_epsilon"])
+    writer.add_file_type(gguf.LlamaFileType.ALL_F32)
+    writer.add_tokenizer_model("gpt2")
+    writer.add_tokenizer_pre("gpt-2")
+    writer.add_token_list(tokens)
+    writer.add_token_types(
+        [
+            gguf.TokenType.CONTROL if token in special else gguf.TokenType.NORMAL
+            for token in tokens
+        ]
+    )
+    writer.add_token_merges(merges)
+    writer.add_bos_token_id(config["bos_token_id"])
+    writer.add_eos_token_id(config["eos_token_id"])
+
+    names = gguf.get_tensor_name_map(gguf.MODEL_ARCH.GPT2, config["n_layer"])
+    for name, data in load_file(os.path.join(path, "model.safetensors")).items():
+        if name.endswith((".attn.bias", ".attn.masked_bias")):
+            continue
+        # GPT-2 stores its projections as Conv1D (transposed linear) weights
+        if name.endswith((".c_attn.weight", ".c_proj.weight", ".c_fc.weight")):
+            data = data.T
+        gguf_name = names.get_name(name, try_suffixes=(".weight", ".bias"))
+        writer.add_tensor(gguf_name, np.ascontiguousarray(data, dtype=np.float32))
+
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    return gguf_path
@@ -0,0 +1,1137 @@
+import asyncio, importlib.util, json, os, re, tempfile, threading, time, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from l2p import *
+from l2p.llm.huggingface import _StopOnStrings
+from .local_models import (
+    HAS_LLAMA_CPP,
+    HAS_TRANSFORMERS,
+    build_tiny_gguf,
+    build_tiny_gpt2,
+    write_config,
+)
+from .mock_llm import MockLLM
+
+HAS_OPENAI = all(importlib.util.find_spec(name) for name in ("openai", "tiktoken"))
+
+
+class TestBaseLLM(unittest.TestCase):
+    def setUp(self):
+        self.mock_llm = MockLLM()
+
+    def test_aquery(self):
+        self.mock_llm.output = "### TYPES\n```\n{}\n```"
+
+        async def run():
+            return await asyncio.gather(
+                *(self.mock_llm.aquery(prompt=f"prompt {i}") for i in range(5))
+            )
+
+        outputs = asyncio.run(run())
+        self.assertEqual(outputs, [self.mock_llm.output] * 5)
+
+    def test_query_batch(self):
+        self.mock_llm.output = "### OBJECTS\n```\na - block\n```"
+
+        outputs = self.mock_llm.query_batch(["prompt 1", "prompt 2", "prompt 3"])
+        self.assertEqual(outputs, [self.mock_llm.output] * 3)
+
+    def test_query_stream(self):
+        self.mock_llm.output = "### INITIAL\n```\n(on a b)\n```"
+
+        chunks = list(self.mock_llm.query_stream(prompt="prompt"))
+        self.assertEqual("".join(chunks), self.mock_llm.output)
+
+    def test_query_sections(self):
+        chunks = [
+            "### OBJECTS\n```\na - block\n",
+            "b - block\n```\n",
+            "### GOAL\n```\n(on a b)\n",
+            "```\n",
+            "### EXPLANATION\n",
+            "Block a ends up on block b.",
+        ]
+        consumed = []
+
+        def query_stream(prompt):
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+
+        self.mock_llm.query_stream = query_stream
+
+        llm_output = self.mock_llm.query_sections(
+            prompt="prompt", headings=["OBJECTS", "GOAL"]
+        )
+        self.assertEqual(llm_output, "".join(chunks[:5]))
+        self.assertEqual(len(consumed), 5)
+        self.assertEqual(parse_goal(llm_output), parse_goal("".join(chunks)))
+
+    def test_section_complete(self):
+        # heading words in prose do not start a section
+        llm_output = "### OBJECTS\nWe need a GOAL state later.\n```\na - block\n```"
+        self.assertFalse(is_section_complete(llm_output, "GOAL"))
+        self.assertFalse(is_section_complete(llm_output + "\nGOAL\n### ", "GOAL"))
+
+        # a section can hold several blocks, so it ends at the next heading
+        llm_output = "### INITIAL\n```\n(on a b)\n```\n"
+        self.assertFalse(is_section_complete(llm_output, "INITIAL"))
+        llm_output += "```\n(clear a)\n```\n"
+        self.assertFalse(is_section_complete(llm_output, "INITIAL"))
+        self.assertTrue(is_section_complete(llm_output + "### GOAL\n", "INITIAL"))
+
+
+class TestCachedLLM(unittest.TestCase):
+    def setUp(self):
+        self.mock_llm = MockLLM()
+        self.mock_llm.output = "### GOAL\n```\n(on a b)\n```"
+
+    def test_cache_hit(self):
+        cached_llm = CachedLLM(self.mock_llm)
+
+        first = cached_llm.query(prompt="prompt")
+        self.mock_llm.output = "changed"
+        second = cached_llm.query(prompt="prompt")
+
+        self.assertEqual(first, second)
+        self.assertEqual(cached_llm.get_cache_stats(), {"hits": 1, "misses": 1})
+        self.assertTrue(cached_llm.query_log[-1]["cache_hit"])
+        self.assertEqual(cached_llm.query_log[-1]["total_tokens"], 0)
+
+        # a different prompt is a different request
+        self.assertEqual(cached_llm.query(prompt="other prompt"), "changed")
+
+    def test_grammar_key(self):
+        grammar = SectionGrammar(["GOAL"])
+        key = request_key(self.mock_llm, "prompt")
+
+        # constrained queries never share an entry with unconstrained ones
+        self.assertNotEqual(key, request_key(self.mock_llm, "prompt", grammar=grammar))
+        self.mock_llm.grammar = grammar
+        self.assertNotEqual(key, request_key(self.mock_llm, "prompt"))
+        self.mock_llm.grammar = None
+
+    def test_sampling_parameters_key(self):
+        # every parameter the provider sends is part of the key (i.e. LLAMA_CPP's seed)
+        self.mock_llm.sampling_parameter_names = ("temperature", "do_sample", "seed")
+        self.mock_llm.temperature = 0.0
+        self.mock_llm.do_sample, self.mock_llm.seed = False, 1
+        key = request_key(self.mock_llm, "prompt")
+
+        self.mock_llm.do_sample = True
+        self.assertNotEqual(key, request_key(CachedLLM(self.mock_llm), "prompt"))
+        self.mock_llm.do_sample, self.mock_llm.seed = False, 2
+        self.assertNotEqual(key, request_key(self.mock_llm, "prompt"))
+        self.mock_llm.seed = 1
+        self.assertEqual(key, request_key(CachedLLM(self.mock_llm), "prompt"))
+
+    def test_concurrent_misses(self):
+        class LoggingMockLLM(MockLLM):
+            def __init__(self):
+                super().__init__()
+                self.query_log = QueryLog()
+
+            def query(self, prompt: str):
+                time.sleep(0.01)
+                self.query_log.append({"prompt": prompt, "total_tokens": 1})
+                return prompt
+
+        cached_llm = CachedLLM(LoggingMockLLM())
+        threads = [
+            threading.Thread(target=cached_llm.query, args=(f"prompt {i}",))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # each miss is logged once, by the call that made it
+        prompts = sorted(entry["prompt"] for entry in cached_llm.query_log)
+        self.assertEqual(prompts, sorted(f"prompt {i}" for i in range(8)))
+        self.assertEqual(cached_llm.get_cache_stats(), {"hits": 0, "misses": 8})
+
+    def test_memory_cache_eviction(self):
+        backend = MemoryCache(max_bytes=300)
+        for i in range(10):
+            backend.set(f"key-{i}", {"output": "x" * 50})
+
+        self.assertLessEqual(backend.size, 300)
+        self.assertIsNone(backend.get("key-0"))
+        self.assertEqual(backend.get("key-9"), {"output": "x" * 50})
+
+    def test_persistent_backends(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for backend in (
+                SQLiteCache(os.path.join(tmp_dir, "cache.db")),
+                DirectoryCache(os.path.join(tmp_dir, "cache")),
+            ):
+                CachedLLM(self.mock_llm, backend=backend).query(prompt="prompt")
+
+                # a new wrapper (i.e. a new run) reuses stored responses
+                cached_llm = CachedLLM(MockLLM(), backend=backend)
+                self.assertEqual(
+                    cached_llm.query(prompt="prompt"), self.mock_llm.output
+                )
+                self.assertEqual(cached_llm.hits, 1)
+
+
+class SlowMockLLM(MockLLM):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def query(self, prompt: str):
+        self.calls += 1
+        time.sleep(0.1)
+        return self.output
+
+
+class TestCoalescingLLM(unittest.TestCase):
+    def test_coalesce_threads(self):
+        slow_llm = SlowMockLLM()
+        slow_llm.output = "### PREDICATES\n```\n(on ?a ?b)\n```"
+        coalescing_llm = CoalescingLLM(slow_llm)
+
+        outputs = []
+        threads = [
+            threading.Thread(
+                target=lambda: outputs.append(coalescing_llm.query(prompt="prompt"))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outputs, [slow_llm.output] * 5)
+        self.assertEqual(slow_llm.calls, 1)
+        self.assertEqual(
+            coalescing_llm.get_coalescing_stats(),
+            {"upstream_calls": 1, "suppressed": 4},
+        )
+
+    def test_no_coalesce_when_sampling(self):
+        slow_llm = SlowMockLLM()
+        slow_llm.temperature = 1.0
+        coalescing_llm = CoalescingLLM(slow_llm)
+
+        async def run():
+            return await asyncio.gather(
+                *(coalescing_llm.aquery(prompt="prompt") for _ in range(3))
+            )
+
+        asyncio.run(run())
+        self.assertEqual(slow_llm.calls, 3)
+        self.assertEqual(coalescing_llm.suppressed, 0)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_requests_per_minute(self):
+        rate_limiter = RateLimiter(rpm=2)
+
+        self.assertEqual(rate_limiter.reserve(tokens=100), 0.0)
+        self.assertEqual(rate_limiter.reserve(tokens=100), 0.0)
+        self.assertAlmostEqual(rate_limiter.reserve(tokens=100), 30.0, delta=0.1)
+
+    def test_tokens_per_minute(self):
+        rate_limiter = RateLimiter(tpm=600)
+
+        self.assertEqual(rate_limiter.reserve(tokens=600), 0.0)
+        self.assertAlmostEqual(rate_limiter.reserve(tokens=60), 6.0, delta=0.1)
+
+    def test_shared_per_engine(self):
+        self.assertIsNone(get_rate_limiter("test-engine"))
+        self.assertIs(
+            get_rate_limiter("test-engine", rpm=10),
+            get_rate_limiter("test-engine", rpm=10),
+        )
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.retry_policy = RetryPolicy(base_delay=0.01, jitter=False)
+
+    def test_classify_errors(self):
+        self.assertTrue(self.retry_policy.is_retryable(StatusError(429)))
+        self.assertTrue(self.retry_policy.is_retryable(StatusError(503)))
+        self.assertTrue(self.retry_policy.is_retryable(ConnectionError()))
+        self.assertFalse(self.retry_policy.is_retryable(StatusError(400)))
+        self.assertFalse(self.retry_policy.is_retryable(ValueError()))
+
+        # only transport errors are transient; bugs are never retried
+        self.assertTrue(self.retry_policy.is_retryable(TimeoutError()))
+        self.assertFalse(self.retry_policy.is_retryable(AttributeError()))
+        self.assertFalse(self.retry_policy.is_retryable(RuntimeError()))
+
+    def test_retry_after(self):
+        error = StatusError(429, headers={"retry-after": "7"})
+        self.assertEqual(self.retry_policy.backoff(1, error), 7.0)
+        self.assertEqual(self.retry_policy.backoff(3), 0.04)
+
+        # the server cannot block the caller for longer than max_delay
+        error = StatusError(429, headers={"retry-after": "3600"})
+        self.assertEqual(self.retry_policy.backoff(1, error), self.retry_policy.max_delay)
+
+    def test_call(self):
+        errors = [StatusError(500), StatusError(429)]
+
+        def flaky():
+            if errors:
+                raise errors.pop(0)
+            return "success"
+
+        self.assertEqual(self.retry_policy.call(flaky), "success")
+
+        # fatal errors are raised immediately
+        errors = [StatusError(400), StatusError(500)]
+        with self.assertRaises(StatusError):
+            self.retry_policy.call(flaky)
+        self.assertEqual(len(errors), 1)
+
+    def test_retry_budget(self):
+        retry_policy = RetryPolicy(retry_budget=2)
+        self.assertTrue(retry_policy.allow_retry("site"))
+        self.assertTrue(retry_policy.allow_retry("site"))
+        self.assertFalse(retry_policy.allow_retry("site"))
+        self.assertTrue(retry_policy.allow_retry("other site"))
+
+
+class StubCompletionsHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible `/v1/chat/completions` endpoint."""
+
+    protocol_version = "HTTP/1.1"
+    delays = []  # seconds before answering the next requests
+    statuses = []  # error status codes of the next responses
+    bodies = []  # bodies of the requests received
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.bodies.append(body)
+        if self.statuses:
+            data = json.dumps({"error": {"message": "stub error"}}).encode()
+            self.send_response(self.statuses.pop(0))
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if self.delays:
+            time.sleep(self.delays.pop(0))
+        text = "### GOAL\n```\n(on a b)\n```"
+        usage = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+
+        if not body.get("stream"):
+            choices = [{"message": {"role": "assistant", "content": text}}]
+            data = json.dumps({"choices": choices, "usage": usage}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        events = [
+            {"choices": [{"delta": {"content": text[i : i + 4]}}]}
+            for i in range(0, len(text), 4)
+        ]
+        events.append({"choices": [], "usage": usage})
+        data = "".join(f"data: {json.dumps(e)}\n\n" for e in events)
+        data = (data + "data: [DONE]\n\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # request was cancelled
+
+
+class TestVLLMServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubCompletionsHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/v1"
+
+    @classmethod
+    def tearDownClass(cls):
+        get_connection_pool(cls.base_url).close()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.llm = VLLMServer(model="gpt2", base_url=self.base_url, max_connections=4)
+
+    def test_query(self):
+        self.assertEqual(self.llm.query("prompt"), "### GOAL\n```\n(on a b)\n```")
+        self.assertEqual(self.llm.get_tokens(), (10, 5))
+
+        # the server applies the chat template
+        messages = StubCompletionsHandler.bodies[-1]["messages"]
+        self.assertEqual(messages[-1], {"role": "user", "content": "prompt"})
+
+    def test_query_stream(self):
+        chunks = list(self.llm.query_stream("prompt"))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), "### GOAL\n```\n(on a b)\n```")
+        self.assertEqual(self.llm.query_log[-1]["total_tokens"], 15)
+
+    def test_unknown_model(self):
+        with self.assertRaises(ValueError):
+            VLLMServer(model="no-such-model", base_url=self.base_url)
+
+        # any model the server serves can be named explicitly
+        llm = VLLMServer(
+            model="no-such-model", base_url=self.base_url, served_model="my-model"
+        )
+        llm.query("prompt")
+        self.assertEqual(StubCompletionsHandler.bodies[-1]["model"], "my-model")
+
+    def test_stream_closed_early(self):
+        self.llm.token_counter = TokenCounter(str.split)
+        chunks = self.llm.query_stream("prompt")
+        next(chunks)
+        chunks.close()
+
+        # the server reports no usage, so tokens are counted locally
+        entry = self.llm.query_log[-1]
+        self.assertEqual(
+            entry["prompt_tokens"],
+            TokenCounter(str.split).count_messages(entry["messages"]),
+        )
+        self.assertEqual(entry["completion_tokens"], 1)
+
+    def test_grammar(self):
+        grammar = SectionGrammar(["GOAL"])
+        self.llm.query("prompt", grammar=grammar)
+        self.assertEqual(StubCompletionsHandler.bodies[-1]["guided_regex"], grammar.to_regex())
+
+        self.llm.query("prompt")
+        self.assertNotIn("guided_regex", StubCompletionsHandler.bodies[-1])
+
+    def test_connections_reused(self):
+        pool = get_connection_pool(self.base_url)
+        opened = pool.connections_opened
+
+        outputs = self.llm.query_batch([f"prompt {i}" for i in range(20)])
+        for _ in range(5):
+            self.llm.query("prompt")
+
+        self.assertEqual(len(outputs), 20)
+        self.assertLessEqual(pool.connections_opened - opened, 4)
+
+    def test_hedged_query(self):
+        hedging = HedgePolicy(min_delay=0.05, min_samples=2)
+        llm = VLLMServer(model="gpt2", base_url=self.base_url, max_connections=4, hedging=hedging)
+        llm.query("prompt")
+        llm.query("prompt")
+        # no duplicate can be sent yet, so requests are not streamed
+        self.assertNotIn("stream", StubCompletionsHandler.bodies[-1])
+
+        StubCompletionsHandler.delays = [1.0]
+        started = time.perf_counter()
+        self.assertEqual(llm.query("prompt"), "### GOAL\n```\n(on a b)\n```")
+        self.assertLess(time.perf_counter() - started, 0.9)
+        self.assertEqual((hedging.hedges, hedging.wins), (1, 1))
+        # the cancelled request may be logged after the winner
+        winner = [e for e in llm.query_log if e.get("cancelled") is False][-1]
+        self.assertEqual(winner["hedge_attempt"], 1)
+        self.assertEqual(llm.get_metrics()["l2p_llm_hedge_wins_total"][0]["value"], 1)
+
+
+@unittest.skipUnless(HAS_OPENAI, "requires openai and tiktoken")
+class TestOPENAI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        try:
+            get_encoding("cl100k_base")
+        except Exception as e:
+            raise unittest.SkipTest(f"cl100k_base encoding is not available: {e}")
+
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubCompletionsHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/v1"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        retry_policy = RetryPolicy(max_attempts=2, base_delay=0.01)
+        self.llm = OPENAI(
+            model="gpt-4o-mini",
+            api_key="key",
+            base_url=self.base_url,
+            retry_policy=retry_policy,
+        )
+
+    def test_query(self):
+        self.assertEqual(self.llm.query("prompt"), "### GOAL\n```\n(on a b)\n```")
+        self.assertEqual(self.llm.get_tokens(), (10, 5))
+
+    def test_aquery(self):
+        self.assertEqual(
+            asyncio.run(self.llm.aquery("prompt")), "### GOAL\n```\n(on a b)\n```"
+        )
+        self.assertEqual(self.llm.get_tokens(), (10, 5))
+
+    def test_query_stream(self):
+        chunks = list(self.llm.query_stream("prompt"))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), "### GOAL\n```\n(on a b)\n```")
+        self.assertEqual(
+            StubCompletionsHandler.bodies[-1]["stream_options"], {"include_usage": True}
+        )
+        self.assertEqual(self.llm.query_log[-1]["total_tokens"], 15)
+
+    def test_errors(self):
+        # transient errors are retried
+        StubCompletionsHandler.statuses = [503]
+        self.assertEqual(self.llm.query("prompt"), "### GOAL\n```\n(on a b)\n```")
+
+        # and raised as ConnectionError once attempts run out
+        StubCompletionsHandler.statuses = [503, 503]
+        with self.assertRaises(ConnectionError):
+            self.llm.query("prompt")
+
+        # requests which can never succeed are raised at once
+        StubCompletionsHandler.statuses = [400, 400]
+        with self.assertRaises(Exception) as context:
+            self.llm.query("prompt")
+        self.assertNotIsInstance(context.exception, ConnectionError)
+        self.assertEqual(StubCompletionsHandler.statuses, [400])
+        StubCompletionsHandler.statuses = []
+
+    def test_hedged_query(self):
+        hedging = HedgePolicy(min_delay=0.05, min_samples=2)
+        llm = OPENAI(
+            model="gpt-4o-mini", api_key="key", base_url=self.base_url, hedging=hedging
+        )
+        llm.query("prompt")
+        llm.query("prompt")
+
+        StubCompletionsHandler.delays = [1.0]
+        started = time.perf_counter()
+        self.assertEqual(llm.query("prompt"), "### GOAL\n```\n(on a b)\n```")
+        self.assertLess(time.perf_counter() - started, 0.9)
+        self.assertEqual((hedging.hedges, hedging.wins), (1, 1))
+        self.assertTrue(StubCompletionsHandler.bodies[-1]["stream"])
+        winner = [e for e in llm.query_log if e.get("cancelled") is False][-1]
+        self.assertEqual(winner["hedge_attempt"], 1)
+
+
+class TestSectionGrammar(unittest.TestCase):
+    def setUp(self):
+        self.grammar = SectionGrammar(["Action Parameters", "Action Preconditions"])
+        self.valid = (
+            "The block must be clear.\n"
+            "### Action Parameters\n```\n- ?b - block: the block\n```\n\n"
+            "### Action Preconditions\n```\n(and\n    (clear ?b) ; (comment\n)\n```\n"
+        )
+
+    def test_step(self):
+        state = self.grammar.step(self.grammar.start(), self.valid)
+        self.assertTrue(self.grammar.is_complete(state))
+
+        invalid = [
+            "### Action Preconditions\n```\n",  # wrong heading order
+            "### Action Parameters\n- ?b - block\n",  # missing fence
+            "### Action Parameters\n```\n(and (clear ?b)\n```",  # unbalanced
+            "### Action Parameters\n```\n)",  # unbalanced
+        ]
+        for text in invalid:
+            self.assertIsNone(self.grammar.step(self.grammar.start(), text))
+
+    def test_regex(self):
+        regex = re.compile(self.grammar.to_regex())
+        self.assertTrue(regex.fullmatch(self.valid))
+        self.assertFalse(regex.fullmatch(self.valid.replace("(clear ?b)", "(clear ?b")))
+
+    def test_completion(self):
+        state = self.grammar.step(
+            self.grammar.start(), "### Action Parameters\n```\n(and (on ?a"
+        )
+        completion = self.grammar.completion(state)
+        self.assertTrue(self.grammar.is_complete(self.grammar.step(state, completion)))
+
+
+class TestModelRegistry(unittest.TestCase):
+    def test_shared_and_refcounted(self):
+        registry = ModelRegistry()
+        loads = []
+
+        def loader():
+            loads.append(1)
+            time.sleep(0.05)
+            return object()
+
+        values = []
+        threads = [
+            threading.Thread(target=lambda: values.append(registry.acquire("key", loader)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertTrue(all(value is values[0] for value in values))
+        self.assertEqual(registry.refcount("key"), 4)
+
+        for _ in range(3):
+            self.assertFalse(registry.release("key"))
+        self.assertTrue(registry.release("key"))
+        self.assertEqual(registry.keys(), [])
+
+    def test_failed_load(self):
+        registry = ModelRegistry()
+
+        def loader():
+            raise OSError("missing weights")
+
+        with self.assertRaises(OSError):
+            registry.acquire("key", loader)
+        self.assertEqual(registry.acquire("key", lambda: "model"), "model")
+
+
+class TestModelLoader(unittest.TestCase):
+    def test_background(self):
+        loaded = threading.Event()
+        loader = ModelLoader(lambda: (time.sleep(0.1), loaded.set()))
+
+        loader.start(background=True)
+        self.assertFalse(loader.ready())
+        self.assertFalse(loader.wait(timeout=0.01))
+        self.assertTrue(loader.wait())
+        self.assertTrue(loader.ready() and loaded.is_set())
+
+    def test_on_demand(self):
+        calls = []
+        loader = ModelLoader(lambda: calls.append(1))
+
+        self.assertFalse(loader.started)
+        loader.ensure()
+        loader.ensure()
+        self.assertEqual(calls, [1])
+
+    def test_error(self):
+        def load():
+            raise OSError("missing weights")
+
+        loader = ModelLoader(load)
+        loader.start(background=True)
+        with self.assertRaises(RuntimeError):
+            loader.wait()
+        self.assertFalse(loader.ready())
+
+
+@unittest.skipUnless(HAS_TRANSFORMERS, "requires torch and transformers")
+class TestHuggingFace(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.model_path = os.path.join(cls.tmp.name, "tiny-gpt2")
+        build_tiny_gpt2(cls.model_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def load(self, name="tiny", model_config=None, model_params=None):
+        config_dir = tempfile.mkdtemp(dir=self.tmp.name)
+        config_path = write_config(
+            config_dir, "huggingface", name, model_config, model_params
+        )
+        llm = HUGGING_FACE(name, self.model_path, config_path=config_path)
+        self.addCleanup(llm.unload)
+        return llm
+
+    def test_prefix_cache(self):
+        llm = self.load()
+        prefix = "You are a PDDL expert. " * 4
+        prompts = [prefix + "Define the blocksworld domain.", prefix + "(define"]
+        expected = [llm.query(prompt) for prompt in prompts]
+
+        self.assertGreater(llm.register_prefix(prefix), 0)
+        self.assertEqual([llm.query(prompt) for prompt in prompts], expected)
+        self.assertEqual(llm.prefix_hits, 2)
+
+        # prompts without the prefix are prefilled in full
+        llm.query("Define the blocksworld domain.")
+        self.assertEqual(llm.prefix_hits, 2)
+
+        llm.unload()
+        self.assertEqual(len(llm._prefix_cache), 0)
+
+        # the static KV cache of compiled decoding cannot reuse prefixes
+        llm = self.load("tiny-compile", model_config={"compile": True})
+        self.assertEqual(llm.register_prefix(prefix), 0)
+        self.assertEqual(len(llm._prefix_cache), 0)
+
+    def test_stop_string(self):
+        full_output = self.load().query("(define")
+        stop = full_output[2:5]
+
+        llm = self.load("tiny-stop", model_params={"stop": stop})
+        self.assertEqual(llm.query("(define"), full_output.split(stop)[0])
+        self.assertEqual("".join(llm.query_stream("(define")), full_output.split(stop)[0])
+
+        # decoding halts once the stop string is produced, not at max_new_tokens
+        self.assertLess(llm.query_log[0]["completion_tokens"], llm.max_new_tokens)
+
+        # only the newest tokens are decoded at each step
+        stop_on_strings = _StopOnStrings(llm.tokenizer, [stop], prompt_length=1)
+        ids = llm.tokenizer(["(" + full_output[:5]], return_tensors="pt")["input_ids"]
+        self.assertTrue(stop_on_strings(ids, None).all())
+        self.assertFalse(stop_on_strings(ids[:, :1], None).any())
+
+    def test_grammar(self):
+        llm = self.load(model_params={"max_new_tokens": 48})
+        grammar = SectionGrammar(["GOAL"], allow_preamble=False)
+
+        # decoding only produces text the grammar accepts, and completes it in time
+        for llm_output in (
+            llm.query("(define", grammar=grammar),
+            llm.query_batch(["(define", "Define the goal."], grammar=grammar)[1],
+        ):
+            self.assertTrue(llm_output.startswith("### GOAL\n"))
+            state = grammar.step(grammar.start(), llm_output)
+            self.assertTrue(grammar.is_complete(state), llm_output)
+
+        self.assertNotEqual(llm.query("(define"), llm.query("(define", grammar=grammar))
+
+    def test_mmap_loading(self):
+        mapped = self.load(model_config={"mmap": True})
+        copied = self.load(model_config={"mmap": False})
+
+        # a different loading mode never reuses an already loaded model
+        self.assertIsNot(mapped.llm, copied.llm)
+        self.assertIn("load_time_s", mapped.load_stats)
+        self.assertIn("load_time_s", copied.load_stats)
+
+        # weights mapped from the safetensors file match a regular load
+        model = mapped._load_model_mmap()
+        self.assertIsNotNone(model)
+        for (name, a), (_, b) in zip(
+            model.state_dict().items(), copied.llm.state_dict().items()
+        ):
+            self.assertTrue(a.equal(b), name)
+        self.assertEqual(mapped.query("(define"), copied.query("(define"))
+
+        # instances sharing a model report the stats of its load
+        shared = self.load(model_config={"mmap": True})
+        self.assertIs(shared.llm, mapped.llm)
+        self.assertEqual(shared.load_stats, mapped.load_stats)
+
+    def test_cpu_int8(self):
+        import torch
+
+        llm = self.load(model_config={"cpu_quantization": "int8", "mmap": True})
+
+        # quantizing needs float32 weights in RAM, so they are not memory-mapped
+        self.assertFalse(llm.mmap)
+        self.assertEqual(llm.dtype, torch.float32)
+        self.assertTrue(
+            any(
+                isinstance(module, torch.ao.nn.quantized.dynamic.Linear)
+                for module in llm.llm.modules()
+            )
+        )
+        llm.query("(define")
+        self.assertGreater(llm.query_log[-1]["completion_tokens"], 0)
+
+
+@unittest.skipUnless(HAS_LLAMA_CPP, "requires llama-cpp-python and gguf")
+class TestLlamaCpp(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        build_tiny_gpt2(cls.tmp.name)
+        cls.model_path = build_tiny_gguf(cls.tmp.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def load(self, model_config=None):
+        config_dir = tempfile.mkdtemp(dir=self.tmp.name)
+        config_path = write_config(
+            config_dir, "llama_cpp", "tiny", {"num_threads": 1, **(model_config or {})}
+        )
+        llm = LLAMA_CPP("tiny", self.model_path, config_path=config_path)
+        self.addCleanup(llm.unload)
+        return llm
+
+    def test_query(self):
+        llm = self.load()
+
+        llm_output = llm.query("(define")
+        self.assertEqual("".join(llm.query_stream("(define")), llm_output)
+        self.assertEqual(llm.query_log[-1]["output"], llm_output)
+        self.assertGreater(llm.get_tokens()[1], 0)
+
+        # the model is loaded again after being unloaded
+        llm.unload()
+        self.assertIsNone(llm.llm)
+        self.assertEqual(llm.query("(define"), llm_output)
+
+    def test_prefix(self):
+        llm = self.load()
+        prefix = "You are a PDDL expert. " * 4
+        prompt = prefix + "Define the blocksworld domain."
+        expected = llm.query(prompt)
+
+        self.assertGreater(llm.register_prefix(prefix), 0)
+        llm.query("(define")  # replaces the evaluated tokens
+        self.assertEqual(llm.query(prompt), expected)
+        self.assertEqual(llm.prefix_hits, 1)
+
+    def test_model_key(self):
+        mapped = self.load()
+        self.assertIs(self.load().llm, mapped.llm)
+
+        # a different loading mode never reuses an already loaded model
+        self.assertIsNot(self.load({"mmap": False}).llm, mapped.llm)
+        self.assertIsNot(self.load({"mlock": True}).llm, mapped.llm)
+
+
+class TestChatTemplate(unittest.TestCase):
+    @staticmethod
+    def tokenize(text, special):
+        # one token per character; BOS (0) is added with special tokens
+        return ([0] if special else []) + [ord(c) for c in text]
+
+    def test_legacy_template(self):
+        template = ChatTemplate("meta-llama/Llama-2-7b-chat-hf", tokenize=self.tokenize)
+        full_prompt = template.render("System.", "Hello")
+        self.assertEqual(full_prompt, "<<SYS>>\nSystem.\n<</SYS>>\n[INST]Hello[/INST]")
+
+        full_prompt, input_ids = template.encode("System.", "Hello")
+        self.assertEqual(input_ids, self.tokenize(full_prompt, True))
+
+    def test_native_template(self):
+        calls = []
+
+        def apply_chat_template(messages):
+            calls.append(messages)
+            text = "".join(f"<{m['role']}>{m['content']}</{m['role']}>" for m in messages)
+            return "<s>" + text + "<assistant>"
+
+        template = ChatTemplate(
+            "meta-llama/Llama-2-7b-chat-hf",
+            apply_chat_template=apply_chat_template,
+            tokenize=self.tokenize,
+            bos_token="<s>",
+        )
+        self.assertTrue(template.native)
+
+        for prompt in ["Hello", "(define (domain x))"]:
+            full_prompt, input_ids = template.encode("System.", prompt)
+            self.assertEqual(
+                full_prompt,
+                f"<s><system>System.</system><user>{prompt}</user><assistant>",
+            )
+            # the template already starts with BOS, so it is not added again
+            self.assertEqual(input_ids, self.tokenize(full_prompt, False))
+
+        # rendered once at construction and once for the system prompt
+        self.assertEqual(len(calls), 2)
+
+    def test_native_template_without_system_role(self):
+        def apply_chat_template(messages):
+            if messages[0]["role"] == "system":
+                raise ValueError("System role not supported")
+            return f"[INST]{messages[0]['content']}[/INST]"
+
+        template = ChatTemplate("model", apply_chat_template=apply_chat_template)
+        self.assertEqual(template.render("System.", "Hello"), "[INST]System.\n\nHello[/INST]")
+
+
+class TestTokenCounter(unittest.TestCase):
+    def test_memoized(self):
+        calls = []
+
+        def encode(text):
+            calls.append(text)
+            return text.split()
+
+        counter = TokenCounter(encode, cache_size=2)
+        messages = [
+            {"role": "system", "content": "You are a PDDL expert."},
+            {"role": "user", "content": "Define the domain."},
+        ]
+        self.assertEqual(counter.count_messages(messages), 8)
+        self.assertEqual(counter.count_messages(messages), 8)
+        self.assertEqual((counter.hits, counter.misses), (2, 2))
+        self.assertEqual(len(calls), 2)
+
+        # uncached texts are counted every time, and evicted texts again
+        counter.count("output text", cache=False)
+        counter.count("a b c")
+        counter.count("You are a PDDL expert.")
+        self.assertEqual(len(calls), 5)
+
+    def test_usage_counts(self):
+        class Usage:
+            prompt_tokens = 10
+            completion_tokens = 5
+
+        self.assertEqual(usage_counts(Usage()), (10, 5))
+        self.assertEqual(usage_counts({"prompt_tokens": 3, "completion_tokens": 4}), (3, 4))
+        self.assertIsNone(usage_counts(None))
+        self.assertIsNone(usage_counts({"prompt_tokens": 3}))
+
+
+class TestQueryLog(unittest.TestCase):
+    def test_ring_buffer(self):
+        log = QueryLog(maxlen=3, retention="metadata")
+        for i in range(5):
+            log.append({"prompt": f"prompt {i}", "output": "out", "prompt_tokens": i})
+
+        self.assertEqual(len(log), 3)
+        self.assertEqual(log.total, 5)
+        self.assertEqual(log[-1], {"prompt_tokens": 4})
+        self.assertEqual([e["prompt_tokens"] for e in log.since(3)], [3, 4])
+        # evicted entries are no longer available in memory
+        self.assertEqual(len(log.since(0)), 3)
+
+    def test_spill_history(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "queries.jsonl.gz")
+            log = QueryLog(maxlen=2, path=path, retention="metadata")
+            for i in range(5):
+                log.append({"prompt": f"prompt {i}", "output": "out", "prompt_tokens": i})
+
+            history = list(log.history())
+            self.assertEqual([e["prompt_tokens"] for e in history], list(range(5)))
+            self.assertEqual(history[0]["prompt"], "prompt 0")
+            self.assertEqual(len(log), 2)
+
+        with self.assertRaises(ValueError):
+            QueryLog.from_config({"retention": "none"})
+
+
+class TestUsageScope(unittest.TestCase):
+    def test_concurrent_scopes(self):
+        meter = UsageMeter()
+        results = {}
+
+        def request(n):
+            with usage_scope() as usage:
+                for _ in range(n):
+                    meter.record(10, 1, cost_usd=0.5)
+                    time.sleep(0.001)
+            results[n] = usage.get_tokens()
+
+        threads = [threading.Thread(target=request, args=(n,)) for n in (5, 20, 50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {n: (10 * n, n) for n in (5, 20, 50)})
+        self.assertEqual(meter.get_tokens(), (750, 75))
+        self.assertEqual(meter.queries, 75)
+
+    def test_nested_and_pooled(self):
+        meter = UsageMeter()
+        with usage_scope() as outer:
+            meter.record(1, 1)
+            with usage_scope() as inner:
+                record = in_context(lambda _: meter.record(2, 2))
+                worker = threading.Thread(target=record, args=(None,))
+                worker.start()
+                worker.join()
+        meter.record(4, 4)  # outside of any scope
+
+        self.assertEqual(inner.get_tokens(), (2, 2))
+        self.assertEqual(outer.get_tokens(), (3, 3))
+        self.assertEqual(meter.get_tokens(), (7, 7))
+        self.assertGreaterEqual(outer.elapsed_s, inner.elapsed_s)
+
+
+class TestMetrics(unittest.TestCase):
+    class TimedLLM(MockLLM):
+        provider = "mock"
+        model_engine = "timed"
+
+        def __init__(self):
+            super().__init__()
+            self.failures = 1
+
+        def _attempt(self):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("dropped")
+            record_wait(0.5)
+            record_output_tokens(4)
+            return "done"
+
+        @measured
+        def query(self, prompt: str):
+            return RetryPolicy(base_delay=0, jitter=False).call(self._attempt)
+
+        @measured
+        def query_stream(self, prompt: str, **kwargs):
+            yield "a"
+            yield self.query(prompt)  # nested query is part of the stream
+
+    def setUp(self):
+        metrics_registry.reset()
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(1, 2))
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative_buckets(), [(1, 1), (2, 3), (float("inf"), 4)])
+        self.assertEqual(histogram.percentile(0.5), 1.5)
+        self.assertEqual(histogram.percentile(1.0), 3)
+
+    def test_query_metrics(self):
+        llm = self.TimedLLM()
+        self.assertEqual(llm.query("x"), "done")
+        self.assertEqual("".join(llm.query_stream("x")), "adone")
+
+        metrics = llm.get_metrics()
+        self.assertEqual(metrics["l2p_llm_requests_total"][0]["value"], 2)
+        self.assertEqual(metrics["l2p_llm_retries_total"][0]["value"], 1)
+        self.assertEqual(metrics["l2p_llm_output_tokens_total"][0]["value"], 8)
+        self.assertEqual(metrics["l2p_llm_wait_seconds"][0]["sum"], 1.0)
+        self.assertEqual(metrics["l2p_llm_time_to_first_token_seconds"][0]["count"], 1)
+
+        text = metrics_registry.to_prometheus()
+        self.assertIn('l2p_llm_requests_total{engine="timed",provider="mock"} 2', text)
+        self.assertIn('l2p_llm_request_seconds_bucket{engine="timed",provider="mock",le="+Inf"} 2', text)
+        self.assertEqual(json.loads(metrics_registry.to_json()).keys(), metrics.keys())
+
+    def test_errors(self):
+        llm = self.TimedLLM()
+        llm.failures = 5
+        with self.assertRaises(ConnectionError):
+            llm.query("x")
+        metrics = llm.get_metrics()
+        self.assertEqual(metrics["l2p_llm_errors_total"][0]["value"], 1)
+        self.assertNotIn("l2p_llm_request_seconds", metrics)
+
+
+class TestRouterLLM(unittest.TestCase):
+    class Backend(MockLLM):
+        def __init__(self, output, delay=0.0, error=None):
+            super().__init__()
+            self.output, self.delay, self.error = output, delay, error
+            self.calls = 0
+
+        def query(self, prompt: str, **kwargs):
+            self.calls += 1
+            time.sleep(self.delay)
+            if self.error:
+                raise self.error
+            return self.output
+
+    def test_failover(self):
+        down = self.Backend("a", error=ConnectionError("refused"))
+        up = self.Backend("b")
+        router = RouterLLM({"down": down, "up": up}, cooldown=60)
+
+        self.assertEqual(router.query("x"), "b")
+        self.assertEqual(router.query("x"), "b")
+        # the failed backend cools down instead of being retried on every query
+        self.assertEqual((down.calls, up.calls), (1, 2))
+        self.assertEqual(router.failovers, 1)
+        self.assertFalse(router.get_backend_stats()[0]["healthy"])
+
+        up.error = ConnectionError("refused")
+        with self.assertRaises(ConnectionError):
+            router.query("x")
+
+    def test_backends_fail_fast(self):
+        class Backend(self.Backend):
+            def query(self, prompt: str, end_when_error: bool = False):
+                self.end_when_error = end_when_error
+                return super().query(prompt)
+
+        down = Backend("a", error=ConnectionError("refused"))
+        up = Backend("b")
+        router = RouterLLM([down, up])
+
+        # only the last backend tried keeps its own retries
+        self.assertEqual(router.query("x"), "b")
+        self.assertEqual((down.end_when_error, up.end_when_error), (True, False))
+
+    def test_fatal_error_not_failed_over(self):
+        bad = self.Backend("a", error=ValueError("prompt too long"))
+        other = self.Backend("b")
+        router = RouterLLM([bad, other])
+        with self.assertRaises(ValueError):
+            router.query("x")
+        self.assertEqual(other.calls, 0)
+
+    def test_latency_and_load(self):
+        slow = self.Backend("slow", delay=0.05)
+        fast = self.Backend("fast", delay=0.02)
+        router = RouterLLM({"slow": slow, "fast": fast})
+
+        router.query("x")  # tries "slow" first, in order of preference
+        router.query("x")  # then "fast", which has no latency yet
+        self.assertEqual(router.query_batch(["x"] * 4, max_workers=1), ["fast"] * 4)
+
+        # queries spread over both backends once "fast" is busy
+        outputs = router.query_batch(["x"] * 12, max_workers=12)
+        self.assertIn("slow", outputs)
+        self.assertEqual(sum(b["in_flight"] for b in router.get_backend_stats()), 0)
+
+
+class TestHedgePolicy(unittest.TestCase):
+    def test_hedges_slow_request(self):
+        policy = HedgePolicy(min_delay=0.05, min_samples=1)
+        cancelled = threading.Event()
+
+        def slow(attempt):
+            attempt.on_cancel(cancelled.set)
+            attempt.cancelled.wait(2)
+            return "slow"
+
+        # no hedging until enough latencies are known; the unhedged request is used
+        requests = [lambda attempt: "hedged"]
+        self.assertEqual(policy.call(requests, unhedged=lambda: "warmup"), "warmup")
+        self.assertEqual(policy.hedges, 0)
+
+        started = time.perf_counter()
+        self.assertEqual(policy.call([slow, lambda attempt: "fast"]), "fast")
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertTrue(cancelled.wait(1))
+        self.assertEqual((policy.hedges, policy.wins), (1, 1))
+        # the latency seen by the caller includes the hedging delay
+        self.assertGreaterEqual(policy.latency.percentile(1.0), 0.05)
+
+    def test_errors(self):
+        policy = HedgePolicy(min_delay=0.01, min_samples=0)
+
+        def fail(attempt):
+            time.sleep(0.05)
+            raise ConnectionError("dropped")
+
+        # a failed request waits for its duplicate
+        self.assertEqual(policy.call([fail, lambda attempt: "ok"]), "ok")
+        with self.assertRaises(ConnectionError):
+            policy.call([fail])
+        with self.assertRaises(ValueError):
+            HedgePolicy(percentile=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
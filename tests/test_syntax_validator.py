@@ -1772,5 +1772,66 @@ class TestSyntaxValidator(unittest.TestCase):
         self.assertEqual(flag, False)
 
 
+    def test_validate_stream(self):
+
+        self.syntax_validator.headers = [
+            "Action Parameters",
+            "Action Preconditions",
+            "Action Effects",
+        ]
+        self.syntax_validator.error_types = [
+            "validate_header",
+            "validate_unsupported_keywords",
+            "validate_params",
+            "validate_usage_action",
+        ]
+
+        predicates = [
+            Predicate(
+                {
+                    "name": "clear",
+                    "desc": "true if a block does not have anything on top of it",
+                    "raw": "(clear ?b - block): true if a block does not have anything on top of it",
+                    "params": OrderedDict([("?b", "block")]),
+                    "clean": "(clear ?b - block)",
+                }
+            ),
+        ]
+        types = {"block": "block that can be stacked and unstacked"}
+
+        chunks = [
+            "### Action Parameters\n```\n- ?b - block: the block\n```\n\n",
+            "### Action Preconditions\n```\n(and (clear ?b) (holding ?b))\n```\n\n",
+            "### Action Effects\n",
+            "```\n(not (clear ?b))\n```\n",
+        ]
+        consumed = []
+
+        def stream():
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+
+        # case 1: undefined predicate aborts the stream once the next section starts,
+        # before effects are generated
+        llm_output, (flag, _) = self.syntax_validator.validate_stream(
+            stream(), types=types, predicates=predicates
+        )
+
+        self.assertEqual(flag, False)
+        self.assertEqual(len(consumed), 3)
+        self.assertEqual(llm_output, "".join(chunks[:3]))
+
+        # case 2: valid response passes once fully streamed
+        chunks[1] = "### Action Preconditions\n```\n(clear ?b)\n```\n\n"
+        consumed.clear()
+        llm_output, (flag, _) = self.syntax_validator.validate_stream(
+            stream(), types=types, predicates=predicates
+        )
+
+        self.assertEqual(flag, True)
+        self.assertEqual(llm_output, "".join(chunks))
+
+
 if __name__ == "__main__":
     unittest.main()